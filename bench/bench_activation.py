@@ -0,0 +1,148 @@
+"""Compare edges per second for the explicit-stack activate() and poison()
+against the recursive closures they replaced.
+
+Each literal node is walked from a fresh root state, as augment() would for a
+single step. A deep chain graph shows the cost per level, which the recursive
+walk can't handle at all past the recursion limit.
+
+Usage: python bench/bench_activation.py [RULES...]
+"""
+
+import io
+import sys
+import time
+
+from ccs.compiled import NodeArray, activate, poison
+from ccs.dag import Dag, Key, OrNode, add_literal
+from ccs.search_state import Context
+
+from synth import synthetic_ccs
+
+
+def recursive_activate(graph, tallies, or_specificities, starts, fired):
+    """The recursive closures from Context._augment, as they were."""
+    is_and = graph.is_and
+    spec_ids = graph.spec_ids
+    specificities = graph.specificities
+    child_ids, child_offsets = graph.child_ids, graph.child_offsets
+    prop_offsets = graph.prop_offsets
+    constraint_offsets = graph.constraint_offsets
+    edges = 0
+
+    def accum_tally(n):
+        count = tallies[n]
+        if count > 0:
+            count -= 1
+            tallies[n] = count
+            if count == 0:
+                return True
+        return False
+
+    def activate_and(n, propagated_spec):
+        if accum_tally(n):
+            return spec_ids[n]
+        return None
+
+    def activate_or(n, propagated_spec):
+        prev_spec = or_specificities[n]
+        if propagated_spec is None:
+            return prev_spec
+        if specificities[propagated_spec] > specificities[prev_spec]:
+            or_specificities[n] = propagated_spec
+            return propagated_spec
+        return None
+
+    def walk(n, propagated_spec=None):
+        nonlocal edges
+        activator = activate_and if is_and[n] else activate_or
+        activation_spec = activator(n, propagated_spec)
+        if activation_spec is not None:
+            if (
+                prop_offsets[n] != prop_offsets[n + 1]
+                or constraint_offsets[n] != constraint_offsets[n + 1]
+            ):
+                fired.append((n, activation_spec))
+            edges += child_offsets[n + 1] - child_offsets[n]
+            for i in range(child_offsets[n], child_offsets[n + 1]):
+                walk(child_ids[i], activation_spec)
+
+    for n in starts:
+        walk(n)
+    return edges
+
+
+def recursive_poison(graph, tallies, or_tallies, poisoned, starts):
+    is_and = graph.is_and
+    child_ids, child_offsets = graph.child_ids, graph.child_offsets
+    edges = 0
+
+    def walk(n):
+        nonlocal edges
+        fully_poisoned = False
+        if is_and[n]:
+            if tallies[n] != 0 and not poisoned[n]:
+                fully_poisoned = True
+        else:
+            count = or_tallies[n]
+            if count > 0:
+                or_tallies[n] = count - 1
+                fully_poisoned = count == 1
+        if fully_poisoned:
+            poisoned[n] = 1
+            edges += child_offsets[n + 1] - child_offsets[n]
+            for i in range(child_offsets[n], child_offsets[n + 1]):
+                walk(child_ids[i])
+
+    for n in starts:
+        walk(n)
+    return edges
+
+
+def literal_starts(graph):
+    return [
+        list(graph.literal_nodes(ids))
+        for matcher in graph.children.values()
+        for ids in matcher.positive_values.values()
+    ]
+
+
+def edges_per_sec(graph, root, starts, activate_fn, poison_fn):
+    edges = 0
+    start = time.perf_counter()
+    for nodes in starts:
+        tallies = root.tallies.evolver()
+        fired = []
+        edges += activate_fn(graph, tallies, root.or_specificities.evolver(), nodes, fired)
+        edges += poison_fn(graph, tallies, tallies, NodeArray.zeros(len(graph)).evolver(), nodes)
+    return edges / (time.perf_counter() - start)
+
+
+def chain_dag(depth):
+    dag = Dag()
+    node = add_literal(dag, Key("a", {"x"}))
+    for _ in range(depth):
+        child = OrNode()
+        child.add_link()
+        node.children.append(child)
+        node = child
+    return dag
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [1000, 10000]
+    graphs = [
+        (f"{rules} rules", Context.from_ccs_stream(io.StringIO(synthetic_ccs(rules)), "-"))
+        for rules in sizes
+    ]
+    graphs.append(("chain 900", Context(chain_dag(900))))
+    print(f"{'graph':>12} {'stack (Medges/s)':>17} {'recursive (Medges/s)':>21}")
+    for name, root in graphs:
+        graph = root.graph
+        starts = literal_starts(graph) * 20
+        stack = edges_per_sec(graph, root, starts, activate, poison)
+        recursive = edges_per_sec(graph, root, starts, recursive_activate, recursive_poison)
+        print(f"{name:>12} {stack / 1e6:>17.2f} {recursive / 1e6:>21.2f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
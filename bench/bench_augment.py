@@ -0,0 +1,57 @@
+"""Time augment chains on synthetic configurations, one step at a time and batched.
+
+Usage: python bench/bench_augment.py [RULES...]
+"""
+
+import io
+import random
+import sys
+import time
+
+from ccs.search_state import Context
+
+from synth import synthetic_ccs
+
+
+def contexts(count, *, keys=20, values=50, depth=6, seed=0):
+    rng = random.Random(seed)
+    return [
+        [(f"k{rng.randrange(keys)}", f"v{rng.randrange(values)}") for _ in range(depth)]
+        for _ in range(count)
+    ]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [1000, 10000]
+    print(f"{'rules':>8} {'chains':>8} {'augment (us)':>13} {'augment_many (us)':>18}")
+    for rules in sizes:
+        root = Context.from_ccs_stream(io.StringIO(synthetic_ccs(rules)), "-")
+        chains = contexts(2000)
+
+        def run():
+            for chain in chains:
+                ctx = root
+                for key, value in chain:
+                    ctx = ctx.augment(key, value)
+
+        def run_many():
+            for chain in chains:
+                root.augment_many(chain)
+
+        steps = sum(map(len, chains))
+        elapsed = timed(run)
+        elapsed_many = timed(run_many)
+        print(
+            f"{rules:>8} {len(chains):>8} {elapsed / steps * 1e6:>13.1f} "
+            f"{elapsed_many / steps * 1e6:>18.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
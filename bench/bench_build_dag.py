@@ -0,0 +1,41 @@
+"""Time DAG construction on synthetic configurations.
+
+Usage: python bench/bench_build_dag.py [RULES...]
+"""
+
+import io
+import sys
+import time
+
+from ccs.dag import build_dag
+from ccs.parser import Parser
+from ccs.rule_tree import RuleTreeNode
+
+from synth import synthetic_ccs
+
+
+def rule_tree(rules):
+    root = RuleTreeNode()
+    Parser().parse(io.StringIO(synthetic_ccs(rules)), "-").add_to(root)
+    return root
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [1000, 10000, 100000]
+    print(f"{'rules':>8} {'bitsets':>8} {'build (s)':>10} {'nodes':>8} {'edges':>8}")
+    for rules in sizes:
+        root = rule_tree(rules)
+        for bitsets in (False, True):
+            elapsed, dag = timed(lambda: build_dag(root, bitsets=bitsets))
+            stats = dag.stats()
+            print(f"{rules:>8} {bitsets!s:>8} {elapsed:>10.3f} {stats.nodes:>8} {stats.edges:>8}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
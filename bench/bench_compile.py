@@ -0,0 +1,48 @@
+"""Compare the memory held by a Dag's node graph with its CompiledDag.
+
+Usage: python bench/bench_compile.py [RULES...]
+"""
+
+import gc
+import io
+import sys
+import time
+import tracemalloc
+
+from ccs.compiled import compile_dag
+from ccs.dag import build_dag
+from ccs.parser import Parser
+from ccs.rule_tree import RuleTreeNode
+
+from synth import synthetic_ccs
+
+
+def retained(fn):
+    """Call fn, returning its result and the bytes it left allocated."""
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    gc.collect()
+    return result, tracemalloc.get_traced_memory()[0] - before
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [1000, 10000]
+    print(f"{'rules':>8} {'nodes':>8} {'dag (KiB)':>10} {'compiled (KiB)':>15} {'compile (s)':>12}")
+    for rules in sizes:
+        root = RuleTreeNode()
+        Parser().parse(io.StringIO(synthetic_ccs(rules)), "-").add_to(root)
+        tracemalloc.start()
+        dag, dag_bytes = retained(lambda: build_dag(root))
+        start = time.perf_counter()
+        compiled, compiled_bytes = retained(lambda: compile_dag(dag))
+        elapsed = time.perf_counter() - start
+        tracemalloc.stop()
+        print(
+            f"{rules:>8} {len(compiled):>8} {dag_bytes // 1024:>10} "
+            f"{compiled_bytes // 1024:>15} {elapsed:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
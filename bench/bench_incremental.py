@@ -0,0 +1,66 @@
+"""Compare a full load with an incremental update after one file changes.
+
+The configuration is a root file importing FILES synthetic files which
+together hold RULES rules; each update replaces one of them with a new one
+of half the size.
+
+Usage: python bench/bench_incremental.py [RULES...]
+"""
+
+import io
+import random
+import sys
+import time
+
+from ccs.incremental import IncrementalBuild
+from ccs.parser import Parser
+from ccs.search_state import _load_dag
+
+from synth import synthetic_ccs
+
+FILES = 50
+UPDATES = 3
+
+
+class DictResolver:
+    def __init__(self, files):
+        self.files = files
+
+    def resolve(self, location):
+        return io.StringIO(self.files[location])
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [10000, 50000]
+    root = "".join(f'@import "f{i}.ccs"\n' for i in range(FILES))
+    print(f"{'rules':>8} {'full (s)':>9} {'update (s)':>11} {'parsed':>7} {'expanded':>9}")
+    for rules in sizes:
+        per_file = rules // FILES
+        files = {
+            f"f{i}.ccs": synthetic_ccs(per_file, seed=i, root_props=i == 0)
+            for i in range(FILES)
+        }
+        full, _ = timed(
+            lambda: _load_dag(io.StringIO(root), "root", DictResolver(files), parser=Parser())
+        )
+        build = IncrementalBuild()
+        build.update(io.StringIO(root), "root", DictResolver(files))
+        rng = random.Random(0)
+        for n in range(UPDATES):
+            files[f"f{rng.randrange(FILES)}.ccs"] = synthetic_ccs(per_file // 2, seed=FILES + n)
+            update, _ = timed(lambda: build.update(io.StringIO(root), "root", DictResolver(files)))
+            stats = build.stats
+            print(
+                f"{rules:>8} {full:>9.2f} {update:>11.2f} "
+                f"{stats.files_parsed:>7} {stats.expansions:>9}"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
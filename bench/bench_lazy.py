@@ -0,0 +1,41 @@
+"""Compare eager and lazy property resolution for augment chains that read a
+few properties at the end.
+
+Usage: python bench/bench_lazy.py [RULES...]
+"""
+
+import io
+import sys
+import time
+
+from ccs.error import CcsError
+from ccs.search_state import Context
+
+from bench_augment import contexts
+from synth import synthetic_ccs
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [1000, 10000]
+    print(f"{'rules':>8} {'props':>6} {'eager (us)':>11} {'lazy (us)':>10}")
+    for rules in sizes:
+        ccs = synthetic_ccs(rules, props=2000)
+        chains = contexts(2000)
+        reads = [f"p{i}" for i in range(0, 2000, 500)]
+        times = []
+        for lazy in (False, True):
+            root = Context.from_ccs_stream(io.StringIO(ccs), "-", lazy=lazy)
+            start = time.perf_counter()
+            for chain in chains:
+                ctx = root.augment_many(chain)
+                for name in reads:
+                    try:
+                        ctx.get_single_value(name)
+                    except CcsError:
+                        pass
+            times.append((time.perf_counter() - start) / len(chains))
+        print(f"{rules:>8} {len(reads):>6} {times[0] * 1e6:>11.1f} {times[1] * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
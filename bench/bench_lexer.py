@@ -0,0 +1,42 @@
+"""Compare the character-at-a-time Lexer with RegexLexer.
+
+Usage: python bench/bench_lexer.py [RULES...]
+"""
+
+import io
+import sys
+import time
+
+from ccs.parser import Lexer, Parser, RegexLexer, Token
+
+from synth import synthetic_ccs
+
+
+def lex_all(lexer, text):
+    lex = lexer(io.StringIO(text))
+    count = 0
+    while lex.consume().type is not Token.EOS:
+        count += 1
+    return count
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [1000, 10000, 100000]
+    print(f"{'rules':>8} {'lines':>8} {'lexer':>12} {'lex (s)':>9} {'parse (s)':>10}")
+    for rules in sizes:
+        text = synthetic_ccs(rules)
+        lines = text.count("\n")
+        for lexer in (Lexer, RegexLexer):
+            lex = timed(lambda: lex_all(lexer, text))
+            parse = timed(lambda: Parser(lexer).parse(io.StringIO(text), "-"))
+            print(f"{rules:>8} {lines:>8} {lexer.__name__:>12} {lex:>9.3f} {parse:>10.3f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,97 @@
+"""Compare a copied compiled artifact with a memory-mapped one: load time,
+memory each process keeps for itself, and augment throughput.
+
+Private memory is the Private_Dirty total from /proc/self/smaps_rollup of a
+forked worker after it loads the artifact and runs the queries, so it's only
+measured on Linux.
+
+Usage: python bench/bench_mapped.py [RULES...]
+"""
+
+import gc
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from ccs import artifact
+from ccs.search_state import Context, compile_ccs_stream
+
+from synth import synthetic_ccs
+
+
+def private_dirty_kib():
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Private_Dirty:"):
+                return int(line.split()[1])
+
+
+def queries(ctx, count=2000, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        c = ctx
+        for _ in range(3):
+            c = c.augment(f"k{rng.randrange(20)}", f"v{rng.randrange(50)}")
+        c.get_single_value("base")
+
+
+def in_worker(fn):
+    """Run fn in a forked child, returning the number it writes back."""
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        os.write(write, str(fn()).encode())
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        result = f.read()
+    os.waitpid(pid, 0)
+    return int(result)
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [10000, 100000]
+    measure_rss = os.path.exists("/proc/self/smaps_rollup")
+    print(
+        f"{'rules':>8} {'mode':>7} {'load (ms)':>10} {'heap (KiB)':>11} "
+        f"{'private (KiB)':>14} {'augments/s':>11}"
+    )
+    for rules in sizes:
+        data = compile_ccs_stream(io.StringIO(synthetic_ccs(rules)), "-")
+        with tempfile.NamedTemporaryFile(suffix=".ccsc") as f:
+            f.write(data)
+            f.flush()
+            for mapped in (False, True):
+                gc.collect()
+                tracemalloc.start()
+                start = time.perf_counter()
+                graph = artifact.load(f.name, mapped=mapped)
+                load = time.perf_counter() - start
+                heap = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+
+                ctx = Context(graph)
+                start = time.perf_counter()
+                queries(ctx)
+                rate = 3 * 2000 / (time.perf_counter() - start)
+
+                def worker():
+                    before = private_dirty_kib()
+                    queries(Context(artifact.load(f.name, mapped=mapped)))
+                    return private_dirty_kib() - before
+
+                private = in_worker(worker) if measure_rss else "-"
+                print(
+                    f"{rules:>8} {'mapped' if mapped else 'copied':>7} {load * 1e3:>10.1f} "
+                    f"{heap // 1024:>11} {private:>14} {rate:>11.0f}"
+                )
+                del graph, ctx
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
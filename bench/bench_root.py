@@ -0,0 +1,42 @@
+"""Time augment chains from a root context with no unconditional properties.
+
+Each chain first steps through keys that set nothing, so the context stays
+property-free for a while, then through keys from the configuration.
+
+Usage: python bench/bench_root.py [RULES...]
+"""
+
+import io
+import sys
+import time
+
+from ccs.search_state import Context
+
+from synth import synthetic_ccs
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [1000, 10000]
+    print(f"{'rules':>8} {'steps':>8} {'root (us)':>10} {'augment (us)':>13}")
+    for rules in sizes:
+        ccs = synthetic_ccs(rules, root_props=False)
+        ccs += "".join(f"@constrain c{i}.x\n" for i in range(50))
+
+        dag = Context.from_ccs_stream(io.StringIO(ccs), "-").dag
+        start = time.perf_counter()
+        for _ in range(1000):
+            root = Context(dag)
+        root_time = (time.perf_counter() - start) / 1000
+
+        steps = [(f"unused{i}", "x") for i in range(8)] + [("k1", "v1"), ("k2", "v2")]
+        start = time.perf_counter()
+        for _ in range(500):
+            ctx = root
+            for key, value in steps:
+                ctx = ctx.augment(key, value)
+        elapsed = (time.perf_counter() - start) / (500 * len(steps))
+        print(f"{rules:>8} {len(steps):>8} {root_time * 1e6:>10.1f} {elapsed * 1e6:>13.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,98 @@
+"""Query latency through the query server, against loading the config for
+each lookup as a short-lived script would.
+
+The server runs in a child process. Each query asks for one property in a
+context of three random steps. Latencies are client round trips per
+request, so for batches they cover the whole batch, and for pipelined and
+concurrent requests they include time spent queued behind others.
+
+Usage: python bench/bench_serve.py [RULES...]
+"""
+
+import asyncio
+import io
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+from ccs.client import AsyncClient, Client
+from ccs.search_state import Context
+from ccs.server import QueryServer
+
+from synth import synthetic_ccs
+
+QUERIES = 5000
+
+
+def queries(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        ({f"k{rng.randrange(20)}": f"v{rng.randrange(50)}" for _ in range(3)}, ["base"])
+        for _ in range(count)
+    ]
+
+
+def serve(source, path, ready):
+    server = QueryServer(Context.from_ccs_stream(io.StringIO(source), "-", lazy=True))
+    server.ready = ready
+    server.run(path)
+
+
+def report(label, latency, elapsed, count):
+    print(
+        f"{label:>24} {count / elapsed:>10.0f} "
+        f"{latency.percentile(50) * 1e6:>9.0f} {latency.percentile(99) * 1e6:>9.0f}"
+    )
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [10000]
+    qs = queries(QUERIES)
+    for rules in sizes:
+        source = synthetic_ccs(rules)
+        start = time.perf_counter()
+        Context.from_ccs_stream(io.StringIO(source), "-", lazy=True)
+        print(f"{rules} rules: loading the config takes {time.perf_counter() - start:.2f}s")
+        print(f"{'':>24} {'queries/s':>10} {'p50 (us)':>9} {'p99 (us)':>9}")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ccs.sock")
+            ready = multiprocessing.Event()
+            server = multiprocessing.Process(target=serve, args=(source, path, ready))
+            server.start()
+            ready.wait()
+            try:
+                with Client(path) as client:
+                    client.query({}, ["base"])  # connect
+                    for label, run in (
+                        ("one query per request", lambda: [client.query(*q) for q in qs]),
+                        ("batches of 50", lambda: [
+                            client.batch(qs[i : i + 50]) for i in range(0, len(qs), 50)
+                        ]),
+                        ("pipelined", lambda: client.pipeline(qs)),
+                    ):
+                        client.latency = type(client.latency)()
+                        start = time.perf_counter()
+                        run()
+                        report(label, client.latency, time.perf_counter() - start, len(qs))
+
+                async def concurrent():
+                    async with AsyncClient(path, pool_size=4) as client:
+                        start = time.perf_counter()
+                        await asyncio.gather(*(client.query(*q) for q in qs))
+                        return client.latency, time.perf_counter() - start
+
+                latency, elapsed = asyncio.run(concurrent())
+                report("async, all concurrent", latency, elapsed, len(qs))
+                with Client(path) as client:
+                    print(f"server: {client.stats()['latency']}")
+            finally:
+                server.terminate()
+                server.join()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,47 @@
+"""Time suggest_context against a trial augment for every context element.
+
+Usage: python bench/bench_suggest.py [RULES...]
+"""
+
+import io
+import sys
+import time
+
+from ccs.search_state import Context, suggest_context
+
+from synth import synthetic_ccs
+
+
+def trial_suggestions(ctx):
+    current = set(ctx.props.keys())
+    out = []
+    for name, matcher in ctx.graph.children.items():
+        for value in sorted(matcher.positive_values):
+            new = set(ctx.augment(name, value).props.keys()) - current
+            if new:
+                out.append((name, value, new))
+    return out
+
+
+def timed(fn, ctx):
+    start = time.perf_counter()
+    fn(ctx)
+    return time.perf_counter() - start
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [1000, 10000]
+    print(f"{'rules':>8} {'depth':>6} {'trials (ms)':>12} {'suggest (ms)':>13}")
+    for rules in sizes:
+        ctx = Context.from_ccs_stream(io.StringIO(synthetic_ccs(rules)), "-")
+        suggest_context(ctx)  # reachability is computed on first use
+        for depth in range(4):
+            print(
+                f"{rules:>8} {depth:>6} {timed(trial_suggestions, ctx) * 1e3:>12.1f} "
+                f"{timed(suggest_context, ctx) * 1e3:>13.1f}"
+            )
+            ctx = ctx.augment(f"k{depth}", f"v{depth}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
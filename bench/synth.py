@@ -0,0 +1,42 @@
+"""Synthetic CCS configurations for benchmarks."""
+
+import random
+
+
+def synthetic_ccs(rules, *, keys=20, values=50, props=200, root_props=True, seed=0):
+    """Generate CCS source with the given number of rules.
+
+    Selectors are mostly short conjunctions of key.value steps, with the
+    occasional disjunction and nested block, roughly like generated configs.
+    Without root_props, nothing is set unconditionally.
+    """
+    rng = random.Random(seed)
+
+    def step():
+        return f"k{rng.randrange(keys)}.v{rng.randrange(values)}"
+
+    def selector():
+        terms = [step() for _ in range(rng.choice([1, 1, 2, 2, 3]))]
+        if rng.random() < 0.1:
+            terms.append(f"({step()}, {step()})")
+        return " ".join(terms)
+
+    def prop(i):
+        value = rng.choice([f"'value {i}'", str(i), f"{i}.5", f'"${{HOME}}/{i}"'])
+        return f"p{rng.randrange(props)} = {value}"
+
+    lines = ["// generated benchmark config"]
+    if root_props:
+        lines.append("base = 'root'")
+    i = 0
+    while i < rules:
+        if rng.random() < 0.2:
+            lines.append(f"{selector()} {{")
+            for _ in range(rng.randint(1, 3)):
+                lines.append(f"    {selector()} : {prop(i)}")
+                i += 1
+            lines.append("}")
+        else:
+            lines.append(f"{selector()} {{ {prop(i)} }} /* rule {i} */")
+            i += 1
+    return "\n".join(lines) + "\n"
@@ -1,9 +1,11 @@
-from .ast import ImportResolver as ImportResolver
+from .ast import FileImportResolver as FileImportResolver, ImportResolver as ImportResolver
 from .error import (
     AmbiguousPropertyError as AmbiguousPropertyError,
+    ArtifactError as ArtifactError,
     CcsError as CcsError,
     EmptyPropertyError as EmptyPropertyError,
     MissingPropertyError as MissingPropertyError,
 )
 from .property import Property as Property
-from .search_state import Context as Context
+from .search_state import AugmentCache as AugmentCache, Context as Context
+from .snapshot import Snapshot as Snapshot
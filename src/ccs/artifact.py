@@ -0,0 +1,494 @@
+"""Binary compiled-config artifacts.
+
+An artifact holds a CompiledDag, so that loading it skips parsing and DAG
+building altogether. `ccs compile` writes them, and Context.from_compiled()
+reads them.
+
+Layout, all little-endian:
+
+    header    magic b"CCSC", u16 format version, u16 reserved (0),
+              32-byte source fingerprint, u32 section count, 4 bytes of
+              padding
+    sections  each a u8 typecode ("B" or "I"), seven bytes of padding, a u64
+              item count, then the items, padded to a multiple of 8 bytes
+
+so every section starts 8-byte aligned. The sections come in a fixed order
+(see SECTIONS). Strings (property names and values, origins, key names and
+values) are interned into one table and referred to by index. Records are
+flattened into u32 arrays of fixed width: props are (name, value, origin
+file, origin line, override level, property number), constraints (name,
+values start, values end) over a separate array of value ids, matchers
+(name, wildcard node + 1 or 0, values start, values end), and matcher
+values (value, literal start, literal end) over literal_ids. The property
+index is a sorted array of names with, for each, a range of (node id, prop
+record) pairs. Matchers, matcher values and the property index are sorted by
+name, so they can be searched in place.
+
+For a given source, the bytes written are always the same: there are no
+timestamps, nodes are written in id order (which is deterministic), and
+matchers and their values are written sorted by name.
+
+The fingerprint is a SHA-256 over everything the build depended on (see
+cache.closure_parts()), so a deploy can tell whether an artifact is stale.
+
+load() copies an artifact into an ordinary CompiledDag. load(mapped=True)
+instead returns a MappedDag, which memory-maps the file and reads nodes,
+matchers and properties straight out of it, so processes mapping the same
+file share one copy of it. Replace an artifact with a rename (as `ccs
+compile` does) rather than rewriting it in place while it's mapped.
+"""
+
+import hashlib
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Dict
+
+from ccs.ast import Origin
+from ccs.cache import closure_parts
+from ccs.compiled import CompiledDag, CompiledMatcher
+from ccs.dag import Key, Specificity
+from ccs.error import ArtifactError
+from ccs.property import Property
+
+MAGIC = b"CCSC"
+VERSION = 2
+HEADER = struct.Struct("<4sHH32sI4x")
+SECTION = struct.Struct("<B7xQ")
+NO_NODE = 0
+
+SECTIONS = (
+    "string_offsets",
+    "string_data",
+    "specificities",
+    "is_and",
+    "spec_ids",
+    "tally_counts",
+    "child_offsets",
+    "child_ids",
+    "parent_offsets",
+    "parent_ids",
+    "prop_offsets",
+    "props",
+    "constraint_offsets",
+    "constraints",
+    "constraint_values",
+    "matchers",
+    "matcher_values",
+    "literal_ids",
+    "prop_index_names",
+    "prop_index_offsets",
+    "prop_index_entries",
+)
+
+# sections stored as the CompiledDag attribute of the same name
+ARRAYS = (
+    "is_and",
+    "spec_ids",
+    "tally_counts",
+    "child_offsets",
+    "child_ids",
+    "parent_offsets",
+    "parent_ids",
+    "prop_offsets",
+    "constraint_offsets",
+    "literal_ids",
+)
+
+
+def fingerprint(filename: str, text: str, contents: Dict[str, str]) -> bytes:
+    """The source fingerprint for a root file and its imports' contents."""
+    h = hashlib.sha256(b"ccs-source")
+    for part in closure_parts(filename, text, contents):
+        data = part.encode("utf-8", "surrogatepass")
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.digest()
+
+
+class _Strings:
+    def __init__(self):
+        self.ids = {}
+        self.offsets = array("I", [0])
+        self.data = bytearray()
+
+    def __call__(self, s):
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.ids)
+            self.data += s.encode("utf-8", "surrogatepass")
+            self.offsets.append(len(self.data))
+        return i
+
+
+def dumps(graph: CompiledDag, source_fingerprint: bytes = bytes(32)) -> bytes:
+    """The artifact for graph."""
+    strings = _Strings()
+
+    specificities = array("I")
+    for spec in graph.specificities:
+        specificities.extend(spec)
+
+    props = array("I")
+    index = {}
+    for n in range(len(graph)):
+        for i in range(graph.prop_offsets[n], graph.prop_offsets[n + 1]):
+            name, prop = graph.props[i]
+            props.extend(
+                (
+                    strings(name),
+                    strings(prop.value),
+                    strings(prop.origin.filename),
+                    prop.origin.line_number,
+                    prop.override_level,
+                    prop.property_number,
+                )
+            )
+            index.setdefault(name, []).extend((n, i))
+
+    constraints, constraint_values = array("I"), array("I")
+    for key in graph.constraints:
+        start = len(constraint_values)
+        constraint_values.extend(strings(v) for v in sorted(key.values))
+        constraints.extend((strings(key.name), start, len(constraint_values)))
+
+    matchers, matcher_values = array("I"), array("I")
+    for name, matcher in sorted(graph.children.items()):
+        start = len(matcher_values) // 3
+        for value, ids in sorted(matcher.positive_values.items()):
+            matcher_values.extend((strings(value), ids.start, ids.stop))
+        wildcard = NO_NODE if matcher.wildcard is None else matcher.wildcard + 1
+        matchers.extend((strings(name), wildcard, start, len(matcher_values) // 3))
+
+    index_names, index_offsets, index_entries = array("I"), array("I", [0]), array("I")
+    for name in sorted(index):
+        index_names.append(strings(name))
+        index_entries.extend(index[name])
+        index_offsets.append(len(index_entries) // 2)
+
+    sections = {
+        "string_offsets": strings.offsets,
+        "string_data": array("B", strings.data),
+        "specificities": specificities,
+        "props": props,
+        "constraints": constraints,
+        "constraint_values": constraint_values,
+        "matchers": matchers,
+        "matcher_values": matcher_values,
+        "prop_index_names": index_names,
+        "prop_index_offsets": index_offsets,
+        "prop_index_entries": index_entries,
+    }
+    for name in ARRAYS:
+        values = getattr(graph, name)
+        if isinstance(values, memoryview):  # from a MappedDag
+            values = array(values.format, values)
+        sections[name] = values
+
+    out = bytearray(HEADER.pack(MAGIC, VERSION, 0, source_fingerprint, len(SECTIONS)))
+    for name in SECTIONS:
+        values = sections[name]
+        if sys.byteorder == "big" and values.itemsize > 1:
+            values = array(values.typecode, values)
+            values.byteswap()
+        data = values.tobytes()
+        out += SECTION.pack(ord(values.typecode), len(values))
+        out += data
+        out += bytes(-len(data) % 8)
+    return bytes(out)
+
+
+def _sections(data, copy=True):
+    """The fingerprint and sections of the artifact in data, a memoryview.
+    Sections are arrays, or with copy=False, memoryviews into data."""
+    if len(data) < HEADER.size:
+        raise ArtifactError("Not a compiled CCS config: too short")
+    magic, version, _, source_fingerprint, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ArtifactError("Not a compiled CCS config")
+    if version != VERSION:
+        raise ArtifactError(f"Unsupported compiled config version {version} (expected {VERSION})")
+    if count != len(SECTIONS):
+        raise ArtifactError(f"Corrupt compiled config: {count} sections")
+
+    sections = {}
+    pos = HEADER.size
+    for name in SECTIONS:
+        if pos + SECTION.size > len(data):
+            raise ArtifactError(f"Corrupt compiled config: truncated at {name}")
+        typecode, length = SECTION.unpack_from(data, pos)
+        pos += SECTION.size
+        if typecode not in b"BI":
+            raise ArtifactError(f"Corrupt compiled config: bad typecode in {name}")
+        typecode = chr(typecode)
+        size = length * array(typecode).itemsize
+        if pos + size > len(data):
+            raise ArtifactError(f"Corrupt compiled config: truncated at {name}")
+        if copy:
+            values = array(typecode)
+            values.frombytes(data[pos : pos + size])
+            if sys.byteorder == "big" and values.itemsize > 1:
+                values.byteswap()
+        else:
+            values = data[pos : pos + size].cast(typecode)
+        sections[name] = values
+        pos += size + (-size % 8)
+    return bytes(source_fingerprint), sections
+
+
+def _specificities(specs):
+    return [Specificity(*specs[i : i + 4]) for i in range(0, len(specs), 4)]
+
+
+def loads(data: bytes) -> CompiledDag:
+    """The CompiledDag stored in an artifact. Its source_fingerprint is set
+    from the artifact."""
+    source_fingerprint, sections = _sections(memoryview(data))
+
+    offsets, blob = sections["string_offsets"], sections["string_data"].tobytes()
+    strings = [
+        blob[offsets[i] : offsets[i + 1]].decode("utf-8", "surrogatepass")
+        for i in range(len(offsets) - 1)
+    ]
+
+    graph = CompiledDag()
+    graph.source_fingerprint = source_fingerprint
+    graph.specificities = _specificities(sections["specificities"])
+    for name in ARRAYS:
+        setattr(graph, name, sections[name])
+
+    props = sections["props"]
+    origins = {}
+    graph.props = []
+    for i in range(0, len(props), 6):
+        name, value, filename, line, override, number = props[i : i + 6]
+        origin = origins.get((filename, line))
+        if origin is None:
+            origin = origins[(filename, line)] = Origin(strings[filename], line)
+        graph.props.append((strings[name], Property(strings[value], origin, override, number)))
+
+    constraints, values = sections["constraints"], sections["constraint_values"]
+    graph.constraints = [
+        Key(strings[name], [strings[v] for v in values[start:end]])
+        for name, start, end in zip(*[iter(constraints)] * 3)
+    ]
+
+    matchers, matcher_values = sections["matchers"], sections["matcher_values"]
+    for name, wildcard, start, end in zip(*[iter(matchers)] * 4):
+        matcher = CompiledMatcher(None if wildcard == NO_NODE else wildcard - 1)
+        for i in range(start * 3, end * 3, 3):
+            value, lo, hi = matcher_values[i : i + 3]
+            matcher.positive_values[strings[value]] = range(lo, hi)
+        graph.children[strings[name]] = matcher
+
+    return graph
+
+
+def load(path, *, mapped: bool = False) -> CompiledDag:
+    """The CompiledDag in the artifact at path: a MappedDag if mapped is set
+    (except on big-endian hosts, which always get a copy), otherwise a copy."""
+    if mapped and sys.byteorder == "little":
+        return MappedDag(path)
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+class _StringTable:
+    """Strings decoded on demand from the string sections of a mapped artifact."""
+
+    __slots__ = ("offsets", "data")
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __getitem__(self, i):
+        return str(self.data[self.offsets[i] : self.offsets[i + 1]], "utf-8", "surrogatepass")
+
+    def find(self, records, width, lo, hi, s):
+        """The index among records lo to hi (each width entries long, and sorted
+        by the string their first entry refers to) of the one for s, or -1."""
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found = self[records[mid * width]]
+            if found < s:
+                lo = mid + 1
+            elif s < found:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+
+class _Props(Sequence):
+    """CompiledDag.props over the prop records of a mapped artifact."""
+
+    def __init__(self, strings, records):
+        self.strings = strings
+        self.records = records
+
+    def __len__(self):
+        return len(self.records) // 6
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.prop(j) for j in range(*i.indices(len(self)))]
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.prop(i)
+
+    def prop(self, i):
+        strings, records, i = self.strings, self.records, i * 6
+        origin = Origin(strings[records[i + 2]], records[i + 3])
+        return (
+            strings[records[i]],
+            Property(strings[records[i + 1]], origin, records[i + 4], records[i + 5]),
+        )
+
+
+class _Constraints(Sequence):
+    """CompiledDag.constraints over the constraint records of a mapped artifact."""
+
+    def __init__(self, strings, records, values):
+        self.strings = strings
+        self.records = records
+        self.values = values
+
+    def __len__(self):
+        return len(self.records) // 3
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.key(j) for j in range(*i.indices(len(self)))]
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.key(i)
+
+    def key(self, i):
+        name, start, end = self.records[i * 3 : i * 3 + 3]
+        return Key(self.strings[name], [self.strings[v] for v in self.values[start:end]])
+
+
+class _Values(Mapping):
+    """CompiledMatcher.positive_values over one matcher's value records."""
+
+    def __init__(self, strings, records, start, end):
+        self.strings = strings
+        self.records = records
+        self.start = start
+        self.end = end
+
+    def __getitem__(self, value):
+        i = -1
+        if isinstance(value, str):
+            i = self.strings.find(self.records, 3, self.start, self.end, value)
+        if i < 0:
+            raise KeyError(value)
+        return range(self.records[i * 3 + 1], self.records[i * 3 + 2])
+
+    def __iter__(self):
+        for i in range(self.start, self.end):
+            yield self.strings[self.records[i * 3]]
+
+    def __len__(self):
+        return self.end - self.start
+
+
+class _Matchers(Mapping):
+    """CompiledDag.children over the matcher records of a mapped artifact."""
+
+    def __init__(self, strings, records, values):
+        self.strings = strings
+        self.records = records
+        self.values = values
+
+    def __getitem__(self, name):
+        i = -1
+        if isinstance(name, str):
+            i = self.strings.find(self.records, 4, 0, len(self), name)
+        if i < 0:
+            raise KeyError(name)
+        _, wildcard, start, end = self.records[i * 4 : i * 4 + 4]
+        return CompiledMatcher(
+            None if wildcard == NO_NODE else wildcard - 1,
+            _Values(self.strings, self.values, start, end),
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.strings[self.records[i * 4]]
+
+    def __len__(self):
+        return len(self.records) // 4
+
+
+class _PropIndex(Mapping):
+    """CompiledDag.prop_index() over the property index of a mapped artifact."""
+
+    def __init__(self, strings, props, names, offsets, entries):
+        self.strings = strings
+        self.props = props
+        self.names = names
+        self.offsets = offsets
+        self.entries = entries
+
+    def __getitem__(self, name):
+        i = -1
+        if isinstance(name, str):
+            i = self.strings.find(self.names, 1, 0, len(self), name)
+        if i < 0:
+            raise KeyError(name)
+        entries = self.entries
+        return [
+            (entries[j], self.props.prop(entries[j + 1])[1])
+            for j in range(self.offsets[i] * 2, self.offsets[i + 1] * 2, 2)
+        ]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.strings[self.names[i]]
+
+    def __len__(self):
+        return len(self.names)
+
+
+class MappedDag(CompiledDag):
+    """A CompiledDag read in place from a memory-mapped artifact.
+
+    The node arrays are memoryviews into the mapping, and strings, props,
+    constraints and matchers are decoded from it as they're read, so little
+    per-process state is kept besides what Contexts themselves hold. Matcher
+    and property lookups are binary searches over the sorted records. A
+    MappedDag pickles as its path, and is mapped afresh when unpickled."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # an empty file can't be mapped
+                raise ArtifactError("Not a compiled CCS config: too short") from None
+        self.source_fingerprint, sections = _sections(memoryview(self.buffer), copy=False)
+
+        strings = _StringTable(sections["string_offsets"], sections["string_data"])
+        self.specificities = _specificities(sections["specificities"])
+        for name in ARRAYS:
+            setattr(self, name, sections[name])
+        self.props = _Props(strings, sections["props"])
+        self.constraints = _Constraints(
+            strings, sections["constraints"], sections["constraint_values"]
+        )
+        self.children = _Matchers(strings, sections["matchers"], sections["matcher_values"])
+        self._prop_index = _PropIndex(
+            strings,
+            self.props,
+            sections["prop_index_names"],
+            sections["prop_index_offsets"],
+            sections["prop_index_entries"],
+        )
+
+    def __reduce__(self):
+        return MappedDag, (self.path,)
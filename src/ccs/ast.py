@@ -3,7 +3,8 @@
 from abc import ABC, abstractmethod
 from collections import defaultdict
 from enum import Enum
-from typing import Dict, List, Optional, Set, Protocol, TextIO
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Protocol, TextIO
 
 from ccs.dag import Key
 
@@ -32,6 +33,16 @@ class ImportResolver(Protocol):
     def resolve(self, location: str) -> TextIO: ...
 
 
+class FileImportResolver:
+    """Resolves @import paths relative to the directory containing the importing file."""
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+
+    def resolve(self, location: str) -> TextIO:
+        return open(self.base_dir / location)
+
+
 class Expr(Selector):
     """A conjunction or disjunction selector expression."""
 
@@ -74,6 +85,11 @@ class AstNode(ABC):
     ) -> bool:
         return True
 
+    def imports(self) -> Iterator["Import"]:
+        """The Import nodes in this subtree, in source order, not descending into
+        already-resolved imports."""
+        return iter(())
+
 
 class Import(AstNode):
     """AST node for @import."""
@@ -89,26 +105,21 @@ class Import(AstNode):
         assert self.ast
         self.ast.add_to(build_context)
 
+    def imports(self) -> Iterator["Import"]:
+        yield self
+
+    def report_circular(self) -> None:
+        # TODO logger
+        print(f"Circular import detected involving '{self.location}'")
+
     def resolve_imports(
         self, import_resolver: ImportResolver, parser, in_progress
     ) -> bool:
         if self.location in in_progress:
-            # TODO logger
-            print(f"Circular import detected involving '{self.location}'")
-        else:
-            in_progress.append(self.location)
-            try:
-                self.ast = parser.parse_ccs_stream(
-                    import_resolver.resolve(self.location),
-                    self.location,
-                    import_resolver,
-                    in_progress,
-                )
-                if self.ast:
-                    return True
-            finally:
-                in_progress.pop()
-        return False
+            self.report_circular()
+            return False
+        self.ast = parser.parse_import(self.location, import_resolver, in_progress)
+        return self.ast is not None
 
 
 class PropDef:
@@ -129,6 +140,9 @@ class PropDef:
     def resolve_imports(self, *args) -> bool:
         return True
 
+    def imports(self) -> Iterator["Import"]:
+        return iter(())
+
 
 class Constraint:
     """AST node for @constrain."""
@@ -145,6 +159,9 @@ class Constraint:
     def resolve_imports(self, *args) -> bool:
         return True
 
+    def imports(self) -> Iterator["Import"]:
+        return iter(())
+
 
 class Nested:
     """AST node for a nested ruleset (single or multiple rules)."""
@@ -171,6 +188,10 @@ class Nested:
                 return False
         return True
 
+    def imports(self) -> Iterator["Import"]:
+        for rule in self.rules:
+            yield from rule.imports()
+
     def __str__(self) -> str:
         return f"{self.selector} {{ {'; '.join(map(str, self.rules))} }}"
 
@@ -0,0 +1,234 @@
+"""On-disk cache of built DAGs.
+
+Building a DAG from source means parsing, flattening, DNF conversion and the
+set-cover construction in build_dag(). When many processes load the same
+configuration, a DagCache lets all but the first skip that work and unpickle the
+finished Dag instead.
+
+Entries are keyed by a fingerprint of the whole import closure: the root file's
+name and contents, the contents of every file reached through the import
+resolver, and the current values of any environment variables those files
+interpolate (since interpolation happens at parse time). Because the set of
+imported files is only known after parsing, each root file also gets a small
+manifest listing the import locations seen when it was last built.
+
+The cache directory must be trusted: entries are pickles.
+"""
+
+import hashlib
+import io
+import os
+import pickle
+import re
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, TextIO
+
+from ccs.ast import ImportResolver
+from ccs.dag import Dag
+
+INTERPOLANT_RE = re.compile(r"\$\{([_0-9A-Za-z]*)\}")
+
+# the umask can only be read by setting it, so it's read once, at import
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def default_cache_dir() -> Path:
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "ccs"
+
+
+def closure_parts(filename: str, text: str, contents: Dict[str, str]) -> List[str]:
+    """Everything a build depends on: the root file's name and text, each
+    imported location and its contents, and the values of the environment
+    variables any of them interpolate."""
+    parts = [filename, text]
+    variables = set(INTERPOLANT_RE.findall(text))
+    for location, content in contents.items():
+        parts += [location, content]
+        variables.update(INTERPOLANT_RE.findall(content))
+    for name in sorted(variables):
+        value = os.environ.get(name)
+        parts += [name, "" if value is None else "=" + value]
+    return parts
+
+
+class RecordingResolver:
+    """Wraps an ImportResolver, remembering the contents of everything resolved."""
+
+    def __init__(self, resolver: ImportResolver) -> None:
+        self.resolver = resolver
+        self.contents: Dict[str, str] = {}
+
+    def resolve(self, location: str) -> TextIO:
+        if location not in self.contents:
+            with self.resolver.resolve(location) as stream:
+                self.contents[location] = stream.read()
+        return io.StringIO(self.contents[location])
+
+
+class DagCache:
+    """A size-bounded directory of pickled DAGs, safe for concurrent use.
+
+    Writers never modify a file in place: each entry is written to a temporary
+    file in the cache directory and atomically renamed into place, so readers see
+    either a complete entry or none at all. Once the directory grows beyond
+    max_bytes, the least recently used files are removed.
+    """
+
+    VERSION = 3
+    ENTRY_SUFFIX = ".dag"
+    MANIFEST_SUFFIX = ".manifest"
+
+    def __init__(self, directory=None, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.directory = Path(directory) if directory is not None else default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load_or_build(
+        self,
+        stream: TextIO,
+        filename: str,
+        import_resolver: Optional[ImportResolver],
+        build: Callable[[TextIO, str, Optional[ImportResolver]], Dag],
+    ) -> Dag:
+        """Return the Dag for this source, from the cache if possible.
+
+        On a miss, build(stream, filename, import_resolver) constructs it and the
+        result is stored for next time.
+        """
+        text = stream.read()
+        root_key = self._digest([filename, text])
+
+        locations = self._read_manifest(root_key)
+        if locations is not None:
+            contents = self._resolve_all(import_resolver, locations)
+            if contents is not None:
+                key = self._closure_key(filename, text, contents)
+                dag = self._read_entry(key)
+                if dag is not None:
+                    self.hits += 1
+                    return dag
+
+        self.misses += 1
+        recorder = RecordingResolver(import_resolver) if import_resolver else None
+        dag = build(io.StringIO(text), filename, recorder)
+        contents = recorder.contents if recorder else {}
+        self._write(root_key + self.MANIFEST_SUFFIX, pickle.dumps(list(contents)))
+        key = self._closure_key(filename, text, contents)
+        self._write(key + self.ENTRY_SUFFIX, pickle.dumps(dag, pickle.HIGHEST_PROTOCOL))
+        self._evict()
+        return dag
+
+    def clear(self) -> None:
+        for path in self._files():
+            _unlink(path)
+
+    def _digest(self, parts: List[str]) -> str:
+        h = hashlib.sha256(f"ccs-dag-cache-v{self.VERSION}".encode())
+        for part in parts:
+            data = part.encode("utf-8", "surrogatepass")
+            h.update(len(data).to_bytes(8, "little"))
+            h.update(data)
+        return h.hexdigest()
+
+    def _closure_key(self, filename: str, text: str, contents: Dict[str, str]) -> str:
+        return self._digest(closure_parts(filename, text, contents))
+
+    def _resolve_all(
+        self, import_resolver: Optional[ImportResolver], locations: List[str]
+    ) -> Optional[Dict[str, str]]:
+        if not locations:
+            return {}
+        if import_resolver is None:
+            return None
+        contents = {}
+        try:
+            for location in locations:
+                with import_resolver.resolve(location) as stream:
+                    contents[location] = stream.read()
+        except OSError:
+            return None
+        return contents
+
+    def _read_manifest(self, root_key: str) -> Optional[List[str]]:
+        return self._read(root_key + self.MANIFEST_SUFFIX)
+
+    def _read_entry(self, key: str) -> Optional[Dag]:
+        return self._read(key + self.ENTRY_SUFFIX)
+
+    def _read(self, name: str):
+        path = self.directory / name
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # truncated or otherwise unreadable: drop it and rebuild.
+            _unlink(path)
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return value
+
+    def _write(self, name: str, data: bytes) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.directory / name, data)
+
+    def _files(self) -> List[Path]:
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return []
+        return [
+            Path(e.path)
+            for e in entries
+            if e.name.endswith((self.ENTRY_SUFFIX, self.MANIFEST_SUFFIX))
+        ]
+
+    def _evict(self) -> None:
+        files = []
+        total = 0
+        for path in self._files():
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue  # removed by a concurrent writer
+            files.append((st.st_mtime, path, st.st_size))
+            total += st.st_size
+        files.sort()
+        for _, path, size in files:
+            if total <= self.max_bytes:
+                break
+            _unlink(path)
+            total -= size
+            self.evictions += 1
+
+
+def atomic_write(path: Path, data: bytes) -> None:
+    """Write data to path by way of a temporary file in the same directory,
+    renamed into place, so readers never see half of it. The file gets the
+    permissions a newly created file would (0666 less the umask), not
+    mkstemp's 0600, so other users can read it."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), 0o666 & ~_UMASK)
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        _unlink(Path(tmp))
+        raise
+
+
+def _unlink(path: Path) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
@@ -27,6 +27,8 @@ if click is not None:
         """CCS configuration query tool."""
 
     # Register subcommands — each module decorates @cli.command() on import.
+    import ccs.cli.compile  # noqa: F401
     import ccs.cli.dump   # noqa: F401
     import ccs.cli.query  # noqa: F401
+    import ccs.cli.serve  # noqa: F401
     import ccs.cli.shell  # noqa: F401
@@ -5,25 +5,15 @@ from __future__ import annotations
 import io
 import sys
 from pathlib import Path
-from typing import TextIO
 
 import click
 
+from ccs.ast import FileImportResolver
 from ccs.dag import Key
-from ccs.parser import Lexer, Token, ParseError
+from ccs.parser import RegexLexer, Token, ParseError
 from ccs.search_state import Context, SetAccumulator
 
 
-class FileImportResolver:
-    """Resolves @import paths relative to the directory containing the importing file."""
-
-    def __init__(self, base_dir: Path):
-        self.base_dir = base_dir
-
-    def resolve(self, location: str) -> TextIO:
-        return open(self.base_dir / location)
-
-
 def parse_context_steps(text: str) -> list[Key]:
     """Parse context specs using real CCS lexing rules.
 
@@ -32,7 +22,7 @@ def parse_context_steps(text: str) -> list[Key]:
 
     Raises click.ClickException on parse errors.
     """
-    lex = Lexer(io.StringIO(text))
+    lex = RegexLexer(io.StringIO(text))
     keys = []
     try:
         while lex.peek().type is not Token.EOS:
@@ -68,8 +58,10 @@ def load_context(
     *,
     show_all: bool = False,
     trace: bool = False,
+    compiled: bool = False,
 ) -> Context:
-    """Load a CCS file and return a root Context.
+    """Load a CCS file, or with compiled, an artifact written by `ccs compile`,
+    and return a root Context.
 
     Raises click.ClickException on failure.
     """
@@ -87,16 +79,25 @@ def load_context(
         kwargs["trace_properties"] = tracer
 
     try:
+        if compiled:
+            return Context.from_compiled(file_path, **kwargs)
         with open(file_path) as f:
             return Context.from_ccs_stream(f, str(file_path), resolver, **kwargs)
     except Exception as e:
         raise click.ClickException(f"Failed to load {file_path}: {e}") from e
 
 
+compiled_option = click.option(
+    "--compiled", is_flag=True, default=False,
+    help="FILE is a compiled config written by 'ccs compile'.",
+)
+
+
 def apply_context_specs(ctx: Context, specs: tuple[str, ...]) -> Context:
     """Apply a sequence of context specs (from -c flags) to a Context."""
-    for spec in specs:
-        for key in parse_context_steps(spec):
-            value = next(iter(key.values), None)
-            ctx = ctx.augment(key.name, value)
-    return ctx
+    steps = [
+        (key.name, next(iter(key.values), None))
+        for spec in specs
+        for key in parse_context_steps(spec)
+    ]
+    return ctx.augment_many(steps)
@@ -0,0 +1,38 @@
+"""The 'ccs compile' command."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import click
+
+from ccs.ast import FileImportResolver
+from ccs.cache import atomic_write
+from ccs.cli import cli
+from ccs.search_state import compile_ccs_stream
+
+
+@cli.command(name="compile")
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-o", "--output", type=click.Path(dir_okay=False),
+    help="Where to write the compiled config (default: FILE with a .ccsc suffix).",
+)
+def compile_(file, output):
+    """Compile a CCS file into a binary config.
+
+    Parses FILE and everything it imports, builds the DAG, and writes it
+    along with a fingerprint of the sources. Load the result with --compiled
+    on query, dump and shell, or with Context.from_compiled(). The same
+    sources always give the same bytes.
+    """
+    file_path = Path(file).resolve()
+    out_path = Path(output) if output else file_path.with_suffix(".ccsc")
+    try:
+        with open(file_path) as f:
+            data = compile_ccs_stream(f, str(file_path), FileImportResolver(file_path.parent))
+    except Exception as e:
+        raise click.ClickException(f"Failed to compile {file_path}: {e}") from e
+
+    atomic_write(out_path, data)
+    click.echo(f"Wrote {out_path} ({len(data)} bytes)")
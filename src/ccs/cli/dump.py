@@ -5,10 +5,9 @@ from __future__ import annotations
 from pathlib import Path
 
 import click
-import pyrsistent
 
 from ccs.cli import cli
-from ccs.cli._util import apply_context_specs, load_context
+from ccs.cli._util import apply_context_specs, compiled_option, load_context
 from ccs.dump import dump_dag
 
 
@@ -19,7 +18,8 @@ from ccs.dump import dump_dag
     "-c", "--context", "contexts", multiple=True,
     help="Context constraint: KEY or KEY.VALUE (repeatable).",
 )
-def dump(file, properties, contexts):
+@compiled_option
+def dump(file, properties, contexts, compiled):
     """Canonical dump of rules from a CCS file.
 
     Loads FILE, applies context constraints, and prints a canonical
@@ -27,9 +27,9 @@ def dump(file, properties, contexts):
     only rules setting those properties are shown.
     """
     file_path = Path(file).resolve()
-    ctx = load_context(file_path)
+    ctx = load_context(file_path, compiled=compiled)
     # Enable closed-world assumption so dump reflects context.
-    ctx.poisoned = pyrsistent.s()
+    ctx = ctx.with_poisoning()
     ctx = apply_context_specs(ctx, contexts)
 
     dump_dag(ctx, properties or None)
@@ -8,7 +8,7 @@ from pathlib import Path
 import click
 
 from ccs.cli import cli
-from ccs.cli._util import apply_context_specs, load_context
+from ccs.cli._util import apply_context_specs, compiled_option, load_context
 from ccs.error import AmbiguousPropertyError, MissingPropertyError
 
 
@@ -27,14 +27,15 @@ from ccs.error import AmbiguousPropertyError, MissingPropertyError
     "-t", "--trace", is_flag=True, default=False,
     help="Enable property tracing (prints origin and context path to stderr).",
 )
-def query(file, properties, contexts, show_all, trace):
+@compiled_option
+def query(file, properties, contexts, show_all, trace, compiled):
     """Query properties from a CCS file.
 
     Loads FILE, applies context constraints, and prints the requested
     PROPERTIES. If no properties are specified, all set properties are shown.
     """
     file_path = Path(file).resolve()
-    ctx = load_context(file_path, show_all=show_all, trace=trace)
+    ctx = load_context(file_path, show_all=show_all, trace=trace, compiled=compiled)
     ctx = apply_context_specs(ctx, contexts)
 
     if not properties:
@@ -48,7 +49,7 @@ def query(file, properties, contexts, show_all, trace):
                 click.echo(f"{prop}: <not set>", err=True)
                 errors = True
             else:
-                for p, specificity in accum.values:
+                for p, specificity in accum.all():
                     click.echo(f"{prop} = {p.value}  (specificity: {specificity}, origin: {p.origin})")
         else:
             try:
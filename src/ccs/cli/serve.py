@@ -0,0 +1,60 @@
+"""The 'ccs serve' command."""
+
+from __future__ import annotations
+
+import signal
+from pathlib import Path
+
+import click
+
+from ccs.cli import cli
+from ccs.reload import ConfigHandle
+from ccs.server import QueryServer
+
+
+@cli.command()
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-s", "--socket", "socket_path", required=True, type=click.Path(dir_okay=False),
+    help="Path of the Unix domain socket to listen on.",
+)
+@click.option(
+    "--watch/--no-watch", default=True,
+    help="Reload the config when any of its files changes (default: on).",
+)
+@click.option(
+    "--incremental", is_flag=True, default=False,
+    help="Patch the previous DAG on reload rather than rebuilding it.",
+)
+@click.option(
+    "--poll-interval", type=float, default=1.0, show_default=True,
+    help="Seconds between checks for changed files.",
+)
+def serve(file, socket_path, watch, incremental, poll_interval):
+    """Serve queries against a CCS file over a Unix domain socket.
+
+    Loads FILE and keeps it in memory, reloading it as it changes, and
+    answers requests from ccs.client.Client (or anything else speaking the
+    protocol in ccs.protocol) until interrupted.
+    """
+    file_path = Path(file).resolve()
+    try:
+        handle = ConfigHandle(
+            file_path,
+            lazy=True,
+            watch=watch,
+            poll_interval=poll_interval,
+            incremental=incremental,
+        )
+    except Exception as e:
+        raise click.ClickException(f"Failed to load {file_path}: {e}") from e
+
+    server = QueryServer(handle)
+    signal.signal(signal.SIGTERM, lambda *_: server.close())
+    click.echo(f"Serving {file_path} on {socket_path}")
+    try:
+        server.run(socket_path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        handle.close()
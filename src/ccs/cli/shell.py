@@ -2,13 +2,13 @@
 
 from __future__ import annotations
 
+from bisect import bisect_left
 from pathlib import Path
 
 import click
-import pyrsistent
 
 from ccs.cli import cli
-from ccs.cli._util import apply_context_specs, load_context, parse_context_steps
+from ccs.cli._util import apply_context_specs, compiled_option, load_context, parse_context_steps
 from ccs.dump import dump_dag
 from ccs.error import AmbiguousPropertyError, MissingPropertyError
 from ccs.search_state import suggest_context
@@ -33,6 +33,14 @@ def _context_path(ctx):
     return " > ".join(parts)
 
 
+def _with_prefix(names, prefix):
+    """The names in sorted list names which start with prefix."""
+    for i in range(bisect_left(names, prefix), len(names)):
+        if not names[i].startswith(prefix):
+            break
+        yield names[i]
+
+
 def _make_prompt(ctx):
     path = _context_path(ctx)
     if path:
@@ -80,8 +88,9 @@ class CcsCompleter(Completer):
             if cmd == "get" and arg_prefix == "-":
                 yield Completion("-a", start_position=-1)
                 return
-            for prop_name in sorted(self.state.ctx.props.keys()):
-                if prop_name.startswith(arg_prefix):
+            ctx = self.state.ctx
+            for prop_name in _with_prefix(ctx.graph.prop_names(), arg_prefix):
+                if prop_name in ctx.props:
                     yield Completion(prop_name, start_position=-len(arg_prefix))
 
         elif cmd == "add":
@@ -216,7 +225,7 @@ def _cmd_get(state, arg):
         if accum is None:
             click.echo(f"{prop}: <not set>", err=True)
         else:
-            for p, specificity in accum.values:
+            for p, specificity in accum.all():
                 click.echo(f"{prop} = {p.value}  (specificity: {specificity}, origin: {p.origin})")
     else:
         try:
@@ -338,7 +347,8 @@ def _run_repl(state):
     "-c", "--context", "contexts", multiple=True,
     help="Initial context constraint: KEY or KEY.VALUE (repeatable).",
 )
-def shell(file, contexts):
+@compiled_option
+def shell(file, contexts, compiled):
     """Interactive shell for exploring a CCS configuration.
 
     Loads FILE and enters an interactive REPL where you can incrementally
@@ -346,9 +356,9 @@ def shell(file, contexts):
     what context elements would activate additional properties.
     """
     file_path = Path(file).resolve()
-    root_ctx = load_context(file_path, show_all=True)
+    root_ctx = load_context(file_path, show_all=True, compiled=compiled)
     # Enable closed-world assumption so dump/suggest reflect current context.
-    root_ctx.poisoned = pyrsistent.s()
+    root_ctx = root_ctx.with_poisoning()
 
     state = ShellState(root_ctx)
     if contexts:
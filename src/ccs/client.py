@@ -0,0 +1,401 @@
+"""Clients for the query server (see ccs.server).
+
+A query is a list of context steps, as for Context.augment_many() (or a
+mapping from key to value), and the names of the properties wanted in the
+resulting context. Its answers come back as a Result, which looks up values
+much as a Context does:
+
+    with Client("/run/ccs.sock") as client:
+        result = client.query({"env": "prod"}, ["db.host", "db.port"])
+        host = result.get_single_value("db.host")
+
+Client is for threads: it keeps a pool of connections, each used by one
+request at a time. batch() sends several queries in one request, and
+pipeline() sends several requests on one connection without waiting for
+each answer before sending the next. AsyncClient is for asyncio: its
+connections are shared, so concurrent queries are pipelined on them.
+
+Both record the round-trip time of each request in latency.
+"""
+
+import asyncio
+import collections
+import itertools
+import json
+import socket
+import threading
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from ccs import protocol
+from ccs.error import (
+    AmbiguousPropertyError,
+    CcsError,
+    EmptyPropertyError,
+    MissingPropertyError,
+)
+from ccs.protocol import LatencyStats, ProtocolError, Reader
+
+_ERRORS = {
+    protocol.MISSING: MissingPropertyError,
+    protocol.EMPTY: EmptyPropertyError,
+    protocol.AMBIGUOUS: AmbiguousPropertyError,
+}
+
+
+class ServerError(CcsError):
+    """The server couldn't answer a request."""
+
+
+class Result(Mapping):
+    """The answers to one query: a read-only mapping from each property name
+    that had a single value to that value. The other names asked for are in
+    errors, with the error Context.get_single_value() would have raised."""
+
+    def __init__(self, names: Sequence[str], answers: Sequence[protocol.Answer]) -> None:
+        self.values: Dict[str, str] = {}
+        self.errors: Dict[str, CcsError] = {}
+        for name, (kind, text) in zip(names, answers):
+            if kind == protocol.VALUE:
+                self.values[name] = text
+            else:
+                self.errors[name] = _ERRORS.get(kind, CcsError)(text)
+
+    def __getitem__(self, name: str) -> str:
+        return self.values[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.values)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def get_single_value(self, name: str) -> str:
+        if name in self.errors:
+            raise self.errors[name]
+        try:
+            return self.values[name]
+        except KeyError:
+            raise MissingPropertyError(f"Property {name} wasn't asked for") from None
+
+    def __repr__(self):
+        return f"Result({self.values!r}, errors={list(self.errors)!r})"
+
+
+def _steps(steps) -> list:
+    return list(steps.items() if isinstance(steps, Mapping) else steps)
+
+
+def _queries(queries) -> List[protocol.Query]:
+    return [(_steps(steps), list(names)) for steps, names in queries]
+
+
+def _parse(payload: bytes, request_id: int) -> Reader:
+    """A Reader positioned at the body of an OK response to request_id."""
+    r = Reader(payload)
+    try:
+        got, status = protocol.RESPONSE.unpack_from(payload)
+    except Exception:
+        raise ProtocolError("truncated response") from None
+    if got != request_id:
+        raise ProtocolError(f"response to request {got}, expected {request_id}")
+    r.offset = protocol.RESPONSE.size
+    if status != protocol.STATUS_OK:
+        raise ServerError(r.str32())
+    return r
+
+
+def _results(queries: List[protocol.Query], r: Reader) -> List[Result]:
+    answers = protocol.read_answers(r)
+    if len(answers) != len(queries):
+        raise ProtocolError("wrong number of answers")
+    return [Result(names, a) for (_, names), a in zip(queries, answers)]
+
+
+def _stats(r: Reader) -> dict:
+    stats = json.loads(r.str32())
+    r.end()
+    return stats
+
+
+class _Connection:
+    def __init__(self, path, timeout) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.settimeout(timeout)
+            self.sock.connect(str(path))
+        except BaseException:
+            self.sock.close()
+            raise
+        self.file = self.sock.makefile("rb")
+        self.ids = itertools.count()
+
+    def next_id(self) -> int:
+        return next(self.ids) & 0xFFFFFFFF
+
+    def send(self, frame: bytes) -> None:
+        self.sock.sendall(frame)
+
+    def receive(self) -> bytes:
+        header = self.file.read(protocol.FRAME.size)
+        if len(header) < protocol.FRAME.size:
+            raise ConnectionError("connection closed by server")
+        (size,) = protocol.FRAME.unpack(header)
+        payload = self.file.read(size)
+        if len(payload) < size:
+            raise ConnectionError("connection closed by server")
+        return payload
+
+    def close(self) -> None:
+        self.file.close()
+        self.sock.close()
+
+
+class Client:
+    """A pooled, thread-safe client for a query server at path.
+
+    At most pool_size connections are open at once; a request made while
+    all of them are in use waits for one. Idle connections are kept for
+    reuse, and a connection that fails is dropped. timeout, if given,
+    applies to each socket operation."""
+
+    def __init__(self, path, *, pool_size: int = 4, timeout: Optional[float] = None) -> None:
+        self.path = path
+        self.timeout = timeout
+        self.latency = LatencyStats()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._idle: List[_Connection] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _connection(self) -> Iterator[_Connection]:
+        with self._slots:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = _Connection(self.path, self.timeout)
+            try:
+                yield conn
+            except BaseException:
+                # whatever was in flight on it is lost
+                conn.close()
+                raise
+            with self._lock:
+                self._idle.append(conn)
+
+    def _request(self, make, read):
+        with self._connection() as conn:
+            request_id = conn.next_id()
+            start = time.perf_counter()
+            conn.send(make(request_id))
+            payload = conn.receive()
+            self.latency.record(time.perf_counter() - start)
+            # checked before the connection goes back to the pool, so that one
+            # out of step with its responses is closed instead. an error
+            # response leaves it in step, and so in the pool.
+            try:
+                r = _parse(payload, request_id)
+            except ServerError as e:
+                error = e
+            else:
+                error = None
+        if error is not None:
+            raise error
+        return read(r)
+
+    def query(self, steps, names: Iterable[str]) -> Result:
+        """The answers for names in the context reached by steps."""
+        return self.batch([(steps, names)])[0]
+
+    def batch(self, queries) -> List[Result]:
+        """The answers to several (steps, names) queries, sent as one request."""
+        queries = _queries(queries)
+        return self._request(
+            lambda request_id: protocol.query_request(request_id, queries),
+            lambda r: _results(queries, r),
+        )
+
+    def pipeline(self, queries, *, depth: int = 32) -> List[Result]:
+        """The answers to several (steps, names) queries, each sent as its own
+        request on one connection, with up to depth of them in flight."""
+        queries = _queries(queries)
+        results = []
+        with self._connection() as conn:
+            in_flight = collections.deque()
+
+            def receive():
+                request_id, query, start = in_flight.popleft()
+                payload = conn.receive()
+                self.latency.record(time.perf_counter() - start)
+                results.append(_results([query], _parse(payload, request_id))[0])
+
+            for query in queries:
+                if len(in_flight) >= depth:
+                    receive()
+                request_id = conn.next_id()
+                in_flight.append((request_id, query, time.perf_counter()))
+                conn.send(protocol.query_request(request_id, [query]))
+            while in_flight:
+                receive()
+        return results
+
+    def stats(self) -> dict:
+        """The server's statistics."""
+        return self._request(protocol.stats_request, _stats)
+
+    def close(self) -> None:
+        """Close the idle connections. Ones in use are closed as they're
+        returned, or reused if the client is used again."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class _AsyncConnection:
+    """One connection, on which any number of requests can be in flight.
+    Responses come back in request order, so each resolves the oldest
+    waiting future."""
+
+    def __init__(self, reader, writer, latency) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.latency = latency
+        self.pending = collections.deque()
+        self.ids = itertools.count()
+        self.closed = False
+        self.task = asyncio.get_running_loop().create_task(self._receive())
+
+    async def request(self, make) -> tuple:
+        if self.closed:
+            raise ConnectionError("connection closed")
+        request_id = next(self.ids) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        # no await between queueing the future and writing the request, so
+        # requests go out in the same order as the futures wait
+        self.pending.append((future, time.perf_counter()))
+        self.writer.write(make(request_id))
+        await self.writer.drain()
+        return request_id, await future
+
+    async def _receive(self) -> None:
+        error: BaseException = ConnectionError("connection closed by server")
+        try:
+            while True:
+                (size,) = protocol.FRAME.unpack(
+                    await self.reader.readexactly(protocol.FRAME.size)
+                )
+                payload = await self.reader.readexactly(size)
+                future, start = self.pending.popleft()
+                self.latency.record(time.perf_counter() - start)
+                if not future.done():
+                    future.set_result(payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except IndexError:
+            error = ProtocolError("response to no request")
+        except BaseException as e:
+            error = e
+            if isinstance(e, asyncio.CancelledError):
+                error = ConnectionError("connection closed")
+        finally:
+            self.closed = True
+            while self.pending:
+                future, _ = self.pending.popleft()
+                if not future.done():
+                    future.set_exception(error)
+
+    async def close(self) -> None:
+        self.closed = True
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+
+class AsyncClient:
+    """An asyncio client for a query server at path.
+
+    Requests go to the least busy of up to pool_size connections, opened as
+    needed, and are pipelined on it. Closed or failed connections are
+    replaced on later requests. Use from one event loop only."""
+
+    def __init__(self, path, *, pool_size: int = 4) -> None:
+        self.path = path
+        self.pool_size = pool_size
+        self.latency = LatencyStats()
+        self._connections: List[_AsyncConnection] = []
+        self._connecting: Optional[asyncio.Future] = None
+
+    async def _connection(self) -> _AsyncConnection:
+        self._connections = [c for c in self._connections if not c.closed]
+        idle = min(self._connections, key=lambda c: len(c.pending), default=None)
+        if idle is not None and (not idle.pending or len(self._connections) >= self.pool_size):
+            return idle
+        if self._connecting is None:
+            # one connection is opened at a time; other callers wait for it
+            self._connecting = asyncio.ensure_future(self._connect())
+        connecting = self._connecting
+        try:
+            return await asyncio.shield(connecting)
+        finally:
+            if self._connecting is connecting and connecting.done():
+                self._connecting = None
+
+    async def _connect(self) -> _AsyncConnection:
+        reader, writer = await asyncio.open_unix_connection(str(self.path))
+        conn = _AsyncConnection(reader, writer, self.latency)
+        self._connections.append(conn)
+        return conn
+
+    async def _request(self, make, read):
+        conn = await self._connection()
+        request_id, payload = await conn.request(make)
+        try:
+            r = _parse(payload, request_id)
+        except ProtocolError:
+            # out of step with its responses, so no use to later requests
+            await conn.close()
+            raise
+        return read(r)
+
+    async def query(self, steps, names: Iterable[str]) -> Result:
+        """The answers for names in the context reached by steps."""
+        return (await self.batch([(steps, names)]))[0]
+
+    async def batch(self, queries) -> List[Result]:
+        """The answers to several (steps, names) queries, sent as one request."""
+        queries = _queries(queries)
+        return await self._request(
+            lambda request_id: protocol.query_request(request_id, queries),
+            lambda r: _results(queries, r),
+        )
+
+    async def stats(self) -> dict:
+        """The server's statistics."""
+        return await self._request(protocol.stats_request, _stats)
+
+    async def close(self) -> None:
+        connections, self._connections = self._connections, []
+        for conn in connections:
+            await conn.close()
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
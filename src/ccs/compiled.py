@@ -0,0 +1,602 @@
+"""Array-backed form of a built Dag.
+
+compile_dag() numbers the nodes of a Dag densely, in topological order, and
+stores the graph in flat arrays indexed by node id: children, properties and
+constraints in CSR form (an offsets array plus one flat array of entries),
+and node kind, specificity and tally count in parallel arrays. Literal
+matchers map each value to a range of a flat array of literal node ids.
+
+NodeArray is the persistent per-node state a Context keeps over those ids,
+and activate() and poison() walk the graph to update it. Poisoning defers the
+poison() walks until the flags are read.
+"""
+
+from array import array
+from collections import deque
+
+from ccs.dag import AndNode, DagStats, Key, Specificity
+
+
+class CompiledMatcher:
+    """The compiled counterpart of a LiteralMatcher.
+
+    wildcard is a node id, or None if there is no wildcard node. positive_values
+    maps each value to a range of indices into CompiledDag.literal_ids."""
+
+    __slots__ = ("wildcard", "positive_values")
+
+    def __init__(self, wildcard=None, positive_values=None):
+        self.wildcard = wildcard
+        self.positive_values = positive_values if positive_values is not None else {}
+
+
+class CompiledDag:
+    """A Dag stored as parallel arrays over dense node ids.
+
+    Ids are assigned in topological order, so every node's id is smaller than
+    those of its children. The root (property) node is always id 0, and so is
+    the all-zero specificity, which OrNodes are given."""
+
+    ROOT = 0
+    ZERO_SPEC = 0
+
+    def __init__(self):
+        self.is_and = array("B")
+        self.spec_ids = array("I")
+        # unique Specificity values, indexed by spec_ids
+        self.specificities = [Specificity(0, 0, 0, 0)]
+        self.tally_counts = array("I")
+        self.child_offsets = array("I", [0])
+        self.child_ids = array("I")
+        self.prop_offsets = array("I", [0])
+        self.props = []
+        self.constraint_offsets = array("I", [0])
+        self.constraints = []
+        self.literal_ids = array("I")
+        self.children = {}  # key name -> CompiledMatcher
+        # set when loaded from an artifact; see artifact.fingerprint()
+        self.source_fingerprint = None
+        # reverse edges, in the same CSR form as the children
+        self.parent_offsets = array("I", [0])
+        self.parent_ids = array("I")
+        self._literal_keys = None
+        self._prop_index = None
+        self._prop_names = None
+        self._reachable_props = None
+        self.augment_cache = None  # optional search_state.AugmentCache
+        # search_state.ContextTries used by Context.from_mapping
+        self.context_tries = {}
+        self.context_trie_size = 4096
+        self._initial_tallies = None
+        self._key_ranks = None
+        # root context state by accumulator, and root Contexts by accumulator
+        # and tracer; see search_state.root_context().
+        self.root_states = {}
+        self.root_contexts = {}
+
+    def __len__(self):
+        return len(self.is_and)
+
+    def build_parents(self):
+        """Fill in parent_offsets and parent_ids from the child edges."""
+        parents = [[] for _ in range(len(self))]
+        for n in range(len(self)):
+            for child in self.node_children(n):
+                parents[child].append(n)
+        self.parent_ids = array("I")
+        self.parent_offsets = array("I", [0])
+        for ps in parents:
+            self.parent_ids.extend(ps)
+            self.parent_offsets.append(len(self.parent_ids))
+
+    @property
+    def literal_keys(self):
+        """The Key each literal node matches, by node id."""
+        if self._literal_keys is None:
+            # a literal node for a set of values appears under each of them
+            literal_values = {}
+            for name, matcher in self.children.items():
+                if matcher.wildcard is not None:
+                    literal_values[matcher.wildcard] = (name, set())
+                for value, ids_range in matcher.positive_values.items():
+                    for n in self.literal_nodes(ids_range):
+                        values = literal_values.setdefault(n, (name, set()))[1]
+                        if value:
+                            values.add(value)
+            self._literal_keys = {
+                n: Key(name, values) for n, (name, values) in literal_values.items()
+            }
+        return self._literal_keys
+
+    def compiled(self):
+        return self
+
+    def root_context(self, prop_accumulator=None, *, trace_properties=None, lazy=False):
+        from ccs.search_state import root_context  # search_state depends on this module
+
+        return root_context(
+            self, prop_accumulator, trace_properties=trace_properties, lazy=lazy
+        )
+
+    def node_children(self, n):
+        return self.child_ids[self.child_offsets[n] : self.child_offsets[n + 1]]
+
+    def node_props(self, n):
+        return self.props[self.prop_offsets[n] : self.prop_offsets[n + 1]]
+
+    def node_parents(self, n):
+        return self.parent_ids[self.parent_offsets[n] : self.parent_offsets[n + 1]]
+
+    def ancestors(self, nodes):
+        """The given nodes and every node with a path to one of them."""
+        seen = set(nodes)
+        stack = list(seen)
+        parent_ids, parent_offsets = self.parent_ids, self.parent_offsets
+        while stack:
+            n = stack.pop()
+            for i in range(parent_offsets[n], parent_offsets[n + 1]):
+                parent = parent_ids[i]
+                if parent not in seen:
+                    seen.add(parent)
+                    stack.append(parent)
+        return seen
+
+    def node_constraints(self, n):
+        return self.constraints[self.constraint_offsets[n] : self.constraint_offsets[n + 1]]
+
+    def initial_tallies(self):
+        """tally_counts as a NodeArray, the starting state of every Context."""
+        if self._initial_tallies is None:
+            self._initial_tallies = NodeArray.of(self.tally_counts)
+        return self._initial_tallies
+
+    def key_ranks(self):
+        """A stable rank for each key name in the Dag.
+
+        Keys with fewer distinct values rank first, then by name. Contexts
+        built in rank order share more of their leading steps."""
+        if self._key_ranks is None:
+            names = sorted(
+                self.children, key=lambda name: (len(self.children[name].positive_values), name)
+            )
+            self._key_ranks = {name: i for i, name in enumerate(names)}
+        return self._key_ranks
+
+    def prop_index(self):
+        """A dict from property name to the (node id, Property) pairs setting it,
+        in node order."""
+        if self._prop_index is None:
+            index = {}
+            offsets = self.prop_offsets
+            for n in range(len(self)):
+                for name, prop in self.props[offsets[n] : offsets[n + 1]]:
+                    index.setdefault(name, []).append((n, prop))
+            self._prop_index = index
+        return self._prop_index
+
+    def prop_names(self):
+        """Every property name set anywhere in the Dag, sorted."""
+        if self._prop_names is None:
+            self._prop_names = sorted(self.prop_index())
+        return self._prop_names
+
+    def reachable_props(self):
+        """For each node, the names of the properties set on it or on any node
+        below it, and whether any of those nodes has constraints.
+
+        Returns a pair of lists indexed by node id. Nodes which add nothing to
+        a single child share its set."""
+        if self._reachable_props is None:
+            names = [frozenset()] * len(self)
+            constrained = [False] * len(self)
+            for n in reversed(range(len(self))):
+                children = self.node_children(n)
+                own = {name for name, _ in self.node_props(n)}
+                if not own and len(children) == 1:
+                    names[n] = names[children[0]]
+                else:
+                    names[n] = frozenset(own.union(*(names[c] for c in children)))
+                constrained[n] = bool(self.node_constraints(n)) or any(
+                    constrained[c] for c in children
+                )
+            self._reachable_props = (names, constrained)
+        return self._reachable_props
+
+    def specificity(self, n):
+        return self.specificities[self.spec_ids[n]]
+
+    def literal_nodes(self, ids_range):
+        return self.literal_ids[ids_range.start : ids_range.stop]
+
+    def stats(self):
+        """The same figures as Dag.stats() gives for the source Dag."""
+        stats = DagStats()
+        stats.literals = len(self.children)
+        stats.nodes = len(self)
+        stats.props = len(self.props)
+        stats.edges = len(self.child_ids)
+        offsets = self.child_offsets
+        for n in range(len(self)):
+            fanout = offsets[n + 1] - offsets[n]
+            stats.fanout_max = max(stats.fanout_max, fanout)
+            if fanout:
+                stats.nodes_with_fanout += 1
+            if self.is_and[n]:
+                stats.tally_max = max(stats.tally_max, self.tally_counts[n])
+                stats.tally_total += self.tally_counts[n]
+        stats.fanout_total = stats.edges
+        return stats
+
+
+def topological_order(dag):
+    """All nodes reachable from dag's root and literals, parents before children.
+
+    Sources are taken root first, then literal nodes in matcher order, and
+    children in list order, so the numbering is deterministic for a given Dag."""
+    sources = [dag.prop_node]
+    for matcher in dag.children.values():
+        if matcher.wildcard:
+            sources.append(matcher.wildcard)
+        for nodes in matcher.positive_values.values():
+            sources.extend(nodes)
+
+    in_degree = {}
+    stack = list(sources)
+    while stack:
+        node = stack.pop()
+        if node in in_degree:
+            continue
+        in_degree[node] = 0
+        stack.extend(node.children)
+    for node in in_degree:
+        for child in node.children:
+            in_degree[child] += 1
+
+    order = []
+    ready = deque(n for n in dict.fromkeys(sources) if in_degree[n] == 0)
+    while ready:
+        node = ready.popleft()
+        order.append(node)
+        for child in node.children:
+            in_degree[child] -= 1
+            if in_degree[child] == 0:
+                ready.append(child)
+    assert len(order) == len(in_degree), "dag has a cycle"
+    return order
+
+
+def compile_dag(dag):
+    """Build a CompiledDag from a Dag. The Dag itself is left untouched."""
+    order = topological_order(dag)
+    assert order[0] is dag.prop_node
+    ids = {node: i for i, node in enumerate(order)}
+
+    compiled = CompiledDag()
+    spec_ids = {spec: i for i, spec in enumerate(compiled.specificities)}
+    for node in order:
+        is_and = isinstance(node, AndNode)
+        spec = node.specificity if is_and else Specificity(0, 0, 0, 0)
+        if spec not in spec_ids:
+            spec_ids[spec] = len(compiled.specificities)
+            compiled.specificities.append(spec)
+        compiled.is_and.append(is_and)
+        compiled.spec_ids.append(spec_ids[spec])
+        compiled.tally_counts.append(node.tally_count)
+        compiled.child_ids.extend(ids[child] for child in node.children)
+        compiled.child_offsets.append(len(compiled.child_ids))
+        compiled.props.extend(node.props)
+        compiled.prop_offsets.append(len(compiled.props))
+        compiled.constraints.extend(node.constraints)
+        compiled.constraint_offsets.append(len(compiled.constraints))
+
+    for name, matcher in dag.children.items():
+        out = CompiledMatcher(ids[matcher.wildcard] if matcher.wildcard else None)
+        for value, nodes in matcher.positive_values.items():
+            start = len(compiled.literal_ids)
+            compiled.literal_ids.extend(ids[node] for node in nodes)
+            out.positive_values[value] = range(start, len(compiled.literal_ids))
+        compiled.children[name] = out
+
+    compiled.build_parents()
+    return compiled
+
+
+class NodeArray:
+    """A persistent array of unsigned ints indexed by node id.
+
+    Values are kept in fixed-size chunks. Forking shares every chunk, and an
+    evolver copies only the chunks it writes to, so a context's state costs
+    one chunk per chunk touched rather than one entry per node touched."""
+
+    __slots__ = ("chunks",)
+
+    CHUNK_BITS = 8
+    CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    @classmethod
+    def of(cls, values):
+        size = 1 << cls.CHUNK_BITS
+        return cls(tuple(array("I", values[i : i + size]) for i in range(0, len(values), size)))
+
+    @classmethod
+    def zeros(cls, length):
+        # every chunk starts out as the same shared array; writes copy it first.
+        size = 1 << cls.CHUNK_BITS
+        zero = array("I", [0]) * size
+        return cls((zero,) * ((length + size - 1) >> cls.CHUNK_BITS))
+
+    def __getitem__(self, i):
+        return self.chunks[i >> self.CHUNK_BITS][i & self.CHUNK_MASK]
+
+    def evolver(self):
+        return NodeArrayEvolver(self)
+
+
+class NodeArrayEvolver:
+    """A mutable view of a NodeArray which copies chunks on first write."""
+
+    __slots__ = ("base", "chunks", "owned")
+
+    def __init__(self, base):
+        self.base = base
+        self.chunks = base.chunks
+        self.owned = None
+
+    def __getitem__(self, i):
+        return self.chunks[i >> NodeArray.CHUNK_BITS][i & NodeArray.CHUNK_MASK]
+
+    def __setitem__(self, i, value):
+        c = i >> NodeArray.CHUNK_BITS
+        if self.owned is None:
+            self.chunks = list(self.chunks)
+            self.owned = set()
+        if c not in self.owned:
+            self.chunks[c] = array("I", self.chunks[c])
+            self.owned.add(c)
+        self.chunks[c][i & NodeArray.CHUNK_MASK] = value
+
+    def persistent(self):
+        """The current values as a NodeArray. The evolver stays usable, and
+        writes made after this don't show through."""
+        if self.owned is not None:
+            self.base = NodeArray(tuple(self.chunks))
+            self.chunks = self.base.chunks
+            self.owned = None
+        return self.base
+
+
+class Poisoning:
+    """The poisoned flags of a Context, computed only when they're read.
+
+    Augmenting a poisoning context with key K and value V poisons the literal
+    nodes for every other value of K, and everything that can then no longer
+    activate. Rather than walk all of those at every step, a Poisoning just
+    records that K was bound to V, along with the tallies at that point (which
+    the walk depends on). The walks are replayed in order the first time
+    flags() is needed, and the result is kept, so each step is walked at most
+    once however many contexts share it.
+
+    Poisoning keeps its own copy of the OrNode tallies it counts down, since
+    activation never looks at them."""
+
+    __slots__ = ("graph", "parent", "binding", "_state")
+
+    def __init__(self, graph, parent=None, binding=None, state=None):
+        self.graph = graph
+        self.parent = parent
+        self.binding = binding  # (key name, value or None, tallies)
+        self._state = state  # (poisoned flags, OrNode tallies)
+
+    @classmethod
+    def start(cls, graph, or_tallies):
+        return cls(graph, state=(NodeArray.zeros(len(graph)), or_tallies))
+
+    def bind(self, name, value, tallies):
+        """The poisoning after binding key name to value, given the tallies
+        (a NodeArray) just after name.value was activated."""
+        if name not in self.graph.children:
+            return self
+        return Poisoning(self.graph, self, (name, value, tallies))
+
+    def __getitem__(self, n):
+        return self.flags()[n]
+
+    def flags(self):
+        """The poisoned flags, as a NodeArray of zeros and ones."""
+        return self.state()[0]
+
+    def or_tallies(self):
+        return self.state()[1]
+
+    def state(self):
+        if self._state is None:
+            pending = []
+            node = self
+            while node._state is None:
+                pending.append(node)
+                node = node.parent
+            graph = self.graph
+            flags, or_tallies = node._state
+            for node in reversed(pending):
+                name, value, tallies = node.binding
+                starts = []
+                for v2, ids in graph.children[name].positive_values.items():
+                    # TODO here, there's a question... if value is None, do
+                    # we insist that no value ever be asserted for key and
+                    # poison everything? or do we remain agnostic, with the
+                    # idea that key.value is still a monotonic refinement of
+                    # just key? for now we assume the former.
+                    if value != v2:
+                        starts.extend(graph.literal_nodes(ids))
+                    # TODO and of course dually negative matches too
+                flags, or_tallies = flags.evolver(), or_tallies.evolver()
+                poison(graph, tallies, or_tallies, flags, starts)
+                flags, or_tallies = flags.persistent(), or_tallies.persistent()
+                # racing threads compute the same state, so either may win
+                node._state = (flags, or_tallies)
+        return self._state
+
+
+def activate(graph, tallies, or_specificities, starts, fired):
+    """Activate each node in starts, and everything that activates as a result.
+
+    tallies and or_specificities are NodeArrayEvolvers. The walk uses an
+    explicit stack rather than recursion, but visits nodes in the same
+    depth-first order, each child with the specificity its parent activated
+    with: an AndNode activates (with its own specificity) when its tally
+    reaches zero, and an OrNode whenever the propagated specificity beats the
+    one it already has. A start node has no propagated specificity, so an
+    OrNode started from keeps its own.
+
+    Every activated node with properties or constraints is appended to fired
+    as (node id, spec id), in activation order. Returns the number of edges
+    followed."""
+    is_and = graph.is_and
+    spec_ids = graph.spec_ids
+    specificities = graph.specificities
+    child_ids, child_offsets = graph.child_ids, graph.child_offsets
+    prop_offsets = graph.prop_offsets
+    constraint_offsets = graph.constraint_offsets
+
+    edges = 0
+    stack = [(n, None) for n in reversed(starts)]
+    pop, push = stack.pop, stack.extend
+    while stack:
+        n, spec = pop()
+        if is_and[n]:
+            count = tallies[n]
+            if count == 0:
+                continue
+            tallies[n] = count - 1
+            if count != 1:
+                continue
+            spec = spec_ids[n]
+        elif spec is None:
+            spec = or_specificities[n]
+        elif specificities[spec] > specificities[or_specificities[n]]:
+            or_specificities[n] = spec
+        else:
+            continue
+        if (
+            prop_offsets[n] != prop_offsets[n + 1]
+            or constraint_offsets[n] != constraint_offsets[n + 1]
+        ):
+            fired.append((n, spec))
+        start, end = child_offsets[n], child_offsets[n + 1]
+        if start != end:
+            # pushed in reverse, so that children are walked in order
+            push([(child_ids[i], spec) for i in range(end - 1, start - 1, -1)])
+            edges += end - start
+    return edges
+
+
+def new_props(graph, tallies, or_specificities, starts, known, useful):
+    """The names of properties, other than those in known, on the nodes that
+    activate() would activate from starts.
+
+    Nothing is modified: tallies and or_specificities (NodeArrays) are read
+    through local overlays. Children whose reachable_props() are all known
+    can't add anything, and neither can anything below them, so they aren't
+    walked; the rest are walked in activate()'s order, which matters when an
+    OrNode activates more than once. useful memoizes that test by node id,
+    and may be shared by calls with the same known."""
+    reach = graph.reachable_props()[0]
+    is_and = graph.is_and
+    spec_ids = graph.spec_ids
+    specificities = graph.specificities
+    child_ids, child_offsets = graph.child_ids, graph.child_offsets
+    prop_offsets = graph.prop_offsets
+    props = graph.props
+
+    tally_chunks, spec_chunks = tallies.chunks, or_specificities.chunks
+    bits, mask = NodeArray.CHUNK_BITS, NodeArray.CHUNK_MASK
+
+    counts = {}
+    specs = {}
+    found = set()
+    stack = []
+    for n in reversed(starts):
+        if n not in useful:
+            useful[n] = not reach[n] <= known
+        if useful[n]:
+            stack.append((n, None))
+    while stack:
+        n, spec = stack.pop()
+        if is_and[n]:
+            count = counts.get(n)
+            if count is None:
+                count = tally_chunks[n >> bits][n & mask]
+            if count == 0:
+                continue
+            counts[n] = count - 1
+            if count != 1:
+                continue
+            spec = spec_ids[n]
+        else:
+            prev = specs.get(n)
+            if prev is None:
+                prev = spec_chunks[n >> bits][n & mask]
+            if spec is None:
+                spec = prev
+            elif specificities[spec] > specificities[prev]:
+                specs[n] = spec
+            else:
+                continue
+        for i in range(prop_offsets[n], prop_offsets[n + 1]):
+            found.add(props[i][0])
+        for i in range(child_offsets[n + 1] - 1, child_offsets[n] - 1, -1):
+            child = child_ids[i]
+            is_useful = useful.get(child)
+            if is_useful is None:
+                is_useful = useful[child] = not reach[child] <= known
+            if is_useful:
+                stack.append((child, spec))
+    return found - known
+
+
+def poison(graph, tallies, or_tallies, poisoned, starts):
+    """Poison each node in starts, and everything that can no longer activate
+    as a result, in the same depth-first order as activate().
+
+    AndNode tallies are read from tallies, and OrNode tallies counted down in
+    or_tallies, which may be the same array. or_tallies and poisoned are
+    NodeArrayEvolvers. Returns the number of edges followed."""
+    is_and = graph.is_and
+    child_ids, child_offsets = graph.child_ids, graph.child_offsets
+
+    edges = 0
+    stack = list(reversed(starts))
+    pop, push = stack.pop, stack.extend
+    while stack:
+        n = pop()
+        if is_and[n]:
+            # a bit of care is required here, since we build tally-one
+            # conjunction nodes for literals, even when they represent
+            # disjunctions of multiple values.
+            # TODO this is starting to feel a bit too cute and tricky,
+            # might be time to build those in a more obvious way and use
+            # a more explicit technique to ensure uniqueness of literal
+            # values in context.
+            # but anyway, because of that, and because we always activate
+            # prior to poisoning, we can avoid incorrectly poisoning a
+            # literal node just by checking to see whether it's already
+            # been fully activated. that's the only scenario in which this
+            # can happen, so it's sufficient to detect it.
+            if tallies[n] == 0 or poisoned[n]:
+                continue
+        else:
+            count = or_tallies[n]
+            if count == 0:
+                continue
+            or_tallies[n] = count - 1
+            if count != 1:
+                continue
+        poisoned[n] = 1
+        start, end = child_offsets[n], child_offsets[n + 1]
+        if start != end:
+            push(child_ids[start:end][::-1])
+            edges += end - start
+    return edges
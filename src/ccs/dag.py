@@ -1,6 +1,7 @@
-from collections import defaultdict, namedtuple
+import gc
+from collections import Counter, defaultdict, namedtuple
 from functools import total_ordering
-import heapq
+from itertools import chain
 
 
 class Specificity(
@@ -73,10 +74,34 @@ class LiteralMatcher:
             assert not self.wildcard
             self.wildcard = node
 
-        for value in values:
+        for value in sorted(values):
             self.positive_values[value].append(node)
         # TODO handle negatives
 
+    def remove_values(self, values, node):
+        """Undo add_values(values, node)."""
+        if len(values) == 0:
+            assert self.wildcard is node
+            self.wildcard = None
+
+        for value in values:
+            nodes = self.positive_values[value]
+            nodes.remove(node)
+            if not nodes:
+                del self.positive_values[value]
+
+    def is_empty(self):
+        return self.wildcard is None and not self.positive_values
+
+    def copy(self, nodes):
+        """A copy of this matcher, matching nodes[n] wherever this matches n."""
+        matcher = LiteralMatcher()
+        if self.wildcard is not None:
+            matcher.wildcard = nodes[self.wildcard]
+        for value, matched in self.positive_values.items():
+            matcher.positive_values[value] = [nodes[n] for n in matched]
+        return matcher
+
 
 class Node:
     def __init__(self):
@@ -150,6 +175,66 @@ class Dag:
     def __init__(self):
         self.children = defaultdict(LiteralMatcher)
         self.prop_node = OrNode()
+        self.augment_cache = None  # optional search_state.AugmentCache
+        self._compiled = None
+        # search_state.ContextTries used by Context.from_mapping
+        self.context_tries = {}
+        self.context_trie_size = 4096
+
+    def compiled(self):
+        """The CompiledDag for this Dag, built on first use. The Dag must not be
+        modified after this is called."""
+        if self._compiled is None:
+            from ccs.compiled import compile_dag  # compiled depends on this module
+
+            self._compiled = compile_dag(self)
+        return self._compiled
+
+    def copy(self):
+        """A Dag with its own copies of this one's nodes and matchers, so that
+        nothing done to either afterwards affects the other. Props and
+        constraints are shared, but not the lists holding them."""
+        sources = [self.prop_node]
+        for matcher in self.children.values():
+            if matcher.wildcard is not None:
+                sources.append(matcher.wildcard)
+            for matched in matcher.positive_values.values():
+                sources += matched
+        # the copies make no reference cycles, so the collector is paused while
+        # they're made; on a large Dag it would otherwise spend most of the
+        # time scanning everything else on the heap.
+        paused = gc.isenabled()
+        gc.disable()
+        try:
+            nodes = {}
+            stack = sources
+            while stack:
+                node = stack.pop()
+                if node not in nodes:
+                    clone = nodes[node] = object.__new__(type(node))
+                    clone.__dict__.update(node.__dict__)
+                    stack += node.children
+            for node in nodes.values():
+                node.children = [nodes[child] for child in node.children]
+                node.props = list(node.props)
+                node.constraints = list(node.constraints)
+        finally:
+            if paused:
+                gc.enable()
+
+        dag = Dag()
+        dag.prop_node = nodes[self.prop_node]
+        for name, matcher in self.children.items():
+            dag.children[name] = matcher.copy(nodes)
+        return dag
+
+    def root_context(self, prop_accumulator=None, *, trace_properties=None, lazy=False):
+        """The root Context for this Dag, built once per accumulator and tracer."""
+        from ccs.search_state import root_context  # search_state depends on this module
+
+        return root_context(
+            self, prop_accumulator, trace_properties=trace_properties, lazy=lazy
+        )
 
     def stats(self):
         stats = DagStats()
@@ -171,6 +256,7 @@ class Rank:
     def __init__(self, elem):
         self.weight = len(elem)
         self.elem = elem
+        self.pos = None  # index in a RankHeap, while queued
 
     def __eq__(self, other):
         return self.weight == other.weight and self.elem == other.elem
@@ -181,6 +267,90 @@ class Rank:
         return self.weight > other.weight
 
 
+class RankHeap:
+    """A binary heap of Ranks which tracks each rank's position, so that a rank
+    whose weight has dropped can be moved down in place instead of re-heapifying."""
+
+    def __init__(self, ranks):
+        self.heap = sorted(ranks)  # a sorted list is already a heap
+        for i, rank in enumerate(self.heap):
+            rank.pos = i
+
+    def __len__(self):
+        return len(self.heap)
+
+    def top(self):
+        return self.heap[0]
+
+    def pop(self):
+        heap = self.heap
+        best, last = heap[0], heap.pop()
+        best.pos = None
+        if heap:
+            heap[0] = last
+            last.pos = 0
+            self._sift_down(0)
+        return best
+
+    def decrease(self, rank):
+        """Restore the heap after rank's weight has been lowered."""
+        if rank.pos is not None:
+            self._sift_down(rank.pos)
+
+    def _sift_down(self, i):
+        heap = self.heap
+        rank = heap[i]
+        end = len(heap)
+        while (child := 2 * i + 1) < end:
+            if child + 1 < end and heap[child + 1] < heap[child]:
+                child += 1
+            if not heap[child] < rank:
+                break
+            heap[i] = heap[child]
+            heap[i].pos = i
+            i = child
+        heap[i] = rank
+        rank.pos = i
+
+
+class SubsetIndex(dict):
+    """A dict of built sub-expressions that can find the subsets of an expression.
+
+    Keeps an inverted index from each element to the keys containing it, so
+    subsets_of() only visits keys sharing an element with the expression rather
+    than every key built so far."""
+
+    def __init__(self):
+        super().__init__()
+        self.exprs = []
+        self.sizes = []
+        self.positions = {}
+        self.postings = defaultdict(list)
+
+    def __setitem__(self, expr, node):
+        if expr not in self:
+            # postings hold positions in self.exprs, which are cheaper to count
+            # than the expressions themselves.
+            for el in expr.elements():
+                self.postings[el].append(len(self.exprs))
+            self.positions[expr] = len(self.exprs)
+            self.exprs.append(expr)
+            self.sizes.append(len(expr))
+        super().__setitem__(expr, node)
+
+    def __delitem__(self, expr):
+        super().__delitem__(expr)
+        # the position stays in the postings, but with a size no count can
+        # reach, so subsets_of() never returns it.
+        self.sizes[self.positions.pop(expr)] = -1
+
+    def subsets_of(self, expr):
+        postings = self.postings
+        hits = Counter(chain.from_iterable(postings.get(el, ()) for el in expr.elements()))
+        sizes, exprs = self.sizes, self.exprs
+        return [exprs[i] for i, count in hits.items() if count == sizes[i]]
+
+
 def build(expr, constructor, base_nodes, these_nodes):
     assert not expr.is_empty()
 
@@ -191,26 +361,25 @@ def build(expr, constructor, base_nodes, these_nodes):
         return these_nodes[expr]
     if len(expr) == 2:
         node = constructor()
-        for el in expr.elements():
+        for el in expr.sorted_elements():
             base_nodes[el].children.append(node)
             node.add_link()
         return node
 
     ranks = defaultdict(list)
     sizes = []
-    for c in these_nodes:
-        if c.issubset(expr):
-            assert len(c) < len(expr), "exact equality handled above"
-            rank = Rank(c)
-            sizes.append(rank)
-            for el in c.elements():
-                ranks[el].append(rank)
-    heapq.heapify(sizes)
+    for c in these_nodes.subsets_of(expr):
+        assert len(c) < len(expr), "exact equality handled above"
+        rank = Rank(c)
+        sizes.append(rank)
+        for el in c.elements():
+            ranks[el].append(rank)
+    sizes = RankHeap(sizes)
     covered = set()
     node = constructor()
 
-    while len(sizes) and sizes[0].weight != 0:
-        best = heapq.heappop(sizes).elem
+    while len(sizes) and sizes.top().weight != 0:
+        best = sizes.pop().elem
         these_nodes[best].children.append(node)
         node.add_link()
         for el in best.elements():
@@ -218,11 +387,11 @@ def build(expr, constructor, base_nodes, these_nodes):
                 covered.add(el)
                 for rank in ranks[el]:
                     rank.weight -= 1
-        # TODO this repeated linear heapify is no good, we need a heap that allows us to
-        # shuffle elements up and down as needed
-        heapq.heapify(sizes)
+                    sizes.decrease(rank)
 
-    for el in expr.elements() - covered:
+    for el in expr.sorted_elements():
+        if el in covered:
+            continue
         base_nodes[el].children.append(node)
         node.add_link()
 
@@ -237,32 +406,63 @@ def add_literal(dag, lit):
     return node
 
 
-def build_dag(rule_tree_nodes):
-    dag = Dag()
-    lit_nodes = {}
+def build_dag(rule_tree_nodes, *, bitsets=True):
+    """Build a Dag from rule tree nodes.
+
+    With bitsets, formulae are first re-encoded as BitFormulae so that the
+    subset tests, hashing and sorting below are integer operations. The
+    resulting Dag is the same either way."""
+    return _build_dag(list(rule_tree_nodes), bitsets)[0]
+
+
+def add_formula_nodes(dag, formulae, lit_nodes, clause_nodes, form_nodes):
+    """Build nodes for those of formulae that are neither empty nor already in
+    form_nodes, along with any literals and clauses they need that aren't
+    yet in lit_nodes and clause_nodes. Each index is updated as nodes are
+    built. Returns the formulae built, in the order they were built."""
+    # deduplicated in order, so formulae given already sorted (and so their
+    # clauses, mostly) sort cheaply
+    added = sorted(dict.fromkeys(f for f in formulae if not f.is_empty() and f not in form_nodes))
     # obviously there are better ways of gathering the unique literals and unique clauses,
     # if performance needs to be improved...
-    sorted_formulae = sorted(rule_tree_nodes, key=lambda n: n.formula)
-    all_clauses = [
-        c for f in sorted_formulae for c in f.formula.clauses | f.formula.shared
-    ]
-    for lit in {lit for c in all_clauses for lit in c.elements()}:
+    clauses = dict.fromkeys(
+        c
+        for f in added
+        for c in f.clauses | f.shared
+        if not c.is_empty() and c not in clause_nodes
+    )
+    # sorted, like everything else here, so that the Dag doesn't depend on
+    # hash order
+    for lit in sorted({lit for c in clauses for lit in c.elements()} - lit_nodes.keys()):
         lit_nodes[lit] = add_literal(dag, lit)
-    clause_nodes = {}
-    for clause in sorted(all_clauses):
-        if not clause.is_empty():
-            clause_nodes[clause] = build(
-                clause, lambda: AndNode(clause.specificity()), lit_nodes, clause_nodes
-            )
-    form_nodes = {}
-    for rule in sorted_formulae:
-        if rule.formula.is_empty():
-            dag.prop_node.props += rule.props
-            dag.prop_node.constraints += rule.constraints
-        else:
-            node = build(rule.formula, lambda: OrNode(), clause_nodes, form_nodes)
-            node.props += rule.props
-            node.constraints += rule.constraints
-            form_nodes[rule.formula] = node
-
-    return dag
+    for clause in sorted(clauses):
+        clause_nodes[clause] = build(
+            clause, lambda c=clause: AndNode(c.specificity()), lit_nodes, clause_nodes
+        )
+    for formula in added:
+        form_nodes[formula] = build(formula, OrNode, clause_nodes, form_nodes)
+    return added
+
+
+def _build_dag(rules, bitsets):
+    """build_dag(), also returning the nodes built for each literal, clause and
+    (non-empty) formula, keyed as they were built."""
+    from ccs.formula import encode  # formula depends on this module
+
+    dag = Dag()
+    formulae = [rule.formula for rule in rules]
+    if bitsets:
+        formulae = encode(formulae)
+    # stable, so rules with the same formula stay in rule tree order
+    order = sorted(range(len(rules)), key=lambda i: formulae[i])
+    lit_nodes = {}
+    clause_nodes = SubsetIndex()
+    form_nodes = SubsetIndex()
+    add_formula_nodes(dag, [formulae[i] for i in order], lit_nodes, clause_nodes, form_nodes)
+    for i in order:
+        rule, formula = rules[i], formulae[i]
+        node = dag.prop_node if formula.is_empty() else form_nodes[formula]
+        node.props += rule.props
+        node.constraints += rule.constraints
+
+    return dag, lit_nodes, clause_nodes, form_nodes
@@ -8,59 +8,24 @@ from __future__ import annotations
 
 import sys
 
-import pyrsistent
-
-from ccs.dag import AndNode, Key
 from ccs.formula import Clause, Formula
 
 
-def top_sort(dag):
-    """Topological sort of DAG nodes, building formula representations.
+def literal_forms(graph, nodes=None):
+    """Clauses for the literal nodes of a CompiledDag.
 
-    Returns (nodes, node_forms) where nodes is in topological order and
-    node_forms maps each node to its Clause or Formula.
+    Returns a dict mapping the id of each literal node (or of each one among
+    nodes, if given) to its Clause. Since node ids are already in topological
+    order, no sort is needed to visit the rest.
     """
-    visited = set()
-    result = []
-
-    def visit(n):
-        if n in visited:
-            return
-        for m in n.children:
-            visit(m)
-        visited.add(n)
-        result.append(n)
-
-    node_forms = {}
-
-    def visit_literal_node(node, name, value=None):
-        # at this point, we know all the nodes are going to be
-        # AndNodes, but we also know that in actual fact they correspond
-        # to disjunctions of literals, so we do something a bit special
-        # to build the clause:
-        assert isinstance(node, AndNode)
-
-        # TODO this won't really work right for disjunctions of a wildcard
-        # plus actual values (as in '(a, a.x, a.y) : foo = bar'), but i'm
-        # pretty sure that's already broken other places as well. anyway,
-        # add a test and fix it everywhere!
-        if node in node_forms:
-            values = node_forms[node].first().values
-        else:
-            values = set()
-        to_add = {value} if value else set()
-        node_forms[node] = Clause([Key(name, values | to_add)])
-        visit(node)
-
-    for lit, matcher in dag.children.items():
-        if matcher.wildcard:
-            visit_literal_node(matcher.wildcard, lit)
-        for v, nodes in matcher.positive_values.items():
-            for node in nodes:
-                visit_literal_node(node, lit, v)
-        # TODO handle negative values here
-
-    return reversed(result), node_forms
+    # TODO this won't really work right for disjunctions of a wildcard
+    # plus actual values (as in '(a, a.x, a.y) : foo = bar'), but i'm
+    # pretty sure that's already broken other places as well. anyway,
+    # add a test and fix it everywhere!
+    literal_keys = graph.literal_keys
+    if nodes is None:
+        return {node: Clause([key]) for node, key in literal_keys.items()}
+    return {node: Clause([literal_keys[node]]) for node in nodes if node in literal_keys}
 
 
 # TODO this is terrible and wants a cleanup!
@@ -89,29 +54,40 @@ def dump_dag(ctx, prop_names=None, *, out=sys.stdout):
     elif prop_names is not None:
         prop_names = set(prop_names)
 
-    dag = ctx.dag
-    poisoned = ctx.poisoned or pyrsistent.s()
-    nodes, node_forms = top_sort(dag)
+    graph = ctx.graph
+    poisoned = ctx.poisoned.flags() if ctx.poisoned is not None else None
 
     def _include(prop):
         return prop_names is None or prop[0] in prop_names
 
+    if prop_names is None:
+        nodes = range(len(graph))
+        node_forms = literal_forms(graph)
+    else:
+        # only the nodes setting these properties, and the nodes their
+        # formulas are built from, need visiting.
+        index = graph.prop_index()
+        targets = {n for name in prop_names for n, _ in index.get(name, ())}
+        nodes = sorted(graph.ancestors(targets))
+        node_forms = literal_forms(graph, nodes)
+    visited = set(nodes) if prop_names is not None else None
+
     results = []
 
     # Root-level (unconditional) properties from prop_node
-    for prop in dag.prop_node.props:
+    for prop in graph.node_props(graph.ROOT):
         if _include(prop):
             results.append((None, prop))
 
     for node in nodes:
         # TODO is this the correct place to bail out here? or only when
         # we add the props to result? think hard about this!
-        if node in poisoned:
+        if poisoned is not None and poisoned[node]:
             continue
         form = node_forms.get(node)
         if form is None:
             continue
-        for prop in node.props:
+        for prop in graph.node_props(node):
             if not _include(prop):
                 continue
             # TODO this is terrible, find a better way to do it. in general,
@@ -120,11 +96,13 @@ def dump_dag(ctx, prop_names=None, *, out=sys.stdout):
             prop_form = Formula([form]) if isinstance(form, Clause) else form
             results.append((prop_form, prop))  # TODO include origin!
         # TODO also handle constraints!
-        for child in node.children:
+        for child in graph.node_children(node):
+            if visited is not None and child not in visited:
+                continue
             if child in node_forms:
                 child_form = node_forms[child]
             else:
-                child_form = Clause([]) if isinstance(child, AndNode) else Formula([])
+                child_form = Clause([]) if graph.is_and[child] else Formula([])
             node_forms[child] = combine(form, child_form)
 
     def sort_key(result):
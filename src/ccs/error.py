@@ -10,3 +10,6 @@ class EmptyPropertyError(CcsError): ...
 
 
 class AmbiguousPropertyError(CcsError): ...
+
+
+class ArtifactError(CcsError): ...
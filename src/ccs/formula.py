@@ -1,7 +1,7 @@
 """CCS selector intermediate representation: clauses and formulae."""
 
 from ccs.dag import Key, Specificity
-from typing import Iterable, Set
+from typing import FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
 
 
 class Clause:
@@ -25,6 +25,9 @@ class Clause:
     def elements(self) -> Iterable[Key]:
         return self.literals
 
+    def sorted_elements(self) -> List[Key]:
+        return sorted(self.literals)
+
     def union(self, other: "Clause") -> "Clause":
         return Clause(self.literals.union(other.literals))
 
@@ -77,6 +80,9 @@ class Formula:
     def elements(self) -> Iterable[Clause]:
         return self.clauses
 
+    def sorted_elements(self) -> List[Clause]:
+        return sorted(self.clauses)
+
     def __len__(self) -> int:
         return len(self.clauses)
 
@@ -128,3 +134,179 @@ def normalize(formula: Formula) -> Formula:
         s for s in formula.shared if any(s.is_strict_subset(c) for c in minimized)
     }
     return Formula(minimized, shared)
+
+
+class Interner:
+    """Assigns dense integer ids to a fixed collection of items, in sorted order.
+
+    Because ids follow the items' own ordering, comparing sorted id sequences is
+    the same as comparing sorted items."""
+
+    def __init__(self, items: Iterable) -> None:
+        self.items = sorted(set(items))
+        self.ids = {item: i for i, item in enumerate(self.items)}
+
+    def mask(self, items: Iterable) -> int:
+        mask = 0
+        for item in items:
+            mask |= 1 << self.ids[item]
+        return mask
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+def bit_ids(mask: int) -> Tuple[int, ...]:
+    """The ids of the bits set in mask, in increasing order."""
+    ids = []
+    while mask:
+        low = mask & -mask
+        ids.append(low.bit_length() - 1)
+        mask ^= low
+    return tuple(ids)
+
+
+class BitSet:
+    """Base for bitmask encodings of sets of items from an Interner.
+
+    Subset tests, hashing and comparisons are integer operations. Only sets
+    sharing an Interner can be ordered; sets from different Interners are
+    never equal."""
+
+    __slots__ = ("mask", "table", "_key", "_elements")
+
+    def __init__(self, mask: int, table: Interner) -> None:
+        self.mask = mask
+        self.table = table
+        self._key: Optional[Tuple[int, Tuple[int, ...]]] = None
+        self._elements: Optional[FrozenSet] = None
+
+    @property
+    def sort_key(self) -> Tuple[int, Tuple[int, ...]]:
+        if self._key is None:
+            ids = bit_ids(self.mask)
+            self._key = (len(ids), ids)
+        return self._key
+
+    def first(self):
+        if not self.mask:
+            raise ValueError("empty set has no first element")
+        return self.table.items[(self.mask & -self.mask).bit_length() - 1]
+
+    def issubset(self, other: "BitSet") -> bool:
+        return self.mask & other.mask == self.mask
+
+    def elements(self) -> FrozenSet:
+        if self._elements is None:
+            items = self.table.items
+            self._elements = frozenset(items[i] for i in self.sort_key[1])
+        return self._elements
+
+    def sorted_elements(self) -> List:
+        items = self.table.items
+        return [items[i] for i in self.sort_key[1]]
+
+    def _repr_pretty_(self, p, cycle) -> None:
+        p.text(str(self) if not cycle else "...")
+
+    def __len__(self) -> int:
+        return self.mask.bit_count()
+
+    # same ordering as Clause and Formula, since ids follow item order
+    def __lt__(self, other: "BitSet") -> bool:
+        return self.sort_key < other.sort_key
+
+    def __gt__(self, other: "BitSet") -> bool:
+        return self.sort_key > other.sort_key
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, BitSet):
+            return NotImplemented
+        return self.mask == other.mask and self.table is other.table
+
+    # not hash(self.mask): int hashes are taken modulo 2**61 - 1, so masks whose
+    # bits are 61 apart would collide, and single-literal sets are the common case.
+    def __hash__(self) -> int:
+        return hash(self.sort_key[1])
+
+
+class BitClause(BitSet):
+    """A Clause encoded as a bitmask over literal ids."""
+
+    __slots__ = ()
+
+    def is_empty(self) -> bool:
+        return self.mask == 0
+
+    def is_strict_subset(self, other: "BitClause") -> bool:
+        return self.mask != other.mask and self.mask & other.mask == self.mask
+
+    def union(self, other: "BitClause") -> "BitClause":
+        return BitClause(self.mask | other.mask, self.table)
+
+    def specificity(self) -> Specificity:
+        items = self.table.items
+        return sum(
+            (items[i].specificity for i in self.sort_key[1]), Specificity(0, 0, 0, 0)
+        )
+
+    def decode(self) -> Clause:
+        return Clause(self.elements())
+
+    def __str__(self) -> str:
+        items = self.table.items
+        return " ".join(str(items[i]) for i in self.sort_key[1])
+
+    def __repr__(self) -> str:
+        return "<{}>".format("".join(map(str, self.elements())))
+
+
+class BitFormula(BitSet):
+    """A Formula encoded as a bitmask over the ids of its BitClauses."""
+
+    __slots__ = ("shared",)
+
+    def __init__(
+        self, mask: int, table: Interner, shared: Iterable[BitClause] = ()
+    ) -> None:
+        super().__init__(mask, table)
+        self.shared = frozenset(shared)
+
+    @property
+    def clauses(self) -> FrozenSet[BitClause]:
+        return self.elements()
+
+    def is_empty(self) -> bool:
+        # true if it holds the empty clause, as for Formula. that sorts before
+        # every other clause, so if it's in the table at all its id is 0.
+        return bool(self.mask & 1) and self.table.items[0].is_empty()
+
+    def decode(self) -> Formula:
+        return Formula(
+            (c.decode() for c in self.clauses), (c.decode() for c in self.shared)
+        )
+
+    def __str__(self) -> str:
+        items = self.table.items
+        return ", ".join(str(items[i]) for i in self.sort_key[1])
+
+    def __repr__(self) -> str:
+        return "({})".format("".join(map(str, self.elements())))
+
+
+def encode(formulae: Sequence[Formula]) -> List[BitFormula]:
+    """Re-encode formulae as BitFormulae, over literal and clause tables shared by
+    all of them. Shared subclauses are encoded as well."""
+
+    clauses = {c for f in formulae for c in f.clauses | f.shared}
+    literals = Interner(lit for c in clauses for lit in c.elements())
+    encoded = {c: BitClause(literals.mask(c.elements()), literals) for c in clauses}
+    table = Interner(encoded.values())
+    return [
+        BitFormula(
+            table.mask(encoded[c] for c in f.clauses),
+            table,
+            (encoded[c] for c in f.shared),
+        )
+        for f in formulae
+    ]
@@ -0,0 +1,318 @@
+"""Incremental rebuilding of a Dag as the files of a configuration change.
+
+An IncrementalBuild keeps what it built for the last version of a
+configuration, and on each update redoes only the work that depends on what
+changed:
+
+- Each file's parsed tree is kept along with its text. A file whose text is
+  unchanged isn't parsed again; its tree is only relinked to the (possibly
+  new) trees of the files it imports.
+- The rule tree is rebuilt by walking the parsed trees again, which is cheap,
+  and numbers properties exactly as a full load would. The expensive part,
+  expanding each selector to DNF, is memoized by selector and parent formula,
+  so only the selectors of reparsed files are expanded.
+- The Dag is patched rather than rebuilt. Nodes are built only for formulas
+  (and their clauses and literals) that weren't already present, by the same
+  set-cover construction as build_dag(), with everything already built
+  available as covers. Every formula node then gets the props and
+  constraints of the new rule tree, and nodes no longer needed by any
+  formula are retired: unlinked from their parents, dropped from the indexes
+  of built clauses and formulas, and removed from the literal matchers.
+
+A patched Dag isn't built the same way as a fresh one (a new formula may be
+covered by nodes that a full build wouldn't have made), but it sets the
+same props and constraints under the same formulas, and so behaves the same.
+With verify set, each update is checked against a full build_dag() of the
+same rule tree, and a CcsError raised if they differ in that respect.
+
+Every update returns a new Dag, already compiled, with its own copy of the
+working Dag's nodes. Later updates don't change it, so a Dag from an
+earlier update can still be dumped, cached or rebased from.
+"""
+
+import io
+from itertools import chain
+from typing import Dict, Optional, TextIO, Tuple
+
+from ccs.ast import AstNode, ImportResolver
+from ccs.compiled import compile_dag
+from ccs.dag import Dag, SubsetIndex, _build_dag, add_formula_nodes, build_dag
+from ccs.dump import combine, literal_forms
+from ccs.error import CcsError
+from ccs.formula import Clause, Formula
+from ccs.parser import LoadStats, Parser
+from ccs.rule_tree import RuleTreeNode
+
+
+class _Formulas(dict):
+    """DNF expansions for RuleTreeNode.traverse(), falling back on those of
+    the previous update. Only the ones used are carried over, so expansions
+    for selectors that are gone don't pile up."""
+
+    def __init__(self, previous) -> None:
+        super().__init__()
+        self.previous = previous
+        self.reused = 0
+
+    def __missing__(self, key):
+        formula = self[key] = self.previous[key]
+        self.reused += 1
+        return formula
+
+
+class _ReusingParser(Parser):
+    """A sequential Parser that reuses a file's tree from the previous update
+    if its text hasn't changed."""
+
+    def __init__(self, previous: Dict[str, Tuple[str, AstNode]]) -> None:
+        super().__init__()
+        self.previous = previous
+        self.sources: Dict[str, Tuple[str, AstNode]] = {}
+        self.reused = 0
+
+    def load(self, text, filename, import_resolver):
+        self.stats = LoadStats()
+        self._loaded = {}
+        return self._parse(text, filename, import_resolver, [])
+
+    def parse_import(self, location, import_resolver: ImportResolver, in_progress):
+        self.stats.imports += 1
+        if location in self._loaded:
+            self.stats.parses_saved += 1
+            return self._loaded[location]
+        with import_resolver.resolve(location) as stream:
+            text = stream.read()
+        in_progress.append(location)
+        try:
+            rule = self._parse(text, location, import_resolver, in_progress)
+        finally:
+            in_progress.pop()
+        if rule is not None:
+            self._loaded[location] = rule
+        return rule
+
+    def _parse(self, text, location, import_resolver, in_progress):
+        cached = self.previous.get(location)
+        if cached is not None and cached[0] == text:
+            rule = cached[1]
+            self.reused += 1
+            if import_resolver is not None and not rule.resolve_imports(
+                import_resolver, self, in_progress
+            ):
+                return None
+        elif import_resolver is None:
+            rule = self.parse(io.StringIO(text), location)
+        else:
+            rule = self.parse_ccs_stream(
+                io.StringIO(text), location, import_resolver, in_progress
+            )
+            if rule is None:
+                return None
+        self.sources[location] = (text, rule)
+        return rule
+
+
+class UpdateStats:
+    """Counts for one IncrementalBuild.update()."""
+
+    def __init__(self) -> None:
+        self.full = False
+        self.files_parsed = 0
+        self.files_reused = 0
+        self.expansions = 0
+        self.expansions_reused = 0
+        self.formulas_added = 0
+        self.nodes_retired = 0
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
+class IncrementalBuild:
+    """Builds the Dag for a configuration, and rebuilds it after changes to
+    its files by patching the previous one. The first update is a full build.
+
+    Not thread-safe: updates must not run concurrently. Counts for the most
+    recent update are kept in self.stats."""
+
+    def __init__(self, *, verify: bool = False) -> None:
+        self.verify = verify
+        self.stats = UpdateStats()
+        self._sources: Dict[str, Tuple[str, AstNode]] = {}
+        self._formulas: Dict = {}
+        self._dag: Optional[Dag] = None
+
+    def update(
+        self,
+        stream: TextIO,
+        filename: str,
+        import_resolver: Optional[ImportResolver] = None,
+    ) -> Dag:
+        """The Dag for the configuration as it is now: stream, and the files
+        it imports through import_resolver. On error, nothing is changed."""
+        stats = UpdateStats()
+        parser = _ReusingParser(self._sources)
+        rules = parser.load(stream.read(), filename, import_resolver)
+        if rules is None:
+            raise CcsError(f"Errors loading '{filename}'")
+        formulas = _Formulas(self._formulas)
+        root = RuleTreeNode(formulas=formulas)
+        rules.add_to(root)
+        stats.files_parsed = parser.stats.files_parsed
+        stats.files_reused = parser.reused
+        stats.expansions = len(formulas) - formulas.reused
+        stats.expansions_reused = formulas.reused
+
+        rule_nodes = list(root)
+        try:
+            if self._dag is None:
+                stats.full = True
+                self._rebuild(rule_nodes)
+            self._patch(rule_nodes, stats)
+            dag = self._publish()
+        except BaseException:
+            # the working Dag may be half patched
+            self._dag = None
+            raise
+        if self.verify and not stats.full:
+            problem = _difference(dag.compiled(), build_dag(rule_nodes).compiled())
+            if problem is not None:
+                self._dag = None
+                raise CcsError(f"Incremental build of '{filename}' differs: {problem}")
+        self._sources, self._formulas = parser.sources, formulas
+        self.stats = stats
+        return dag
+
+    def _rebuild(self, rule_nodes) -> None:
+        self._dag, self._lit_nodes, clause_nodes, form_nodes = _build_dag(
+            rule_nodes, True
+        )
+        # the bitset encoding is only good for the formulas it was made from,
+        # so the indexes are kept in terms of plain clauses and formulas.
+        self._clause_nodes = SubsetIndex()
+        for clause, node in clause_nodes.items():
+            self._clause_nodes[clause.decode()] = node
+        # formulas are keyed by the rule tree's own objects, which later rule
+        # trees share through the memoized expansions, so that looking them
+        # up is mostly a matter of identity rather than comparing clauses.
+        decoded = {formula.decode(): node for formula, node in form_nodes.items()}
+        self._form_nodes = SubsetIndex()
+        for rule in rule_nodes:
+            if not rule.formula.is_empty() and rule.formula not in self._form_nodes:
+                self._form_nodes[rule.formula] = decoded[rule.formula]
+        self._targets = []
+
+    def _patch(self, rule_nodes, stats: UpdateStats) -> None:
+        dag = self._dag
+        lit_nodes, clause_nodes, form_nodes = (
+            self._lit_nodes,
+            self._clause_nodes,
+            self._form_nodes,
+        )
+
+        # props and constraints by formula, each in rule tree order, as in a
+        # full build.
+        settings: Dict[Formula, Tuple[list, list]] = {}
+        for rule in rule_nodes:
+            props, constraints = settings.setdefault(rule.formula, ([], []))
+            props += rule.props
+            constraints += rule.constraints
+
+        added = add_formula_nodes(dag, settings, lit_nodes, clause_nodes, form_nodes)
+        stats.formulas_added = len(added)
+
+        for node in self._targets:
+            node.props, node.constraints = [], []
+        self._targets = []
+        for formula, (props, constraints) in settings.items():
+            node = dag.prop_node if formula.is_empty() else form_nodes[formula]
+            node.props, node.constraints = props, constraints
+            self._targets.append(node)
+
+        stats.nodes_retired = self._retire(set(self._targets))
+
+    def _retire(self, targets) -> int:
+        """Remove every node that is neither in targets nor a parent of a node
+        that is kept. Returns how many were removed."""
+        dag = self._dag
+        # a node is kept if it's a target or any of its children is kept;
+        # since parents of kept nodes are themselves kept, no kept node
+        # loses a parent, and so tally counts don't change.
+        live = {}
+        for source in chain([dag.prop_node], self._lit_nodes.values()):
+            if source in live:
+                continue
+            stack = [(source, iter(source.children))]
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    if child not in live:
+                        stack.append((child, iter(child.children)))
+                        break
+                else:
+                    stack.pop()
+                    kept = [child for child in node.children if live[child]]
+                    if len(kept) != len(node.children):
+                        node.children = kept
+                    live[node] = bool(kept) or node in targets
+
+        for index in (self._clause_nodes, self._form_nodes):
+            for expr in [expr for expr, node in index.items() if not live[node]]:
+                del index[expr]
+        for lit in [lit for lit, node in self._lit_nodes.items() if not live[node]]:
+            matcher = dag.children[lit.name]
+            matcher.remove_values(lit.values, self._lit_nodes.pop(lit))
+            if matcher.is_empty():
+                del dag.children[lit.name]
+        return sum(1 for kept in live.values() if not kept)
+
+    def _publish(self) -> Dag:
+        # a copy, since the working Dag goes on being patched by later updates
+        dag = self._dag.copy()
+        dag._compiled = compile_dag(dag)
+        return dag
+
+
+def _settings(graph):
+    """The props and constraints of a CompiledDag, by the formula of the node
+    setting them."""
+    forms = literal_forms(graph)
+    settings = {}
+    for node in range(len(graph)):
+        if node == graph.ROOT:
+            key = ""
+        elif (form := forms.get(node)) is not None:
+            key = str(Formula([form]) if isinstance(form, Clause) else form)
+        else:
+            continue
+        props, constraints = graph.node_props(node), graph.node_constraints(node)
+        if props or constraints:
+            settings[key] = (
+                [
+                    (name, p.value, str(p.origin), p.override_level, p.property_number)
+                    for name, p in props
+                ],
+                sorted(map(str, constraints)),
+            )
+        if node == graph.ROOT:
+            continue
+        for child in graph.node_children(node):
+            if child in forms:
+                child_form = forms[child]
+            else:
+                child_form = Clause([]) if graph.is_and[child] else Formula([])
+            forms[child] = combine(form, child_form)
+    return settings
+
+
+def _difference(graph, expected) -> Optional[str]:
+    """A description of the first way in which graph doesn't set the same
+    props and constraints under the same formulas as expected, or None."""
+    got, want = _settings(graph), _settings(expected)
+    for formula in sorted(got.keys() | want.keys()):
+        if got.get(formula) != want.get(formula):
+            return (
+                f"under '{formula}', found {got.get(formula)}, "
+                f"expected {want.get(formula)}"
+            )
+    return None
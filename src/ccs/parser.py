@@ -1,5 +1,6 @@
 """CCS parser."""
 
+import concurrent.futures
 import re
 
 from ccs import ast
@@ -343,10 +344,217 @@ class Lexer:
         return token
 
 
+class RegexLexer:
+    """Block-buffered lexer driven by a precompiled master regex.
+
+    The whole stream is read up front and tokenized by matching at the current
+    offset, rather than one character at a time. Tokens, locations and errors
+    are exactly those produced by Lexer, which remains available so that the
+    two can be compared.
+    """
+
+    PUNCTUATION = {
+        "(": Token.LPAREN,
+        ")": Token.RPAREN,
+        "{": Token.LBRACE,
+        "}": Token.RBRACE,
+        ";": Token.SEMI,
+        ":": Token.COLON,
+        ",": Token.COMMA,
+        ".": Token.DOT,
+        ">": Token.GT,
+        "=": Token.EQ,
+    }
+
+    COMMANDS = {
+        "@constrain": Token.CONSTRAIN,
+        "@context": Token.CONTEXT,
+        "@import": Token.IMPORT,
+        "@override": Token.OVERRIDE,
+    }
+
+    ESCAPES = "$'\"\\tnr"
+
+    # leading whitespace and newline-terminated line comments are skipped as
+    # part of every token match. the comment group catches block comments and
+    # a line comment running into end-of-input, which need special handling.
+    # the skip prefix is written so that it can't backtrack ambiguously.
+    TOKEN_RE = re.compile(
+        r"""
+        \s*(?://[^\n]*\n\s*)*
+        (?:
+          (?P<punct>[(){};:,.>=])
+        | (?P<hex>0x[0-9a-fA-F]*)
+        | (?P<numid>[-+0-9][-+0-9A-Za-z$_.]*)
+        | (?P<ident>[$_A-Za-z][$_A-Za-z0-9]*)
+        | (?P<command>@[$_A-Za-z0-9]*)
+        | (?P<string>['"])
+        | (?P<comment>/\*|//[^\n]*\Z)
+        | (?P<eos>\Z)
+        )
+        """,
+        re.VERBOSE,
+    )
+    SPACE_RE = re.compile(r"\s*(?://[^\n]*\n\s*)*")
+    COMMENT_DELIM_RE = re.compile(r"/\*|\*/")
+    INTERPOLANT_RE = re.compile(r"[_0-9A-Za-z]*")
+    STRING_RUN_RES = {q: re.compile(f"[^{q}\\\\$]+") for q in "'\""}
+
+    def __init__(self, stream):
+        self.text = stream.read()
+        self.pos = 0
+        # location tracking: the line number at self.tracked, and the offset
+        # of the last newline before it (columns are 1-based offsets from it).
+        self.tracked = 0
+        self.line = 1
+        self.last_newline = -1
+        # Lexer reports end-of-input one column further along for every extra
+        # read past the end of the stream. we mimic that so that locations
+        # agree exactly.
+        self.eof_reads = 0
+        self.next = self.next_token()
+
+    def peek(self):
+        return self.next
+
+    def consume(self):
+        tmp = self.next
+        self.next = self.next_token()
+        return tmp
+
+    def location(self, offset):
+        text = self.text
+        end = offset if offset < len(text) else len(text)
+        if end > self.tracked:
+            last = text.rfind("\n", self.tracked, end)
+            if last != -1:
+                self.line += text.count("\n", self.tracked, last + 1)
+                self.last_newline = last
+            self.tracked = end
+        return Location(self.line, offset - self.last_newline)
+
+    def multiline_comment(self, pos):
+        depth = 1
+        while depth:
+            m = self.COMMENT_DELIM_RE.search(self.text, pos)
+            if m is None:
+                raise ParseError(
+                    self.location(len(self.text)), "Unterminated multi-line comment"
+                )
+            depth += 1 if m.group() == "/*" else -1
+            pos = m.end()
+        return pos
+
+    def next_token(self):
+        text = self.text
+        while True:
+            m = self.TOKEN_RE.match(text, self.pos)
+            if m is None:
+                start = self.SPACE_RE.match(text, self.pos).end()
+                c = text[start]
+                raise ParseError(
+                    self.location(start), f"Unexpected character: '{c}' (0x{hex(ord(c))})"
+                )
+            kind = m.lastgroup
+            if kind != "comment":
+                break
+            if m.group(kind) == "/*":
+                self.pos = self.multiline_comment(m.end())
+            else:  # line comment with no trailing newline
+                self.pos = len(text)
+                self.eof_reads += 1
+
+        start = m.start(kind)
+        where = self.location(start + self.eof_reads)
+        self.pos = m.end()
+        value = m.group(kind)
+
+        if kind == "punct":
+            return Token(self.PUNCTUATION[value], where)
+        if kind == "ident":
+            return Token(Token.IDENT, where, value)
+        if kind == "numid":
+            if Lexer.INT_RE.fullmatch(value):
+                return Token(Token.INT, where, value)
+            if Lexer.DOUBLE_RE.fullmatch(value):
+                return Token(Token.DOUBLE, where, value)
+            return Token(Token.NUMID, where, value)
+        if kind == "string":
+            return self.string(value, where)
+        if kind == "hex":
+            token = Token(Token.INT, where, value[2:])
+            token.intValue = int(token.value, 16) if token.value else 0
+            token.doubleValue = token.intValue
+            return token
+        if kind == "command":
+            if value not in self.COMMANDS:
+                raise ParseError(where, f"Unrecognized @-command: {value}")
+            return Token(self.COMMANDS[value], where, value)
+        self.eof_reads += 1
+        return Token(Token.EOS, where)
+
+    def string(self, quote, where):
+        text = self.text
+        end = len(text)
+        run_re = self.STRING_RUN_RES[quote]
+        result = stringval.StringVal()
+        current = []
+        pos = self.pos
+        while True:
+            m = run_re.match(text, pos)
+            if m is not None:
+                current.append(m.group())
+                pos = m.end()
+            if pos >= end:
+                raise ParseError(self.location(pos), "Unterminated string literal")
+            c = text[pos]
+            if c == quote:
+                break
+            if c == "$":
+                pos += 1
+                if not text.startswith("{", pos):
+                    raise ParseError(self.location(pos), "Expected '{'")
+                if current:
+                    result.add_literal("".join(current))
+                current = []
+                m = self.INTERPOLANT_RE.match(text, pos + 1)
+                pos = m.end()
+                if pos >= end:
+                    raise ParseError(self.location(pos), "Unterminated string literal")
+                if text[pos] != "}":
+                    bad = text[pos]
+                    raise ParseError(
+                        self.location(pos),
+                        "Character not allowed in string interpolant: "
+                        f"{bad} (0x{hex(ord(bad))})",
+                    )
+                result.add_interpolant(m.group())
+                pos += 1
+            else:  # backslash
+                if pos + 1 >= end:
+                    raise ParseError(self.location(pos + 2), "Unterminated string literal")
+                escape = text[pos + 1]
+                if escape in self.ESCAPES:
+                    current.append(escape)
+                elif escape != "\n":  # escaped newline: ignore
+                    raise ParseError(
+                        self.location(pos + 1),
+                        f"Unrecognized escape sequence: '\\{escape}' "
+                        f"(0x{hex(ord(escape))})",
+                    )
+                pos += 2
+        self.pos = pos + 1
+        if current:
+            result.add_literal("".join(current))
+        tok = Token(Token.STRING, where)
+        tok.string_value = result
+        return tok
+
+
 class ParserImpl:
-    def __init__(self, filename, stream):
+    def __init__(self, filename, stream, lexer=RegexLexer):
         self.filename = filename
-        self.lex = Lexer(stream)
+        self.lex = lexer(stream)
         self.cur = None
         self.last = None
         self.advance()
@@ -534,7 +742,49 @@ class ParserImpl:
         )
 
 
+def _parse_import(import_resolver, location, lexer):
+    """Resolve and parse a single imported file, without resolving its imports.
+
+    This runs on a worker, possibly in another process, so parse errors are
+    returned as strings rather than raised.
+    """
+    with import_resolver.resolve(location) as stream:
+        try:
+            return ParserImpl(location, stream, lexer).parse_ruleset(), None
+        except ParseError as e:
+            return None, str(e)
+
+
+class LoadStats:
+    def __init__(self):
+        self.files_parsed = 0
+        self.imports = 0
+        self.parses_saved = 0
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
 class Parser:
+    """Parses CCS source, optionally resolving imports in parallel.
+
+    Within one load, each imported location is resolved and parsed only once,
+    however many times it is imported; the parsed tree is shared by every import
+    of it. Counts for the most recent load are kept in self.stats.
+
+    If an executor (a concurrent.futures thread or process pool) is given,
+    parse_ccs_stream() fetches and parses imported files on it concurrently.
+    The resulting tree, and so the order in which rules are added, is the same
+    as for sequential loading. A thread pool overlaps file reads; a process pool
+    also parses in parallel, but requires the import resolver to be picklable.
+    """
+
+    def __init__(self, lexer=RegexLexer, *, executor=None):
+        self.lexer = lexer
+        self.executor = executor
+        self.stats = LoadStats()
+        self._loaded = {}
+
     def load_ccs_stream(self, stream, filename, dag, import_resolver: ImportResolver):
         rule = self.parse_ccs_stream(stream, filename, import_resolver, [])
         if not rule:
@@ -546,9 +796,20 @@ class Parser:
     def parse_ccs_stream(
         self, stream, filename, import_resolver: ImportResolver, in_progress
     ):
+        if not in_progress:
+            # a new load, rather than an import within one...
+            self.stats = LoadStats()
+            self._loaded = {}
         try:
-            rule = ParserImpl(filename, stream).parse_ruleset()
-            if not rule.resolve_imports(import_resolver, self, in_progress):
+            self.stats.files_parsed += 1
+            rule = ParserImpl(filename, stream, self.lexer).parse_ruleset()
+            if self.executor is not None:
+                resolved = self._resolve_imports_parallel(
+                    rule, import_resolver, in_progress
+                )
+            else:
+                resolved = rule.resolve_imports(import_resolver, self, in_progress)
+            if not resolved:
                 return None
             return rule
         except ParseError as e:
@@ -556,8 +817,83 @@ class Parser:
             print(f"Errors parsing '{filename}': {e}")
             return None
 
+    def parse_import(self, location, import_resolver: ImportResolver, in_progress):
+        """Parse an imported file and its imports, or reuse an earlier result."""
+        self.stats.imports += 1
+        if location in self._loaded:
+            self.stats.parses_saved += 1
+            return self._loaded[location]
+        in_progress.append(location)
+        try:
+            rule = self.parse_ccs_stream(
+                import_resolver.resolve(location), location, import_resolver, in_progress
+            )
+        finally:
+            in_progress.pop()
+        if rule is not None:
+            self._loaded[location] = rule
+        return rule
+
+    def _resolve_imports_parallel(self, rule, import_resolver, in_progress):
+        # one job per imported location. as each file is parsed, jobs for any
+        # new locations it imports are submitted in turn.
+        jobs = {}
+        pending = {}
+
+        def submit(node):
+            for imp in node.imports():
+                if imp.location not in jobs:
+                    job = self.executor.submit(
+                        _parse_import, import_resolver, imp.location, self.lexer
+                    )
+                    jobs[imp.location] = job
+                    pending[job] = imp.location
+
+        submit(rule)
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for job in done:
+                del pending[job]
+                if job.exception() is None:
+                    ast, _ = job.result()
+                    if ast is not None:
+                        submit(ast)
+        self.stats.files_parsed += len(jobs)
+
+        # now link the tree together in source order, exactly as sequential
+        # loading does, so that circular imports are detected the same way and
+        # the same failure (if any) is the one reported.
+        stack = list(in_progress)
+
+        def link(node):
+            for imp in node.imports():
+                if imp.location in stack:
+                    imp.report_circular()
+                    return False
+                self.stats.imports += 1
+                if imp.location in self._loaded:
+                    self.stats.parses_saved += 1
+                    imp.ast = self._loaded[imp.location]
+                    continue
+                ast, error = jobs[imp.location].result()
+                if error is not None:
+                    # TODO logger...
+                    print(f"Errors parsing '{imp.location}': {error}")
+                    return False
+                stack.append(imp.location)
+                linked = link(ast)
+                stack.pop()
+                if not linked:
+                    return False
+                imp.ast = self._loaded[imp.location] = ast
+            return True
+
+        return link(rule)
+
     def parse(self, stream, filename):
-        return ParserImpl(filename, stream).parse_ruleset()
+        return ParserImpl(filename, stream, self.lexer).parse_ruleset()
 
     def parse_selector(self, stream, filename="<none>"):
-        return ParserImpl(filename, stream).parse_selector()
+        return ParserImpl(filename, stream, self.lexer).parse_selector()
@@ -0,0 +1,241 @@
+"""Wire format of the query server (see ccs.server and ccs.client).
+
+Every message is a frame: a little-endian u32 payload length, then the
+payload. Requests and responses on a connection are matched up by order (a
+server answers requests in the order they arrive, so clients may pipeline
+them), and also carry a u32 request id, which a response repeats.
+
+Strings are UTF-8, prefixed by their length: a u16 for keys, values of
+context steps and property names, a u32 for property values and messages.
+
+Request payload: u32 id, u8 op, then for QUERY:
+
+    u16 query count, and for each query:
+        u16 step count, and for each step:
+            str16 key, u8 has value, [str16 value]
+        u16 name count, and for each name: str16 name
+
+STATS has no body.
+
+Response payload: u32 id, u8 status. If status is ERROR, a str32 message
+follows. Otherwise, for QUERY:
+
+    u16 query count, and for each query:
+        u16 name count, and for each name (in request order):
+            u8 answer, str32 value (for VALUE) or message (otherwise)
+
+and for STATS, a str32 holding a JSON object.
+"""
+
+import struct
+import threading
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+FRAME = struct.Struct("<I")
+REQUEST = struct.Struct("<IB")
+RESPONSE = struct.Struct("<IB")
+
+# frames bigger than this are refused, and the connection dropped
+MAX_FRAME = 16 << 20
+
+OP_QUERY = 1
+OP_STATS = 2
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# answers for one property name, following Context.get_single_value()
+VALUE = 0
+MISSING = 1
+EMPTY = 2
+AMBIGUOUS = 3
+
+Step = Tuple[str, Optional[str]]
+Query = Tuple[Sequence[Step], Sequence[str]]
+Answer = Tuple[int, str]
+
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+
+
+class ProtocolError(Exception):
+    """A malformed or unexpected message."""
+
+
+class Reader:
+    """Reads the fields of a payload in order."""
+
+    def __init__(self, data: bytes, offset: int = 0) -> None:
+        self.data = memoryview(data)
+        self.offset = offset
+
+    def _unpack(self, st: struct.Struct) -> int:
+        try:
+            (value,) = st.unpack_from(self.data, self.offset)
+        except struct.error:
+            raise ProtocolError("truncated message") from None
+        self.offset += st.size
+        return value
+
+    def u8(self) -> int:
+        return self._unpack(_U8)
+
+    def u16(self) -> int:
+        return self._unpack(_U16)
+
+    def _str(self, size: int) -> str:
+        end = self.offset + size
+        if end > len(self.data):
+            raise ProtocolError("truncated message")
+        try:
+            value = str(self.data[self.offset : end], "utf-8")
+        except UnicodeDecodeError:
+            raise ProtocolError("invalid UTF-8 in message") from None
+        self.offset = end
+        return value
+
+    def str16(self) -> str:
+        return self._str(self.u16())
+
+    def str32(self) -> str:
+        return self._str(self._unpack(_U32))
+
+    def end(self) -> None:
+        if self.offset != len(self.data):
+            raise ProtocolError("trailing bytes in message")
+
+
+class Writer:
+    """Builds a payload from fields in order."""
+
+    def __init__(self) -> None:
+        self.parts: List[bytes] = []
+
+    def raw(self, data: bytes) -> None:
+        self.parts.append(data)
+
+    def u8(self, value: int) -> None:
+        self.parts.append(_U8.pack(value))
+
+    def u16(self, value: int) -> None:
+        if value > 0xFFFF:
+            raise ValueError(f"too many items for one message: {value}")
+        self.parts.append(_U16.pack(value))
+
+    def str16(self, value: str) -> None:
+        data = value.encode()
+        self.u16(len(data))
+        self.parts.append(data)
+
+    def str32(self, value: str) -> None:
+        data = value.encode()
+        self.parts.append(_U32.pack(len(data)))
+        self.parts.append(data)
+
+    def frame(self) -> bytes:
+        """The payload, framed."""
+        payload = b"".join(self.parts)
+        return FRAME.pack(len(payload)) + payload
+
+
+def query_request(request_id: int, queries: Iterable[Query]) -> bytes:
+    w = Writer()
+    w.raw(REQUEST.pack(request_id, OP_QUERY))
+    queries = list(queries)
+    w.u16(len(queries))
+    for steps, names in queries:
+        steps = list(steps)
+        w.u16(len(steps))
+        for key, value in steps:
+            w.str16(key)
+            w.u8(value is not None)
+            if value is not None:
+                w.str16(value)
+        names = list(names)
+        w.u16(len(names))
+        for name in names:
+            w.str16(name)
+    return w.frame()
+
+
+def stats_request(request_id: int) -> bytes:
+    w = Writer()
+    w.raw(REQUEST.pack(request_id, OP_STATS))
+    return w.frame()
+
+
+def read_queries(r: Reader) -> List[Query]:
+    queries = []
+    for _ in range(r.u16()):
+        steps = []
+        for _ in range(r.u16()):
+            key = r.str16()
+            steps.append((key, r.str16() if r.u8() else None))
+        names = [r.str16() for _ in range(r.u16())]
+        queries.append((steps, names))
+    r.end()
+    return queries
+
+
+def write_answers(w: Writer, answers: Sequence[Sequence[Answer]]) -> None:
+    w.u16(len(answers))
+    for query in answers:
+        w.u16(len(query))
+        for kind, text in query:
+            w.u8(kind)
+            w.str32(text)
+
+
+def read_answers(r: Reader) -> List[List[Answer]]:
+    answers = []
+    for _ in range(r.u16()):
+        answers.append([(r.u8(), r.str32()) for _ in range(r.u16())])
+    r.end()
+    return answers
+
+
+class LatencyStats:
+    """Counts of latencies, in buckets by powers of two of microseconds, from
+    which percentiles can be estimated to within a factor of two. Safe for
+    use from several threads."""
+
+    BUCKETS = 32
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * self.BUCKETS
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        bucket = min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            self.buckets[bucket] += 1
+
+    def percentile(self, q: float) -> float:
+        """An upper bound, in seconds, on the q-th percentile (0 < q <= 100)."""
+        with self._lock:
+            target = self.count * q / 100
+            seen = 0
+            for bucket, n in enumerate(self.buckets):
+                seen += n
+                if n and seen >= target:
+                    return min((1 << bucket) / 1e6, self.max)
+        return 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+    def __repr__(self):
+        return str(self.as_dict())
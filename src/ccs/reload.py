@@ -0,0 +1,302 @@
+"""Reloading a CCS configuration as its files change.
+
+A ConfigHandle loads a root file and everything it imports, and watches all
+of those files. When one changes, the configuration is rebuilt on a
+background thread and the new Dag swapped in. Contexts are immutable and
+keep the Dag they were made from, so a request holding a context goes on
+seeing the configuration it started with; ConfigHandle.rebase() carries a
+context over to the current Dag by replaying its augments there.
+
+Changes are detected by comparing each file's mtime, size and inode with
+what they were when it was read. On Linux, inotify watches on the files'
+directories wake the watcher as soon as anything in them changes; elsewhere
+(or with use_inotify=False) it simply checks every poll_interval seconds.
+Either way the check is also made every poll_interval seconds.
+
+With incremental set, reloads patch the previous Dag rather than building a
+new one from scratch (see ccs.incremental), so that a change to one file
+costs roughly what that file contributes rather than the whole
+configuration.
+"""
+
+import ctypes
+import os
+import select
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from ccs.ast import FileImportResolver
+from ccs.incremental import IncrementalBuild
+from ccs.search_state import Context, PropertyTracer
+
+Signature = Optional[Tuple[int, int, int]]
+
+
+def _signature(path) -> Signature:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class _RecordingFileResolver(FileImportResolver):
+    """A FileImportResolver noting the signature of each file just before reading it."""
+
+    def __init__(self, base_dir: Path) -> None:
+        super().__init__(base_dir)
+        self.signatures: Dict[Path, Signature] = {}
+
+    def resolve(self, location: str):
+        path = self.base_dir / location
+        self.signatures[path] = _signature(path)
+        return open(path)
+
+
+class _PollingWatcher:
+    """Wakes the watcher thread only when closed; changes are found by polling."""
+
+    def __init__(self) -> None:
+        self._woken = threading.Event()
+
+    def watch(self, directories) -> None:
+        pass
+
+    def wait(self, timeout: float) -> None:
+        self._woken.wait(timeout)
+
+    def wake(self) -> None:
+        self._woken.set()
+
+    def close(self) -> None:
+        pass
+
+
+class _InotifyWatcher:
+    """Wakes the watcher thread whenever an entry in a watched directory changes.
+
+    Whole directories are watched rather than files, so that a file replaced
+    by renaming another over it is still noticed."""
+
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    # | IN_CREATE | IN_DELETE
+    MASK = 0x002 | 0x004 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._wake_read, self._wake_write = os.pipe()
+        self._directories = set()
+
+    @classmethod
+    def create(cls) -> Optional["_InotifyWatcher"]:
+        """An _InotifyWatcher, or None if inotify isn't available here."""
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            return cls()
+        except (OSError, AttributeError):
+            return None
+
+    def watch(self, directories) -> None:
+        for directory in set(directories) - self._directories:
+            # a directory that can't be watched is still polled
+            if self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.MASK) >= 0:
+                self._directories.add(directory)
+
+    def wait(self, timeout: float) -> None:
+        ready, _, _ = select.select([self._fd, self._wake_read], [], [], timeout)
+        if self._fd in ready:
+            # the events themselves don't matter, only that there were some
+            try:
+                while os.read(self._fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def wake(self) -> None:
+        os.write(self._wake_write, b"\0")
+
+    def close(self) -> None:
+        for fd in (self._fd, self._wake_read, self._wake_write):
+            os.close(fd)
+
+
+class ConfigHandle:
+    """The current configuration loaded from a CCS file, reloaded as it changes.
+
+    The file is loaded when the handle is created, and any error raised.
+    After that, failed reloads leave the previous configuration in place; they
+    are counted in failures and the error kept in last_error. Successful
+    ones are counted in reloads, and each adds one to generation.
+    last_reload_seconds and reload_seconds_total time both kinds.
+
+    With watch=False, nothing is reloaded unless reload() is called. Use the
+    handle as a context manager, or call close(), to stop watching.
+
+    With incremental, each reload patches the previous Dag; with verify as
+    well, each patched Dag is also checked against a full rebuild, and a
+    reload whose results differ fails. That's slower than not reloading
+    incrementally at all, and meant for testing."""
+
+    def __init__(
+        self,
+        path,
+        *,
+        prop_accumulator=None,
+        trace_properties: Optional[PropertyTracer] = None,
+        lazy: bool = False,
+        watch: bool = True,
+        poll_interval: float = 1.0,
+        settle: float = 0.05,
+        use_inotify: Optional[bool] = None,
+        incremental: bool = False,
+        verify: bool = False,
+    ) -> None:
+        self.path = Path(path)
+        self.prop_accumulator = prop_accumulator
+        self.trace_properties = trace_properties
+        self.lazy = lazy
+        self.poll_interval = poll_interval
+        # how long to let writers finish after a change is seen
+        self.settle = settle
+        self.generation = 0
+        self.reloads = 0
+        self.failures = 0
+        self.last_error: Optional[BaseException] = None
+        self.last_reload_seconds = 0.0
+        self.reload_seconds_total = 0.0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        self._signatures: Dict[Path, Signature] = {}
+        self._incremental = IncrementalBuild(verify=verify) if incremental else None
+
+        self._root, self._signatures = self._build()
+
+        if not watch:
+            self._watcher = None
+            return
+        self._watcher = _InotifyWatcher.create() if use_inotify is not False else None
+        if self._watcher is None:
+            if use_inotify:
+                raise OSError("inotify is not available")
+            self._watcher = _PollingWatcher()
+        self._watcher.watch({p.parent for p in self._signatures})
+        self._thread = threading.Thread(
+            target=self._watch, name=f"ccs-reload {self.path.name}", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def context(self) -> Context:
+        """The root context of the current configuration."""
+        return self._root
+
+    @property
+    def dag(self):
+        """The current Dag."""
+        return self._root.dag
+
+    def rebase(self, ctx: Context) -> Context:
+        """ctx, or if it was made from an older configuration, the same context
+        built on the current one: the same augments, in order, from a root
+        with ctx's accumulator, tracer and laziness. If ctx poisons, so does
+        the result, from its root."""
+        dag = self._root.dag
+        if ctx.dag is dag:
+            return ctx
+        root = dag.root_context(
+            ctx.prop_accumulator, trace_properties=ctx.trace_properties, lazy=ctx.lazy
+        )
+        if ctx.poisoned is not None:
+            root = root.with_poisoning()
+        return root.augment_many(
+            (key.name, next(iter(key.values), None)) for key in ctx.debug_location
+        )
+
+    def reload(self) -> bool:
+        """Rebuild from the files now, and swap in the result. Returns whether
+        that succeeded; if not, the current configuration is kept."""
+        with self._lock:
+            start = time.perf_counter()
+            try:
+                root, signatures = self._build()
+            except Exception as e:
+                self.failures += 1
+                self.last_error = e
+                return False
+            finally:
+                self.last_reload_seconds = time.perf_counter() - start
+                self.reload_seconds_total += self.last_reload_seconds
+            self._root, self._signatures = root, signatures
+            self.generation += 1
+            self.reloads += 1
+            self.last_error = None
+        if self._watcher is not None:
+            self._watcher.watch({p.parent for p in signatures})
+        return True
+
+    def close(self) -> None:
+        """Stop watching. The current configuration stays usable."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._thread is not None:
+            self._watcher.wake()
+            self._thread.join()
+            self._watcher.close()
+
+    def __enter__(self) -> "ConfigHandle":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def changed(self) -> bool:
+        """Whether any file of the configuration has changed since it was read."""
+        return any(_signature(path) != sig for path, sig in self._signatures.items())
+
+    def _build(self):
+        # signatures are taken before each file is read, so a change made
+        # while it's being read is seen next time round.
+        resolver = _RecordingFileResolver(self.path.parent)
+        resolver.signatures[self.path] = _signature(self.path)
+        try:
+            with open(self.path) as f:
+                if self._incremental is not None:
+                    root = self._incremental.update(f, str(self.path), resolver).root_context(
+                        self.prop_accumulator,
+                        trace_properties=self.trace_properties,
+                        lazy=self.lazy,
+                    )
+                else:
+                    root = Context.from_ccs_stream(
+                        f,
+                        str(self.path),
+                        resolver,
+                        prop_accumulator=self.prop_accumulator,
+                        trace_properties=self.trace_properties,
+                        lazy=self.lazy,
+                    )
+        except Exception:
+            # don't retry until something changes again, but keep watching
+            # the files of the current configuration too
+            self._signatures = {**self._signatures, **resolver.signatures}
+            raise
+        return root, resolver.signatures
+
+    def _watch(self) -> None:
+        while True:
+            self._watcher.wait(self.poll_interval)
+            if self._closed.is_set():
+                return
+            if self.changed():
+                time.sleep(self.settle)
+                self.reload()
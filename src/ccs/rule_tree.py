@@ -11,12 +11,23 @@ from ccs.property import Property
 
 
 class RuleTreeNode:
-    def __init__(self, expand_limit=100, formula=Formula([Clause([])]), _counter=None) -> None:
+    """A node of the rule tree, holding the props and constraints set under one
+    formula.
+
+    If formulas is given, it's a mapping used to memoize traverse() for the
+    whole tree: each DNF expansion is stored under the selector object and the
+    parent formula, and looked up before expanding again. Sharing it between
+    trees built from the same parsed files skips re-expanding them."""
+
+    def __init__(
+        self, expand_limit=100, formula=Formula([Clause([])]), _counter=None, formulas=None
+    ) -> None:
         self.expand_limit = expand_limit
         self.formula = formula
         self.children: List[RuleTreeNode] = []
         self.props: List[object] = []  # TODO this type is clearly temporary
         self.constraints: List[Key] = []
+        self.formulas = formulas
         self._counter = _counter if _counter is not None else [0]
 
     def __iter__(self):
@@ -25,11 +36,25 @@ class RuleTreeNode:
             yield v
 
     def traverse(self, selector: Selector) -> "RuleTreeNode":
-        dnf = to_dnf(flatten(selector), self.expand_limit)
-        formula = expand(self.expand_limit, self.formula, dnf)
-        self.children.append(RuleTreeNode(self.expand_limit, formula, self._counter))
+        if self.formulas is None:
+            formula = self._expand(selector)
+        else:
+            # selectors compare by identity, so this only finds the very same
+            # parsed selector under an equal formula.
+            key = (selector, self.formula.clauses, self.formula.shared)
+            try:
+                formula = self.formulas[key]
+            except KeyError:
+                formula = self.formulas[key] = self._expand(selector)
+        self.children.append(
+            RuleTreeNode(self.expand_limit, formula, self._counter, self.formulas)
+        )
         return self.children[-1]
 
+    def _expand(self, selector: Selector) -> Formula:
+        dnf = to_dnf(flatten(selector), self.expand_limit)
+        return expand(self.expand_limit, self.formula, dnf)
+
     def _next_property_number(self) -> int:
         n = self._counter[0]
         self._counter[0] += 1
@@ -1,43 +1,79 @@
-from collections import deque
-from collections.abc import Callable
-from typing import Any, TypeVar, Optional, TextIO, Protocol
+from collections import OrderedDict, deque
+import functools
+import io
+import os
+import threading
+from collections.abc import Callable, Mapping
+from typing import TYPE_CHECKING, Any, TypeVar, Optional, TextIO, Protocol
 
 from pyrsistent import m, s, dq
 import pyrsistent
 
 from ccs.ast import ImportResolver
-from ccs.dag import AndNode, Key, Specificity, build_dag
-from ccs.error import EmptyPropertyError, AmbiguousPropertyError, MissingPropertyError
+from ccs.compiled import NodeArray, Poisoning, activate as activate_nodes, new_props
+from ccs.dag import Key, Specificity, build_dag
+from ccs.error import AmbiguousPropertyError, CcsError, EmptyPropertyError, MissingPropertyError
 from ccs.parser import Parser
 from ccs.property import Property
 from ccs.rule_tree import RuleTreeNode
+from ccs.snapshot import Snapshot
+
+if TYPE_CHECKING:
+    # imported where it's used, since caching is opt-in
+    from ccs.cache import DagCache
 
 T = TypeVar("T")
 
 
+_ZERO = Specificity(0, 0, 0, 0)
+
+
+class PropAccumulator(Protocol):
+    """What a Context keeps for each property name.
+
+    Accumulators are immutable: accum() returns the accumulator with one more
+    contribution, or the same instance if the contribution changes nothing.
+    winners() is the winning properties, in source order: exactly one, unless
+    the property is empty or ambiguous under this policy. all() is the
+    (Property, Specificity) contributions the accumulator kept."""
+
+    def accum(self, prop: Property, specificity: Specificity) -> "PropAccumulator": ...
+
+    def winners(self) -> tuple: ...
+
+    def all(self) -> list: ...
+
+
+def _beats(prop, specificity, best, best_spec):
+    """Whether prop wins over best: higher specificity, then later in source."""
+    if best is None or specificity > best_spec:
+        return True
+    return specificity == best_spec and prop.property_number > best.property_number
+
+
 class SetAccumulator:
-    def __init__(self, values=s()):
+    """Keeps every contribution, and picks a winner like MaxAccumulator."""
+
+    __slots__ = ("values", "best", "best_specificity")
+
+    def __init__(self, values=s(), best=None, best_specificity=None):
         self.values = values
+        self.best = best
+        self.best_specificity = best_specificity
 
     def accum(self, prop, specificity):
-        return SetAccumulator(self.values.add((prop, specificity)))
+        if (prop, specificity) in self.values:
+            return self
+        values = self.values.add((prop, specificity))
+        if _beats(prop, specificity, self.best, self.best_specificity):
+            return SetAccumulator(values, prop, specificity)
+        return SetAccumulator(values, self.best, self.best_specificity)
 
-    def best(self):
-        """Return the winning Property using MaxAccumulator tie-breaking logic.
+    def winners(self):
+        return (self.best,) if self.best is not None else ()
 
-        Picks the highest specificity, breaking ties by source order (last wins).
-        Returns a list of zero or one Property objects.
-        """
-        best_spec = None
-        best_prop = None
-        for prop, specificity in self.values:
-            if best_spec is None or specificity > best_spec:
-                best_spec = specificity
-                best_prop = prop
-            elif specificity == best_spec:
-                if best_prop is None or prop.property_number > best_prop.property_number:
-                    best_prop = prop
-        return [best_prop] if best_prop is not None else []
+    def all(self):
+        return list(self.values)
 
     def __repr__(self):
         return repr(pyrsistent.thaw(self.values))
@@ -46,39 +82,204 @@ class SetAccumulator:
 class MaxAccumulator:
     """Keeps the highest-specificity property, breaking ties by source order (last wins)."""
 
-    def __init__(self, specificity=Specificity(0, 0, 0, 0), values=s()):
+    __slots__ = ("specificity", "prop")
+
+    def __init__(self, specificity=_ZERO, prop=None):
         self.specificity = specificity
-        self.values = values
+        self.prop = prop
 
     def accum(self, prop, specificity):
-        if specificity > self.specificity:
-            return MaxAccumulator(specificity, s(prop))
-        if specificity == self.specificity:
-            if len(self.values) == 0 or prop.property_number > next(iter(self.values)).property_number:
-                return MaxAccumulator(self.specificity, s(prop))
-            return self
+        if _beats(prop, specificity, self.prop, self.specificity):
+            return MaxAccumulator(specificity, prop)
         return self
 
+    def winners(self):
+        return (self.prop,) if self.prop is not None else ()
+
+    def all(self):
+        return [(self.prop, self.specificity)] if self.prop is not None else []
+
     def __repr__(self):
-        return repr(pyrsistent.thaw(self.values))
+        return repr(set(self.winners()))
 
 
 class StrictMaxAccumulator:
     """Like MaxAccumulator but reports ties as ambiguous instead of resolving by source order."""
 
-    def __init__(self, specificity=Specificity(0, 0, 0, 0), values=s()):
+    __slots__ = ("specificity", "props")
+
+    def __init__(self, specificity=_ZERO, props=()):
         self.specificity = specificity
-        self.values = values
+        self.props = props  # tied at specificity, in source order
 
     def accum(self, prop, specificity):
-        if specificity > self.specificity:
-            return StrictMaxAccumulator(specificity, s(prop))
-        if specificity == self.specificity:
-            return StrictMaxAccumulator(self.specificity, self.values.add(prop))
+        if specificity > self.specificity or not self.props:
+            return StrictMaxAccumulator(specificity, (prop,))
+        if specificity == self.specificity and prop not in self.props:
+            props = sorted(self.props + (prop,), key=lambda p: p.property_number)
+            return StrictMaxAccumulator(specificity, tuple(props))
         return self
 
+    def winners(self):
+        return self.props
+
+    def all(self):
+        return [(prop, self.specificity) for prop in self.props]
+
     def __repr__(self):
-        return repr(pyrsistent.thaw(self.values))
+        return repr(set(self.props))
+
+
+class AugmentCache:
+    """A size-bounded LRU cache of augmented contexts.
+
+    Maps (parent context, key, value) to the Context that parent.augment(key,
+    value) returns. Contexts are immutable, so a cached child can be handed out
+    any number of times; it carries the debug location and tracer of the parent
+    it was made from. Attach one to a Dag (dag.augment_cache) to share it among
+    all contexts on that Dag. Safe for use from several threads.
+    """
+
+    def __init__(self, max_entries: int = 4096) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, parent, key, value):
+        # entries hold their parent, so its id can't be reused while cached.
+        with self._lock:
+            entry = self._entries.get((id(parent), key, value))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((id(parent), key, value))
+            self.hits += 1
+            return entry[1]
+
+    def put(self, parent, key, value, child) -> None:
+        with self._lock:
+            self._entries[(id(parent), key, value)] = (parent, child)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # a pickled cache (say, along with its Dag) comes back empty.
+    def __getstate__(self):
+        return {"max_entries": self.max_entries}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_entries"])
+
+
+class ContextTrie:
+    """Contexts built from one root, keyed by the sequence of steps that led to them.
+
+    Every prefix of a path is stored along with the path itself, so a lookup
+    augments only from the longest prefix already built, and contexts for
+    different paths share their common prefixes. At most max_entries contexts
+    are kept; the least recently used are dropped first. Safe for use from
+    several threads.
+    """
+
+    def __init__(self, root: "Context", max_entries: int = 4096) -> None:
+        self.root = root
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, *, build: bool = True) -> Optional["Context"]:
+        """The context reached from root by augmenting with each (key, value) of
+        path in turn. Without build, None if it isn't already stored."""
+        path = tuple(path)
+        with self._lock:
+            ctx, depth = self.root, 0
+            for i in range(len(path), 0, -1):
+                found = self._entries.get(path[:i])
+                if found is not None:
+                    ctx, depth = found, i
+                    break
+            for i in range(1, depth + 1):
+                self._entries.move_to_end(path[:i])
+            if depth == len(path):
+                self.hits += 1
+                return ctx
+            if not build:
+                return None
+            self.misses += 1
+        # augment outside the lock; racing builders produce equal contexts, and
+        # the first one stored wins.
+        built = []
+        for key, value in path[depth:]:
+            ctx = ctx.augment(key, value)
+            built.append(ctx)
+        with self._lock:
+            for i, ctx in enumerate(built, depth + 1):
+                ctx = self._entries.setdefault(path[:i], ctx)
+                self._entries.move_to_end(path[:i])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return ctx
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getstate__(self):
+        return {"root": self.root, "max_entries": self.max_entries}
+
+    def __setstate__(self, state):
+        self.__init__(state["root"], state["max_entries"])
+
+
+# accumulators whose final state doesn't depend on the order contributions
+# arrive in. SetAccumulator keeps every contribution, so it isn't one.
+_ORDER_INSENSITIVE_ACCUMULATORS = (MaxAccumulator, StrictMaxAccumulator)
+
+
+class LazyProps(Mapping):
+    """The props of a lazy Context: a read-only mapping from property name to
+    accumulator, where each entry is computed on first lookup and remembered.
+
+    A lazy context doesn't accumulate properties as nodes activate. Instead, a
+    lookup takes the nodes setting that property from the Dag's property index
+    and accumulates each active one at its final activation specificity. For
+    MaxAccumulator and StrictMaxAccumulator, that gives the same result as
+    accumulating at every activation."""
+
+    def __init__(self, ctx: "Context") -> None:
+        self._ctx = ctx
+        self._resolved: dict = {}
+
+    def __getitem__(self, name):
+        try:
+            accum = self._resolved[name]
+        except KeyError:
+            accum = self._resolved[name] = self._ctx._resolve(name)
+        if accum is None:
+            raise KeyError(name)
+        return accum
+
+    def __iter__(self):
+        return (name for name in self._ctx.graph.prop_index() if name in self)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
 
 
 class PropertyTracer(Protocol):
@@ -95,179 +296,324 @@ class Context:
         *,
         prop_accumulator=None,
         trace_properties: Optional[PropertyTracer] = None,
+        cache: Optional["DagCache"] = None,
+        parser: Optional[Parser] = None,
+        lazy: bool = False,
     ) -> "Context":
-        parser = Parser()
-        if import_resolver is not None:
-            rules = parser.parse_ccs_stream(stream, filename, import_resolver, [])
+        load = functools.partial(_load_dag, parser=parser or Parser())
+        if cache is not None:
+            dag = cache.load_or_build(stream, filename, import_resolver, load)
         else:
-            rules = parser.parse(stream, filename)
+            dag = load(stream, filename, import_resolver)
+        return root_context(
+            dag, prop_accumulator, trace_properties=trace_properties, lazy=lazy
+        )
+
+    @classmethod
+    def from_compiled(
+        cls,
+        path,
+        *,
+        prop_accumulator=None,
+        trace_properties: Optional[PropertyTracer] = None,
+        lazy: bool = False,
+        mapped: bool = False,
+    ) -> "Context":
+        """The root context of a compiled artifact, as written by `ccs compile`
+        or compile_ccs_stream(). Nothing is parsed or built.
+
+        With mapped set, the artifact is memory-mapped and read in place (see
+        artifact.MappedDag) rather than copied, so that processes using the
+        same file share a single copy of it."""
+        from ccs import artifact
+
+        return root_context(
+            artifact.load(path, mapped=mapped),
+            prop_accumulator,
+            trace_properties=trace_properties,
+            lazy=lazy,
+        )
+
+    @classmethod
+    def from_mapping(
+        cls,
+        dag,
+        mapping: Mapping,
+        *,
+        prop_accumulator=MaxAccumulator,
+        trace_properties: Optional[PropertyTracer] = None,
+        poisoning: bool = False,
+        lazy: bool = False,
+        build: bool = True,
+    ) -> Optional["Context"]:
+        """The context for dag given by a mapping from key to value (or None).
+
+        The result doesn't depend on the mapping's order: steps are applied in
+        an order derived from the Dag, and contexts are shared through a
+        ContextTrie kept on the Dag, so equal mappings give the same Context
+        object. Where step order can change the outcome (with poisoning on a
+        Dag with constraints, or with an accumulator that keeps every
+        contribution), the steps are applied in the mapping's own order and
+        nothing is shared.
+
+        Without build, the result is None unless it's already shared, so
+        nothing is augmented.
+        """
+        graph = dag.compiled()
+        order_matters = prop_accumulator not in _ORDER_INSENSITIVE_ACCUMULATORS or (
+            poisoning and len(graph.constraints) > 0
+        )
 
-        root = RuleTreeNode()
-        rules.add_to(root)
-        dag = build_dag(root)
-        kwargs = {"trace_properties": trace_properties}
-        if prop_accumulator is not None:
-            kwargs["prop_accumulator"] = prop_accumulator
-        return Context(dag, **kwargs)
+        def root():
+            ctx = root_context(
+                dag, prop_accumulator, trace_properties=trace_properties, lazy=lazy
+            )
+            return ctx.with_poisoning() if poisoning else ctx
+
+        if order_matters:
+            return root().augment_many(mapping) if build else None
+
+        tries = dag.context_tries
+        trie_key = (prop_accumulator, trace_properties, poisoning, lazy)
+        trie = tries.get(trie_key)
+        if trie is None:
+            if not build:
+                return None
+            trie = tries.setdefault(trie_key, ContextTrie(root(), dag.context_trie_size))
+        rank = graph.key_ranks()
+        path = sorted(
+            mapping.items(),
+            key=lambda kv: (rank.get(kv[0], len(rank)), kv[0]),
+        )
+        return trie.get(path, build=build)
 
     def __init__(
         self,
         dag,
         prop_accumulator=MaxAccumulator,
-        tallies=m(),
-        or_specificities=m(),
+        tallies=None,
+        or_specificities=None,
         props=m(),
         poisoned=None,
         *,
         debug_location=None,
         trace_properties: Optional[PropertyTracer] = None,
+        lazy: bool = False,
     ):
+        """A new root context for dag, unless node state is given.
+
+        With lazy, properties aren't accumulated while augmenting, but resolved
+        one name at a time on lookup (see LazyProps). Only MaxAccumulator and
+        StrictMaxAccumulator support this."""
+        if lazy and prop_accumulator not in _ORDER_INSENSITIVE_ACCUMULATORS:
+            raise ValueError(f"{prop_accumulator.__name__} can't resolve properties lazily")
         self.dag = dag
-        self.tallies = tallies
-        self.or_specificities = or_specificities
+        self.graph = graph = dag.compiled()
+        # per-node state, indexed by node id: remaining tally counts, the best
+        # activation specificity of each OrNode (as an index into
+        # graph.specificities), and, if poisoning is enabled, a Poisoning.
+        self.tallies = tallies if tallies is not None else graph.initial_tallies()
+        self.or_specificities = (
+            or_specificities if or_specificities is not None else NodeArray.zeros(len(graph))
+        )
         self.prop_accumulator = prop_accumulator
         self.props = props
         self.poisoned = poisoned
         self.debug_location = debug_location if debug_location is not None else dq()
         self.trace_properties = trace_properties
-
-        if len(props) == 0:
-            for field, new_value in self._augment(deque(), activate_root=True).items():
+        self.lazy = lazy
+
+        if tallies is None:
+            # a new root context. unless it starts out poisoning, its state
+            # depends only on the dag and accumulator, so it's shared.
+            if poisoned is None:
+                state = graph.root_states.get((prop_accumulator, lazy))
+                if state is None:
+                    state = graph.root_states.setdefault(
+                        (prop_accumulator, lazy), self._augment((), activate_root=True)
+                    )
+            else:
+                state = self._augment((), activate_root=True)
+            for field, new_value in state.items():
                 setattr(self, field, new_value)
+        if lazy:
+            self.props = LazyProps(self)
+
+    def with_poisoning(self) -> "Context":
+        """A copy of this context that poisons nodes for values other than the ones
+        it's augmented with (the closed-world assumption). Nothing already in this
+        context is poisoned."""
+        return Context(
+            self.dag,
+            self.prop_accumulator,
+            self.tallies,
+            self.or_specificities,
+            self.props,
+            Poisoning.start(
+                self.graph,
+                self.poisoned.or_tallies() if self.poisoned is not None else self.tallies,
+            ),
+            debug_location=self.debug_location,
+            trace_properties=self.trace_properties,
+            lazy=self.lazy,
+        )
 
     def augment(self, key, value=None):
-        key = Key(key, {value})
-        changes = self._augment(deque([key]))
+        cache = self.dag.augment_cache
+        if cache is not None:
+            child = cache.get(self, key, value)
+            if child is not None:
+                return child
+        step = Key(key, {value})
+        changes = self._augment([step])
+        child = Context(
+            self.dag,
+            self.prop_accumulator,
+            **changes,
+            debug_location=self.debug_location.append(step),
+            trace_properties=self.trace_properties,
+            lazy=self.lazy,
+        )
+        if cache is not None:
+            cache.put(self, key, value, child)
+        return child
+
+    def augment_many(self, steps) -> "Context":
+        """Augment with several keys at once.
+
+        steps is either a mapping from key to value, or an iterable of
+        (key, value) pairs, where a value of None matches the key alone. The
+        result is the same as calling augment() for each step in order, but
+        the steps share one propagation pass and only one Context is created.
+        """
+        if isinstance(steps, Mapping):
+            steps = steps.items()
+        keys = [Key(key, {value}) for key, value in steps]
+        if not keys:
+            return self
+        changes = self._augment(keys)
         return Context(
             self.dag,
             self.prop_accumulator,
             **changes,
-            debug_location=self.debug_location.append(key),
+            debug_location=self.debug_location.extend(keys),
             trace_properties=self.trace_properties,
+            lazy=self.lazy,
         )
 
-    def _augment(self, keys, *, activate_root=False) -> dict:
-        tallies = self.tallies
-        or_specificities = self.or_specificities
+    def _augment(self, steps, *, activate_root=False) -> dict:
+        """Apply each key in steps in turn, along with any constraints it brings
+        into play, and return the new values of the state fields."""
+        keys = deque()
+        graph = self.graph
+        specificities = graph.specificities
+        prop_offsets = graph.prop_offsets
+        constraint_offsets = graph.constraint_offsets
+        tallies = self.tallies.evolver()
+        or_specificities = self.or_specificities.evolver()
         poisoned = self.poisoned
-        props = self.props
-
-        def accum_tally(n):
-            nonlocal tallies
-            count = tallies.get(n, n.tally_count)
-            if count > 0:
-                count -= 1
-                tallies = tallies.set(n, count)
-                if count == 0:
-                    return True
-            return False
-
-        def activate_and(n, propagated_specificity):
-            if accum_tally(n):
-                return n.specificity
-            return None
-
-        def activate_or(n, propagated_specificity):
-            nonlocal or_specificities
-            prev_spec = or_specificities.get(n, Specificity(0, 0, 0, 0))
-            if propagated_specificity is None:
-                return prev_spec
-            if propagated_specificity > prev_spec:
-                or_specificities = or_specificities.set(n, propagated_specificity)
-                return propagated_specificity
-            return None
-
-        def activate(n, propagated_specificity=None):
-            nonlocal keys
+        props = None if self.lazy else self.props
+
+        def fire(fired):
             nonlocal props
-            activator = activate_and if isinstance(n, AndNode) else activate_or
-            activation_specificity = activator(n, propagated_specificity)
-            if activation_specificity:
-                for constraint in n.constraints:
-                    keys.append(constraint)
-                props = _update_props(
-                    props, n.props, self.prop_accumulator, activation_specificity
-                )
-                for n in n.children:
-                    activate(n, activation_specificity)
-
-        def poison(n):
-            nonlocal poisoned
-            fully_poisoned = False
-            if isinstance(n, AndNode):
-                # a bit of care is required here, since we build tally-one
-                # conjunction nodes for literals, even when they represent
-                # disjunctions of multiple values.
-                # TODO this is starting to feel a bit too cute and tricky,
-                # might be time to build those in a more obvious way and use
-                # a more explicit technique to ensure uniqueness of literal
-                # values in context.
-                # but anyway, because of that, and because we always activate
-                # prior to poisoning, we can avoid incorrectly poisoning a
-                # literal node just by checking to see whether it's already
-                # been fully activated. that's the only scenario in which this
-                # can happen, so it's sufficient to detect it.
-                if tallies.get(n) != 0 and n not in poisoned:
-                    fully_poisoned = True
-            else:
-                fully_poisoned = accum_tally(n)
-            if fully_poisoned:
-                poisoned = poisoned.add(n)
-                for n in n.children:
-                    poison(n)
+            for n, spec in fired:
+                keys.extend(graph.constraints[constraint_offsets[n] : constraint_offsets[n + 1]])
+                if props is not None and prop_offsets[n] != prop_offsets[n + 1]:
+                    props = _update_props(
+                        props,
+                        graph.props[prop_offsets[n] : prop_offsets[n + 1]],
+                        self.prop_accumulator,
+                        specificities[spec],
+                    )
+
+        def activate(starts):
+            # activation only queues constraints and accumulates properties,
+            # neither of which affects the walk, so they can be applied after it.
+            fired = []
+            activate_nodes(graph, tallies, or_specificities, starts, fired)
+            fire(fired)
 
         def match_step(key, value):
-            if key in self.dag.children:
-                matcher = self.dag.children[key]
-                if matcher.wildcard:
-                    activate(matcher.wildcard)
+            nonlocal poisoned
+            if key in graph.children:
+                matcher = graph.children[key]
+                starts = [] if matcher.wildcard is None else [matcher.wildcard]
                 if value and value in matcher.positive_values:
-                    for node in matcher.positive_values[value]:
-                        activate(node)
+                    starts.extend(graph.literal_nodes(matcher.positive_values[value]))
+                activate(starts)
                 # TODO negative matches here too
                 if poisoned is not None:
-                    for v2, nodes in matcher.positive_values.items():
-                        # TODO here, there's a question... if value is None, do
-                        # we insist that no value ever be asserted for key and
-                        # poison everything? or do we remain agnostic, with the
-                        # idea that key.value is still a monotonic refinement of
-                        # just key? for now we assume the former.
-                        if value != v2:
-                            for node in nodes:
-                                poison(node)
-                        # TODO and of course dually negative matches too
+                    poisoned = poisoned.bind(key, value, tallies.persistent())
+
+        def drain():
+            while keys:
+                key = keys.popleft()
+                assert len(key.values) < 2
+                match_step(key.name, next(iter(key.values), None))
 
         if activate_root:
-            keys = deque(self.dag.prop_node.constraints) + keys
-            activate(self.dag.prop_node)
+            keys.extend(graph.node_constraints(graph.ROOT))
+            activate([graph.ROOT])
+            drain()
 
-        while keys:
-            key = keys.popleft()
-            assert len(key.values) < 2
-            match_step(key.name, next(iter(key.values), None))
+        # each step's constraints are processed before the next step, exactly
+        # as if the steps had been separate augments.
+        for key in steps:
+            keys.append(key)
+            drain()
 
         return {
-            "tallies": tallies,
-            "or_specificities": or_specificities,
+            "tallies": tallies.persistent(),
+            "or_specificities": or_specificities.persistent(),
             "props": props,
             "poisoned": poisoned,
         }
 
-    def get_single_property(self, prop: str) -> Property:
+    def _activation_specificity(self, n) -> Optional[Specificity]:
+        """The specificity node n last activated with, or None if it's inactive."""
+        graph = self.graph
+        if graph.is_and[n]:
+            return graph.specificity(n) if self.tallies[n] == 0 else None
+        if n == graph.ROOT:
+            return graph.specificities[graph.ZERO_SPEC]
+        # OrNodes only ever activate with a nonzero specificity
+        spec = self.or_specificities[n]
+        return graph.specificities[spec] if spec != graph.ZERO_SPEC else None
+
+    def _resolve(self, name):
+        """Accumulate name from scratch over the active nodes setting it."""
+        accum = None
+        for n, prop in self.graph.prop_index().get(name, ()):
+            spec = self._activation_specificity(n)
+            if spec is not None:
+                if accum is None:
+                    accum = self.prop_accumulator()
+                accum = accum.accum(prop, Specificity(prop.override_level, 0, 0, 0) + spec)
+        return accum
+
+    def _winners(self, prop: str):
+        """The winning properties for prop (one, unless it's empty or ambiguous),
+        or None if prop isn't set."""
         contenders = self.props.get(prop, None)
-        if contenders is None:
-            raise MissingPropertyError(f"Invalid property: {prop}")
+        return contenders.winners() if contenders is not None else None
 
-        # TODO this is terrible, accumulator interface should be changed
-        if hasattr(contenders, "best"):
-            properties = contenders.best()
-        else:
-            properties = list(contenders.values)
+    def snapshot(self) -> Snapshot:
+        """Resolve every property of this context into a Snapshot."""
+        entries = {}
+        for name in self.props:
+            properties = self._winners(name)
+            entries[name] = properties[0] if len(properties) == 1 else properties
+        return Snapshot(entries, tuple(str(key) for key in self.debug_location))
+
+    def get_single_property(self, prop: str) -> Property:
+        properties = self._winners(prop)
+        if properties is None:
+            raise MissingPropertyError(f"Invalid property: {prop}")
         if len(properties) == 0:
             raise EmptyPropertyError(f"Property {prop} has no values")
         if len(properties) > 1:
             raise AmbiguousPropertyError(
-                f"Property {prop} has too many values: {properties}"
+                f"Property {prop} has too many values: {list(properties)}"
             )
 
         match = properties[0]
@@ -302,6 +648,60 @@ class Context:
             return default
 
 
+def root_context(
+    dag,
+    prop_accumulator=None,
+    *,
+    trace_properties: Optional[PropertyTracer] = None,
+    lazy: bool = False,
+) -> Context:
+    """The root Context of dag, built once per accumulator, tracer and mode and
+    then shared. Also available as dag.root_context()."""
+    if prop_accumulator is None:
+        prop_accumulator = MaxAccumulator
+    roots = dag.compiled().root_contexts
+    key = (prop_accumulator, trace_properties, lazy)
+    ctx = roots.get(key)
+    if ctx is None:
+        ctx = roots.setdefault(
+            key,
+            Context(dag, prop_accumulator, trace_properties=trace_properties, lazy=lazy),
+        )
+    return ctx
+
+
+def _load_dag(stream, filename, import_resolver, *, parser):
+    if import_resolver is not None:
+        rules = parser.parse_ccs_stream(stream, filename, import_resolver, [])
+        if rules is None:
+            raise CcsError(f"Errors loading '{filename}'")
+    else:
+        rules = parser.parse(stream, filename)
+
+    root = RuleTreeNode()
+    rules.add_to(root)
+    return build_dag(root)
+
+
+def compile_ccs_stream(
+    stream: TextIO,
+    filename: str,
+    import_resolver: Optional[ImportResolver] = None,
+    *,
+    parser: Optional[Parser] = None,
+) -> bytes:
+    """Build a compiled artifact (see ccs.artifact) from CCS source, stamped
+    with the fingerprint of the source and everything it imports."""
+    from ccs import artifact
+    from ccs.cache import RecordingResolver
+
+    text = stream.read()
+    recorder = RecordingResolver(import_resolver) if import_resolver is not None else None
+    dag = _load_dag(io.StringIO(text), filename, recorder, parser=parser or Parser())
+    contents = recorder.contents if recorder is not None else {}
+    return artifact.dumps(dag.compiled(), artifact.fingerprint(filename, text, contents))
+
+
 def _update_props(props, new_props, prop_accumulator, activation_specificity):
     for name, prop_val in new_props:
         prop_vals = props.get(name, prop_accumulator())
@@ -312,32 +712,65 @@ def _update_props(props, new_props, prop_accumulator, activation_specificity):
     return props
 
 
-def suggest_context(ctx):
+def _new_props(ctx, current_props, key_name, value):
+    return set(ctx.augment(key_name, value).props.keys()) - current_props
+
+
+def suggest_context(ctx, *, executor=None):
     """Discover context elements that would activate new properties.
 
     Returns a list of (key_name, value_or_None, new_property_names) tuples
     for each context element from the DAG's literal matchers that would add
     properties not currently set.
 
-    This leverages persistent data structures — each trial augment is cheap
-    and shares structure with the original context.
+    Rather than augment ctx with each element in turn, this walks the nodes
+    each one would activate, reading but not copying the context's state,
+    and skipping any part of the Dag that can't reach an unset property (see
+    CompiledDag.reachable_props()). Only where the walk can reach
+    constraints, which bring in further steps, is a real trial augment
+    needed. Those run on executor, if one is given; with a
+    ProcessPoolExecutor, ctx is pickled for each chunk of trials.
     """
+    graph = ctx.graph
     current_props = set(ctx.props.keys())
-    suggestions = []
+    reach, constrained = graph.reachable_props()
     seen = set()
     for key in ctx.debug_location:
         seen.add((key.name, next(iter(key.values), None)))
-    for key_name, matcher in ctx.dag.children.items():
+
+    candidates = []
+    for key_name, matcher in graph.children.items():
+        wildcard = [] if matcher.wildcard is None else [matcher.wildcard]
         for value in sorted(matcher.positive_values.keys()):
-            if (key_name, value) in seen:
-                continue
-            trial = ctx.augment(key_name, value)
-            new_props = set(trial.props.keys()) - current_props
-            if new_props:
-                suggestions.append((key_name, value, new_props))
-        if matcher.wildcard and (key_name, None) not in seen:
-            trial = ctx.augment(key_name)
-            new_props = set(trial.props.keys()) - current_props
-            if new_props:
-                suggestions.append((key_name, None, new_props))
-    return suggestions
+            if (key_name, value) not in seen:
+                starts = wildcard + list(graph.literal_nodes(matcher.positive_values[value]))
+                candidates.append((key_name, value, starts if value else wildcard))
+        if wildcard and (key_name, None) not in seen:
+            candidates.append((key_name, None, wildcard))
+
+    results = {}
+    trials = []
+    useful = {}
+    for i, (key_name, value, starts) in enumerate(candidates):
+        if any(constrained[n] for n in starts):
+            trials.append(i)
+        else:
+            results[i] = new_props(
+                graph, ctx.tallies, ctx.or_specificities, starts, current_props, useful
+            )
+
+    trial = functools.partial(_new_props, ctx, current_props)
+    keys = [candidates[i][0] for i in trials]
+    values = [candidates[i][1] for i in trials]
+    if executor is not None and trials:
+        chunksize = -(-len(trials) // (os.cpu_count() or 1))
+        new = executor.map(trial, keys, values, chunksize=chunksize)
+    else:
+        new = map(trial, keys, values)
+    results.update(zip(trials, new))
+
+    return [
+        (candidates[i][0], candidates[i][1], results[i])
+        for i in sorted(results)
+        if results[i]
+    ]
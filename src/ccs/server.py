@@ -0,0 +1,262 @@
+"""A query server for a CCS configuration, over a Unix domain socket.
+
+A QueryServer keeps a configuration loaded, typically through a
+ConfigHandle so that it's reloaded as its files change, and answers
+requests made with ccs.client (or anything else speaking ccs.protocol).
+Each request carries one or more queries: a list of context steps, and the
+names of the properties wanted in the context those steps lead to.
+
+Contexts are shared by all clients: a query whose steps name each key once
+is answered from Context.from_mapping(), so the same steps in any order
+reach the same cached context, and a client reusing a prefix of another's
+steps only augments from there. That's only so when serving a root
+context; queries against an augmented one augment from it each time.
+After a reload, queries go to the new Dag, and so to its own caches.
+
+The server runs on one asyncio event loop, which hands queries needing a
+context that isn't cached yet to a thread pool. Request latency (from a request being
+read to its response being written) is recorded in stats, and available
+to clients through a STATS request.
+"""
+
+import asyncio
+import json
+import os
+import stat
+import threading
+import time
+from concurrent.futures import Executor
+from typing import Dict, List, Optional
+
+from ccs import protocol
+from ccs.error import AmbiguousPropertyError, EmptyPropertyError, MissingPropertyError
+from ccs.protocol import LatencyStats, ProtocolError, Reader, Writer
+from ccs.search_state import Context
+
+
+class ServerStats:
+    def __init__(self) -> None:
+        self.connections = 0
+        self.open_connections = 0
+        self.requests = 0
+        self.queries = 0
+        self.errors = 0
+        self.latency = LatencyStats()
+
+    def as_dict(self) -> dict:
+        stats = dict(self.__dict__)
+        stats["latency"] = self.latency.as_dict()
+        return stats
+
+    def __repr__(self):
+        return str(self.as_dict())
+
+
+class QueryServer:
+    """Answers queries against config over a Unix domain socket.
+
+    config is either a Context, which is always queried from, or something
+    with a context attribute giving the current root Context, such as a
+    ConfigHandle, which is read afresh for each request.
+
+    A request whose contexts are all cached is answered on the event loop.
+    Any other is answered on executor (by default, the event loop's own
+    thread pool), so that building a context doesn't hold up requests on
+    other connections. Requests on one connection are still answered in
+    turn.
+
+    serve() runs the server in the current event loop until close() is
+    called, which may be done from any thread; run() does the same in a new
+    event loop. ready is set once the socket is listening."""
+
+    def __init__(self, config, *, executor: Optional[Executor] = None) -> None:
+        self.config = config
+        self.executor = executor
+        self.stats = ServerStats()
+        self.ready = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._handlers: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    def run(self, path) -> None:
+        asyncio.run(self.serve(path))
+
+    async def serve(self, path) -> None:
+        path = os.fspath(path)
+        # a socket left over from a server that didn't shut down cleanly is
+        # replaced; anything else at path is left alone.
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_unix_server(self._connection, path)
+        try:
+            self.ready.set()
+            await self._stop.wait()
+        finally:
+            server.close()
+            # closing each connection ends its handler's read, so handlers
+            # finish by themselves rather than being left for asyncio.run()
+            # to cancel, which it would log as an error for each one.
+            for writer in list(self._handlers.values()):
+                writer.close()
+            if self._handlers:
+                await asyncio.gather(*self._handlers, return_exceptions=True)
+            await server.wait_closed()
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self.ready.clear()
+            self._loop = None
+
+    def close(self) -> None:
+        """Stop serving. Safe to call from any thread, or a signal handler,
+        and more than once."""
+        loop, stop = self._loop, self._stop
+        if loop is not None and stop is not None:
+            try:
+                loop.call_soon_threadsafe(stop.set)
+            except RuntimeError:
+                pass  # the loop has already finished
+
+    def _root(self) -> Context:
+        config = self.config
+        return config if isinstance(config, Context) else config.context
+
+    async def _connection(self, reader, writer) -> None:
+        stats = self.stats
+        stats.connections += 1
+        stats.open_connections += 1
+        task = asyncio.current_task()
+        self._handlers[task] = writer
+        try:
+            while True:
+                try:
+                    (size,) = protocol.FRAME.unpack(
+                        await reader.readexactly(protocol.FRAME.size)
+                    )
+                    if size > protocol.MAX_FRAME:
+                        stats.errors += 1
+                        break
+                    payload = await reader.readexactly(size)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                start = time.perf_counter()
+                response = await self._respond(payload)
+                if response is None:
+                    break
+                writer.write(response)
+                stats.latency.record(time.perf_counter() - start)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            stats.open_connections -= 1
+            del self._handlers[task]
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _respond(self, payload: bytes) -> Optional[bytes]:
+        """The framed response to a request payload, or None if it's too
+        garbled to answer at all."""
+        stats = self.stats
+        try:
+            request_id, op = protocol.REQUEST.unpack_from(payload)
+        except Exception:
+            stats.errors += 1
+            return None
+        stats.requests += 1
+        w = Writer()
+        try:
+            r = Reader(payload, protocol.REQUEST.size)
+            if op == protocol.OP_QUERY:
+                queries = protocol.read_queries(r)
+                # answered here if every context needed is cached already.
+                # building one can take a while, so that's done off the event
+                # loop, which meanwhile goes on serving other connections.
+                answers = self._answer(queries, build=False)
+                if answers is None:
+                    answers = await asyncio.get_running_loop().run_in_executor(
+                        self.executor, self._answer, queries
+                    )
+                body = Writer()
+                protocol.write_answers(body, answers)
+                stats.queries += len(queries)
+            elif op == protocol.OP_STATS:
+                r.end()
+                body = Writer()
+                body.str32(json.dumps(self._stats()))
+            else:
+                raise ProtocolError(f"unknown op {op}")
+        except Exception as e:
+            stats.errors += 1
+            w.raw(protocol.RESPONSE.pack(request_id, protocol.STATUS_ERROR))
+            w.str32(str(e) if isinstance(e, ProtocolError) else f"{type(e).__name__}: {e}")
+            return w.frame()
+        w.raw(protocol.RESPONSE.pack(request_id, protocol.STATUS_OK))
+        w.parts += body.parts
+        return w.frame()
+
+    def _answer(self, queries, build: bool = True) -> Optional[List[List[protocol.Answer]]]:
+        """The answers to queries; without build, None unless every context
+        they need is already cached."""
+        root = self._root()
+        contexts = []
+        for steps, _ in queries:
+            ctx = self._context(root, steps, build)
+            if ctx is None:
+                return None
+            contexts.append(ctx)
+        answers = []
+        for ctx, (_, names) in zip(contexts, queries):
+            answer = []
+            for name in names:
+                try:
+                    answer.append((protocol.VALUE, str(ctx.get_single_value(name))))
+                except MissingPropertyError as e:
+                    answer.append((protocol.MISSING, str(e)))
+                except EmptyPropertyError as e:
+                    answer.append((protocol.EMPTY, str(e)))
+                except AmbiguousPropertyError as e:
+                    answer.append((protocol.AMBIGUOUS, str(e)))
+            answers.append(answer)
+        return answers
+
+    def _context(self, root: Context, steps, build: bool = True) -> Optional[Context]:
+        if not steps:
+            return root
+        if root.debug_location or len({key for key, _ in steps}) < len(steps):
+            # from_mapping() starts from the Dag's root context, so it can't
+            # be used to go on from a context that's already been augmented;
+            # and with a key given twice, the order of the steps matters.
+            return root.augment_many(steps) if build else None
+        return Context.from_mapping(
+            root.dag,
+            dict(steps),
+            prop_accumulator=root.prop_accumulator,
+            trace_properties=root.trace_properties,
+            poisoning=root.poisoned is not None,
+            lazy=root.lazy,
+            build=build,
+        )
+
+    def _stats(self) -> dict:
+        stats = self.stats.as_dict()
+        root = self._root()
+        tries = root.dag.context_tries.values()
+        stats["contexts"] = {
+            "cached": sum(len(trie) for trie in tries),
+            "hits": sum(trie.hits for trie in tries),
+            "misses": sum(trie.misses for trie in tries),
+        }
+        for name in ("generation", "reloads", "failures"):
+            if hasattr(self.config, name):
+                stats[name] = getattr(self.config, name)
+        return stats
@@ -0,0 +1,72 @@
+"""Frozen, fully resolved views of a Context."""
+
+from collections.abc import Callable, Iterator, Mapping
+from typing import Any, Optional, Tuple, TypeVar, Union
+
+from ccs.error import AmbiguousPropertyError, EmptyPropertyError, MissingPropertyError
+from ccs.property import Property
+
+T = TypeVar("T")
+
+# a resolved property, or the tuple of contenders when there isn't exactly one
+Entry = Union[Property, Tuple[Property, ...]]
+
+
+class Snapshot(Mapping):
+    """Every property of a Context, resolved once.
+
+    Maps each property name to its winning Property, or, where the context has
+    no single winner, to the tuple of contenders (empty, or in source order if
+    ambiguous). Lookups are plain dict lookups. A Snapshot is immutable, so it
+    can be shared freely between threads, and pickles as a dict of Properties.
+    Unlike Context, it doesn't trace lookups.
+    """
+
+    __slots__ = ("_entries", "location")
+
+    def __init__(self, entries: Mapping[str, Entry], location: Tuple[str, ...] = ()) -> None:
+        self._entries = dict(entries)
+        self.location = location
+
+    def __getitem__(self, name: str) -> Entry:
+        return self._entries[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __reduce__(self):
+        return (Snapshot, (self._entries, self.location))
+
+    def __repr__(self) -> str:
+        location = " > ".join(self.location) or "<root>"
+        return f"<Snapshot of {len(self)} properties in [{location}]>"
+
+    def get_single_property(self, prop: str) -> Property:
+        entry = self._entries.get(prop)
+        if entry is None:
+            raise MissingPropertyError(f"Invalid property: {prop}")
+        if isinstance(entry, Property):
+            return entry
+        if len(entry) == 0:
+            raise EmptyPropertyError(f"Property {prop} has no values")
+        raise AmbiguousPropertyError(f"Property {prop} has too many values: {list(entry)}")
+
+    def get_single_value(
+        self, prop: str, *, cast: Optional[Callable[[Any], T]] = None
+    ) -> T:
+        value = self.get_single_property(prop).value
+        if cast is not None:
+            return cast(value)
+        else:
+            return value
+
+    def try_get_single_value(
+        self, prop: str, default: T, *, cast: Optional[Callable[[Any], T]] = None
+    ) -> T:
+        try:
+            return self.get_single_value(prop, cast=cast)
+        except MissingPropertyError:
+            return default
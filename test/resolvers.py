@@ -0,0 +1,13 @@
+"""Import resolvers shared by the tests."""
+
+from io import StringIO
+
+
+class DictResolver:
+    """Resolves each import location to the text given for it in files."""
+
+    def __init__(self, files):
+        self.files = files
+
+    def resolve(self, location):
+        return StringIO(self.files[location])
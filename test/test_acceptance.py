@@ -68,9 +68,10 @@ TESTS_PATH = Path(__file__).parent / "acceptance_tests.txt"
 cases = parse_tests(TESTS_PATH) if TESTS_PATH.exists() else []
 
 
+@pytest.mark.parametrize("lazy", [False, True], ids=["eager", "lazy"])
 @pytest.mark.parametrize("name, ccs, assertions", cases, ids=[c[0] for c in cases])
-def test_acceptance(name, ccs, assertions):
-    ctx = Context.from_ccs_stream(StringIO(ccs), name)
+def test_acceptance(name, ccs, assertions, lazy):
+    ctx = Context.from_ccs_stream(StringIO(ccs), name, lazy=lazy)
     for selector, prop, expected in assertions:
         augmented = apply_selector(ctx, selector)
         assert augmented.get_single_value(prop) == expected
@@ -0,0 +1,153 @@
+import os
+import pickle
+import subprocess
+import sys
+from io import StringIO
+
+import pytest
+
+from ccs import artifact
+from ccs.dump import dump_dag
+from ccs.error import ArtifactError
+from ccs.search_state import Context, compile_ccs_stream
+
+from resolvers import DictResolver
+from test_dag import CONFIGS
+
+
+FILES = {
+    "main.ccs": '@import "helpers.ccs"\nx = 1\nenv.prod { x = 2; @constrain tier.web }\n',
+    "helpers.ccs": 'tier.web, tier.db : @override y = "${CCS_ARTIFACT_TEST}"\n',
+}
+
+
+def compile_files(files, filename="main.ccs"):
+    return compile_ccs_stream(StringIO(files[filename]), filename, DictResolver(files))
+
+
+def dump(ctx):
+    out = StringIO()
+    dump_dag(ctx, out=out)
+    return out.getvalue()
+
+
+def check_graph(graph, ctx):
+    """Assert that graph matches ctx.graph and answers queries the same way."""
+    original = ctx.graph
+    for name in ["is_and", "spec_ids", "tally_counts", "child_ids", "parent_ids", "literal_ids"]:
+        assert list(getattr(graph, name)) == list(getattr(original, name))
+    assert graph.specificities == original.specificities
+    assert [str(k) for k in graph.constraints] == [str(k) for k in original.constraints]
+    assert graph.literal_keys == original.literal_keys
+    assert graph.prop_names() == original.prop_names()
+    for name, entries in original.prop_index().items():
+        assert [(n, p.value) for n, p in graph.prop_index()[name]] == [
+            (n, p.value) for n, p in entries
+        ]
+
+    for lazy in (False, True):
+        loaded = Context(graph, lazy=lazy)
+        for key, matcher in original.children.items():
+            for value in list(matcher.positive_values) + [None]:
+                a = ctx.with_poisoning().augment(key, value)
+                b = loaded.with_poisoning().augment(key, value)
+                assert dump(a) == dump(b)
+                for name in a.props:
+                    assert a.get_single_property(name).origin.line_number == (
+                        b.get_single_property(name).origin.line_number
+                    )
+
+
+@pytest.mark.parametrize("ccs", CONFIGS)
+def test_round_trip(ccs):
+    ctx = Context.from_ccs_stream(StringIO(ccs), "-")
+    data = compile_ccs_stream(StringIO(ccs), "-")
+    graph = artifact.loads(data)
+    assert artifact.dumps(graph, graph.source_fingerprint) == data
+    check_graph(graph, ctx)
+
+
+@pytest.mark.parametrize("ccs", CONFIGS)
+def test_mapped(ccs, tmp_path):
+    ctx = Context.from_ccs_stream(StringIO(ccs), "-")
+    data = compile_ccs_stream(StringIO(ccs), "-")
+    path = tmp_path / "config.ccsc"
+    path.write_bytes(data)
+    graph = artifact.load(path, mapped=True)
+    assert isinstance(graph, artifact.MappedDag)
+    assert isinstance(graph.child_ids, memoryview)
+    assert artifact.dumps(graph, graph.source_fingerprint) == data
+    check_graph(graph, ctx)
+
+    assert list(graph.children) == sorted(ctx.graph.children)
+    assert "no such key" not in graph.children and None not in graph.children
+    assert pickle.loads(pickle.dumps(graph)).child_ids == graph.child_ids
+
+
+def test_from_compiled(tmp_path, monkeypatch):
+    monkeypatch.setenv("CCS_ARTIFACT_TEST", "interpolated")
+    path = tmp_path / "main.ccsc"
+    path.write_bytes(compile_files(FILES))
+
+    for mapped in (False, True):
+        ctx = Context.from_compiled(path, mapped=mapped).augment("env", "prod")
+        assert ctx.get_single_value("x") == "2"
+        prop = ctx.get_single_property("y")
+        assert (prop.value, prop.override_level, repr(prop.origin)) == (
+            "interpolated",
+            1,
+            "helpers.ccs:1",
+        )
+
+
+def test_fingerprint_tracks_sources(monkeypatch):
+    monkeypatch.setenv("CCS_ARTIFACT_TEST", "one")
+    first = artifact.loads(compile_files(FILES)).source_fingerprint
+    assert artifact.loads(compile_files(FILES)).source_fingerprint == first
+    monkeypatch.setenv("CCS_ARTIFACT_TEST", "two")
+    assert artifact.loads(compile_files(FILES)).source_fingerprint != first
+    changed = dict(FILES, **{"helpers.ccs": "y = 3"})
+    assert artifact.loads(compile_files(changed)).source_fingerprint != first
+
+
+def test_output_does_not_depend_on_hash_seed():
+    script = (
+        "import sys; sys.path[:0] = sys.argv[1:]\n"
+        "from io import StringIO\n"
+        "from test_dag import CONFIGS\n"
+        "from ccs.search_state import compile_ccs_stream\n"
+        "data = b''.join(compile_ccs_stream(StringIO(c), '-') for c in CONFIGS)\n"
+        "import hashlib; print(hashlib.sha256(data).hexdigest())\n"
+    )
+    paths = [os.path.dirname(__file__), os.path.dirname(artifact.__file__) + "/.."]
+    digests = {
+        subprocess.run(
+            [sys.executable, "-c", script, *paths],
+            env=dict(os.environ, PYTHONHASHSEED=str(seed)),
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        for seed in (1, 2, 3)
+    }
+    assert len(digests) == 1
+
+
+def test_bad_artifacts():
+    data = compile_ccs_stream(StringIO("x = 1"), "-")
+    with pytest.raises(ArtifactError, match="Not a compiled"):
+        artifact.loads(b"nonsense" * 10)
+    with pytest.raises(ArtifactError, match="version"):
+        artifact.loads(data[:4] + b"\xff\x00" + data[6:])
+    with pytest.raises(ArtifactError, match="truncated"):
+        artifact.loads(data[: len(data) // 2])
+
+
+def test_bad_mapped_artifacts(tmp_path):
+    path = tmp_path / "empty.ccsc"
+    path.write_bytes(b"")
+    with pytest.raises(ArtifactError, match="too short"):
+        artifact.load(path, mapped=True)
+    path.write_bytes(compile_ccs_stream(StringIO("x = 1"), "-")[:-8])
+    with pytest.raises(ArtifactError, match="truncated"):
+        artifact.load(path, mapped=True)
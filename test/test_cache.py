@@ -0,0 +1,78 @@
+from io import StringIO
+
+from ccs.cache import DagCache
+from ccs.search_state import Context
+
+from resolvers import DictResolver
+
+
+def load(cache, files, filename="main.ccs"):
+    return Context.from_ccs_stream(
+        StringIO(files[filename]), filename, DictResolver(files), cache=cache
+    )
+
+
+def test_hit_after_miss(tmp_path):
+    files = {
+        "main.ccs": '@import "helpers.ccs"\nbaz.bar: frob = "nitz"',
+        "helpers.ccs": 'foo.bar: x = "imported"',
+    }
+    cache = DagCache(tmp_path)
+    load(cache, files)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    ctx = load(cache, files)
+    assert (cache.hits, cache.misses) == (1, 1)
+    prop = ctx.augment("foo", "bar").get_single_property("x")
+    assert prop.value == "imported"
+    assert repr(prop.origin) == "helpers.ccs:1"
+    assert ctx.augment("baz", "bar").get_single_value("frob") == "nitz"
+
+
+def test_imported_file_change_invalidates(tmp_path):
+    files = {
+        "main.ccs": '@import "helpers.ccs"',
+        "helpers.ccs": 'x = "old"',
+    }
+    cache = DagCache(tmp_path)
+    load(cache, files)
+    files["helpers.ccs"] = 'x = "new"'
+    assert load(cache, files).get_single_value("x") == "new"
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert load(cache, files).get_single_value("x") == "new"
+    assert cache.hits == 1
+
+
+def test_interpolated_variables_are_part_of_key(tmp_path, monkeypatch):
+    files = {"main.ccs": 'x = "${CCS_CACHE_TEST}"'}
+    cache = DagCache(tmp_path)
+    monkeypatch.setenv("CCS_CACHE_TEST", "one")
+    assert load(cache, files).get_single_value("x") == "one"
+    monkeypatch.setenv("CCS_CACHE_TEST", "two")
+    assert load(cache, files).get_single_value("x") == "two"
+    assert cache.hits == 0
+
+
+def test_corrupt_entry_is_rebuilt(tmp_path):
+    files = {"main.ccs": "x = 1"}
+    cache = DagCache(tmp_path)
+    load(cache, files)
+    for path in tmp_path.glob("*" + DagCache.ENTRY_SUFFIX):
+        path.write_bytes(b"garbage")
+    assert load(cache, files).get_single_value("x") == "1"
+    assert cache.misses == 2
+
+
+def test_eviction(tmp_path):
+    cache = DagCache(tmp_path, max_bytes=4096)
+    for i in range(20):
+        load(cache, {"main.ccs": f"x = {i}\n" + "y = 'padding'\n" * 20})
+    assert cache.evictions > 0
+    assert sum(p.stat().st_size for p in tmp_path.iterdir()) <= 4096
+    assert not list(tmp_path.glob(".tmp-*"))
+
+
+def test_entries_are_readable_by_others(tmp_path, monkeypatch):
+    monkeypatch.setattr("ccs.cache._UMASK", 0o022)
+    load(DagCache(tmp_path), {"main.ccs": "a = 1"})
+    assert {p.stat().st_mode & 0o777 for p in tmp_path.iterdir()} == {0o644}
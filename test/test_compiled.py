@@ -0,0 +1,166 @@
+import io
+
+import pytest
+
+from ccs.compiled import CompiledDag, NodeArray, activate, compile_dag, topological_order
+from ccs.dag import AndNode, Dag, Key, OrNode, add_literal, build_dag
+from ccs.parser import Parser
+from ccs.property import Property
+from ccs.rule_tree import RuleTreeNode
+from ccs.search_state import Context
+
+from test_dag import CONFIGS
+
+
+def build(ccs):
+    root = RuleTreeNode()
+    Parser().parse(io.StringIO(ccs), "-").add_to(root)
+    return build_dag(root)
+
+
+@pytest.mark.parametrize("ccs", CONFIGS)
+def test_compiled_dag_mirrors_dag(ccs):
+    dag = build(ccs)
+    compiled = compile_dag(dag)
+    order = topological_order(dag)
+    ids = {node: i for i, node in enumerate(order)}
+
+    assert len(compiled) == len(order)
+    assert order[CompiledDag.ROOT] is dag.prop_node
+    for node, n in ids.items():
+        assert compiled.is_and[n] == isinstance(node, AndNode)
+        if isinstance(node, AndNode):
+            assert compiled.specificity(n) == node.specificity
+        assert compiled.tally_counts[n] == node.tally_count
+        assert list(compiled.node_children(n)) == [ids[c] for c in node.children]
+        assert all(c > n for c in compiled.node_children(n))
+        assert compiled.node_props(n) == node.props
+        assert compiled.node_constraints(n) == node.constraints
+        assert list(compiled.node_parents(n)) == sorted(
+            ids[p] for p in order for c in p.children if c is node
+        )
+        for name, prop in node.props:
+            assert (n, prop) in compiled.prop_index()[name]
+
+    assert compiled.children.keys() == dag.children.keys()
+    for name, matcher in dag.children.items():
+        cm = compiled.children[name]
+        assert cm.wildcard == (ids[matcher.wildcard] if matcher.wildcard else None)
+        assert cm.positive_values.keys() == matcher.positive_values.keys()
+        for value, nodes in matcher.positive_values.items():
+            literal_nodes = compiled.literal_nodes(cm.positive_values[value])
+            assert list(literal_nodes) == [ids[node] for node in nodes]
+            for n in literal_nodes:
+                assert compiled.literal_keys[n].name == name
+                assert value in compiled.literal_keys[n].values
+
+    assert repr(compiled.stats()) == repr(dag.stats())
+
+
+def test_compile_is_deterministic():
+    dag = build(CONFIGS[0])
+    a, b = compile_dag(dag), compile_dag(dag)
+    assert a.child_ids == b.child_ids and a.literal_ids == b.literal_ids
+
+
+def test_node_array_forks_share_unwritten_chunks():
+    from ccs.compiled import NodeArray
+
+    base = NodeArray.of(list(range(1000)))
+    ev = base.evolver()
+    ev[3] = 42
+    ev[999] = 7
+    fork = ev.persistent()
+    assert (base[3], base[999]) == (3, 999)
+    assert (fork[3], fork[999], fork[500]) == (42, 7, 500)
+    assert fork.chunks[1] is base.chunks[1]
+    assert base.evolver().persistent() is base
+
+    zeros = NodeArray.zeros(600)
+    ev = zeros.evolver()
+    ev[0] = 1
+    assert ev.persistent()[0] == 1 and zeros[0] == 0 and zeros[599] == 0
+
+
+def recursive_activation(graph, tallies, or_specs, n, fired, spec=None):
+    """The straightforward recursive walk which activate() must agree with."""
+    if graph.is_and[n]:
+        if tallies[n] == 0:
+            return
+        tallies[n] -= 1
+        if tallies[n]:
+            return
+        spec = graph.spec_ids[n]
+    elif spec is None:
+        spec = or_specs[n]
+    elif graph.specificities[spec] > graph.specificities[or_specs[n]]:
+        or_specs[n] = spec
+    else:
+        return
+    if graph.node_props(n) or graph.node_constraints(n):
+        fired.append((n, spec))
+    for child in graph.node_children(n):
+        recursive_activation(graph, tallies, or_specs, child, fired, spec)
+
+
+@pytest.mark.parametrize("ccs", CONFIGS)
+def test_activation_order_matches_recursive_walk(ccs):
+    graph = compile_dag(build(ccs))
+    starts = [CompiledDag.ROOT] + [
+        n
+        for matcher in graph.children.values()
+        for n in [matcher.wildcard] + [
+            i for ids in matcher.positive_values.values() for i in graph.literal_nodes(ids)
+        ]
+        if n is not None
+    ]
+    tallies = NodeArray.of(graph.tally_counts).evolver()
+    or_specs = NodeArray.zeros(len(graph)).evolver()
+    fired = []
+    activate(graph, tallies, or_specs, starts, fired)
+
+    ref_tallies, ref_or_specs, ref_fired = list(graph.tally_counts), [0] * len(graph), []
+    for n in starts:
+        recursive_activation(graph, ref_tallies, ref_or_specs, n, ref_fired)
+    assert fired == ref_fired
+    assert [tallies[n] for n in range(len(graph))] == ref_tallies
+    assert [or_specs[n] for n in range(len(graph))] == ref_or_specs
+
+
+def test_deep_dag_activates_without_recursion():
+    dag = Dag()
+    node = add_literal(dag, Key("a", {"x"}))
+    depth = 5000
+    for i in range(depth):
+        child = OrNode()
+        child.add_link()
+        child.props.append((f"p{i}", Property(str(i), "-", 0, i)))
+        node.children.append(child)
+        node = child
+    ctx = Context(dag).with_poisoning().augment("a", "x")
+    assert ctx.get_single_value(f"p{depth - 1}") == str(depth - 1)
+    poisoned = Context(dag).with_poisoning().augment("a", "y")
+    assert all(poisoned.poisoned[n] for n in range(1, len(poisoned.graph)))
+
+
+def test_poisoning_is_walked_on_demand():
+    hosts = "".join(f"host.h{i} {{ x = {i}; env.prod : y = {i} }}\n" for i in range(50))
+    ctx = Context(build(hosts)).with_poisoning()
+    graph = ctx.graph
+
+    def literals(value):
+        return set(graph.literal_nodes(graph.children["host"].positive_values[value]))
+
+    h1 = ctx.augment("host", "h1")
+    both = h1.augment("env", "prod")
+    assert h1.poisoned.binding is not None and h1.poisoned._state is None
+
+    flags = both.poisoned.flags()
+    poisoned = {n for n in range(len(graph)) if flags[n]}
+    assert literals("h2") <= poisoned and not literals("h1") & poisoned
+    # the host.h2 env.prod clause can no longer activate either
+    assert len(poisoned) == 2 * 49
+    # h1's step was materialized on the way, and agrees with a fresh walk
+    assert h1.poisoned._state is not None
+    fresh = ctx.augment("host", "h1").augment("env", "prod").poisoned
+    assert [fresh[n] for n in range(len(graph))] == [flags[n] for n in range(len(graph))]
@@ -0,0 +1,145 @@
+import io
+
+import pytest
+
+from ccs.dag import AndNode, build_dag
+from ccs.parser import Parser
+from ccs.rule_tree import RuleTreeNode
+
+
+def rule_tree(ccs):
+    root = RuleTreeNode()
+    Parser().parse(io.StringIO(ccs), "-").add_to(root)
+    return root
+
+
+def structure(dag):
+    """Describe a Dag independently of node identity and list order.
+
+    Each node is named by the expression it represents (literal set, clause or
+    formula), which is unique within a Dag, and described along with its
+    specificity, tally, children, properties and constraints."""
+    literals = {}
+    for name, matcher in dag.children.items():
+        if matcher.wildcard:
+            literals.setdefault(matcher.wildcard, set()).add(name)
+        for value, nodes in matcher.positive_values.items():
+            for node in nodes:
+                literals.setdefault(node, set()).add(f"{name}.{value}")
+
+    parents = {}
+    nodes = []
+
+    def visit(node):
+        if node not in parents:
+            parents[node] = []
+            nodes.append(node)
+            for child in node.children:
+                visit(child)
+                parents[child].append(node)
+
+    visit(dag.prop_node)
+    for node in literals:
+        visit(node)
+
+    names = {dag.prop_node: "<root>"}
+
+    def name(node):
+        if node not in names:
+            if node in literals:
+                names[node] = "(" + ", ".join(sorted(literals[node])) + ")"
+            else:
+                sep = " " if isinstance(node, AndNode) else ", "
+                parts = set()
+                for p in parents[node]:
+                    # parents of the same kind contribute their parts
+                    same = type(p) is type(node) and p not in literals
+                    parts.update(name(p).split(sep) if same else [name(p)])
+                names[node] = sep.join(sorted(parts))
+        return names[node]
+
+    return sorted(
+        (
+            name(n),
+            type(n).__name__,
+            getattr(n, "specificity", None),
+            n.tally_count,
+            sorted(map(name, n.children)),
+            [(k, p.value, p.property_number) for k, p in n.props],
+            [str(c) for c in n.constraints],
+        )
+        for n in nodes
+    )
+
+
+CONFIGS = [
+    """
+    (a, b) (c, d) (e, f) { x = 1 }
+    a c e { y = 2 }
+    (a c, b d) (e, f g) { z = 3 }
+    a b c d e f g { w = 4 }
+    (a b, c d, e f) { v = 5 }
+    (a.x, a.y, b) c : q = 1
+    a c e : y = 3
+    @constrain a.x
+    """,
+    """
+    x = 1
+    env.prod { region.us { x = 2 } region.eu, region.ap { x = 3 } }
+    env.prod region.us host { @constrain tier.web; x = 4 }
+    (env.dev, env.qa) (region.us, region.eu) : x = 5
+    """,
+]
+
+
+@pytest.mark.parametrize("ccs", CONFIGS)
+def test_bitsets_build_same_dag(ccs):
+    root = rule_tree(ccs)
+    bits, sets = build_dag(root), build_dag(root, bitsets=False)
+    assert structure(bits) == structure(sets)
+    assert repr(bits.stats()) == repr(sets.stats())
+
+
+def test_subset_index_finds_exactly_the_subsets():
+    from itertools import combinations
+
+    from ccs.dag import SubsetIndex
+    from ccs.formula import Clause
+
+    lits = "abcde"
+    index = SubsetIndex()
+    clauses = [Clause(c) for n in (1, 2, 3) for c in combinations(lits, n)]
+    for i, clause in enumerate(clauses):
+        index[clause] = i
+    for n in (1, 2, 3, 4):
+        for c in combinations(lits, n):
+            expr = Clause(c)
+            expected = {k for k in clauses if k.issubset(expr)}
+            assert set(index.subsets_of(expr)) == expected
+    assert index.subsets_of(Clause("xy")) == []
+
+    del index[Clause("ab")]
+    assert set(index.subsets_of(Clause("abc"))) == {
+        Clause(c) for c in ("a", "b", "c", "ac", "bc", "abc")
+    }
+    index[Clause("ab")] = 0
+    assert Clause("ab") in index.subsets_of(Clause("abc"))
+
+
+def test_rank_heap_pops_in_rank_order_after_decreases():
+    import random
+
+    from ccs.dag import Rank, RankHeap
+    from ccs.formula import Clause
+
+    rng = random.Random(0)
+    ranks = [Rank(Clause(rng.sample("abcdefgh", rng.randint(1, 5)))) for _ in range(60)]
+    ranks = list({r.elem: r for r in ranks}.values())
+    heap = RankHeap(ranks)
+    while len(heap):
+        for rank in rng.sample(ranks, 5):
+            if rank.weight > 0:
+                rank.weight -= 1
+                heap.decrease(rank)
+        queued = [r for r in ranks if r.pos is not None]
+        assert heap.pop() is min(queued)
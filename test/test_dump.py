@@ -0,0 +1,29 @@
+from io import StringIO
+
+import pytest
+
+from ccs.dump import dump_dag
+from ccs.search_state import Context
+
+from test_dag import CONFIGS
+
+
+def dump(ctx, prop_names=None):
+    out = StringIO()
+    dump_dag(ctx, prop_names, out=out)
+    return out.getvalue().splitlines()
+
+
+@pytest.mark.parametrize("ccs", CONFIGS)
+@pytest.mark.parametrize("poisoning", [False, True])
+def test_filtered_dump_matches_full_dump(ccs, poisoning):
+    root = Context.from_ccs_stream(StringIO(ccs), "-")
+    if poisoning:
+        root = root.with_poisoning()
+    names = root.graph.prop_names()
+    for key, value in [(None, None)] + [
+        (key, value) for key, m in root.graph.children.items() for value in m.positive_values
+    ]:
+        ctx = root if key is None else root.augment(key, value)
+        # the full dump is sorted by property name first
+        assert [line for name in names for line in dump(ctx, name)] == dump(ctx)
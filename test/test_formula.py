@@ -1,4 +1,7 @@
-from ccs.formula import Clause, Formula, normalize
+import pytest
+
+from ccs.dag import Key, Specificity
+from ccs.formula import BitClause, Clause, Formula, Interner, encode, normalize
 
 
 def test_normalize():
@@ -14,3 +17,63 @@ def test_normalize():
     )
     assert str(form) == "a, b, a b, c d, a c d"
     assert str(normalize(form)) == "a, b, c d"
+
+
+def test_bitset_encoding_matches_sets():
+    clauses = [
+        Clause(lits)
+        for lits in (["a", "b"], ["b"], ["a"], ["c", "d"], ["a", "c", "d"], [], ["d"])
+    ]
+    forms = [Formula(clauses[i:j]) for i, j in ((0, 3), (3, 5), (1, 2), (4, 7), (0, 7))]
+    encoded = encode(forms)
+    bits = {c: b for f, e in zip(forms, encoded) for c, b in zip(sorted(f.clauses), sorted(e.clauses))}
+
+    for f, e in zip(forms, encoded):
+        assert str(e) == str(f)
+        assert len(e) == len(f)
+    for c, b in bits.items():
+        assert str(b) == str(c)
+        assert len(b) == len(c)
+        assert b.elements() == c.elements()
+        assert b.is_empty() == c.is_empty()
+        for d, e in bits.items():
+            assert b.issubset(e) == c.issubset(d)
+            assert b.is_strict_subset(e) == c.is_strict_subset(d)
+            assert (b < e) == (c < d)
+            assert (b == e) == (c == d)
+            assert b.union(e).elements() == c.union(d).elements()
+    for f, e in zip(forms, encoded):
+        for g, h in zip(forms, encoded):
+            assert (e < h) == (f < g)
+            assert e.issubset(h) == f.issubset(g)
+
+
+def test_bitset_specificity():
+    clause = Clause([Key("a", {"x"}), Key("b")])
+    (form,) = encode([Formula([clause])])
+    assert form.first().specificity() == clause.specificity() == Specificity(0, 1, 0, 1)
+
+
+def test_bitset_hashes_spread_over_wide_masks():
+    table = Interner(Key(f"k{i}", {"v"}) for i in range(200))
+    clauses = [BitClause(1 << i, table) for i in range(200)]
+    assert len({hash(c) for c in clauses}) == 200
+
+
+def test_bitset_equality():
+    table = Interner(Key(f"k{i}", {"v"}) for i in range(3))
+    other = Interner(Key(f"k{i}", {"v"}) for i in range(3))
+    assert BitClause(0b101, table) == BitClause(0b101, table)
+    assert BitClause(0b101, table) != BitClause(0b101, other)
+    assert BitClause(0b101, table) != 0b101
+    assert BitClause(0b101, table) != None  # noqa: E711
+
+
+def test_bitset_empty():
+    forms = [Formula([Clause([])]), Formula([Clause([Key("a")])]), Formula([])]
+    encoded = encode(forms)
+    assert [e.is_empty() for e in encoded] == [True, False, False]
+    with pytest.raises(ValueError):
+        encoded[2].first()
+    with pytest.raises(ValueError):
+        BitClause(0, encoded[1].first().table).first()
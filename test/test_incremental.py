@@ -0,0 +1,129 @@
+import io
+import random
+
+import pytest
+
+from ccs.compiled import compile_dag
+from ccs.dag import build_dag
+from ccs.dump import dump_dag
+from ccs.error import CcsError
+from ccs.incremental import IncrementalBuild, _difference, _settings
+from ccs.parser import Parser
+from ccs.rule_tree import RuleTreeNode
+from ccs.search_state import Context, StrictMaxAccumulator
+
+from resolvers import DictResolver
+
+
+ROOT = '@import "a.ccs"\n@import "b.ccs"\nx = 0\nenv.prod { @import "c.ccs" }\n'
+
+
+def full_dag(files):
+    rules = Parser().parse_ccs_stream(io.StringIO(ROOT), "root", DictResolver(files), [])
+    root = RuleTreeNode()
+    rules.add_to(root)
+    return build_dag(root)
+
+
+def dump(dag):
+    out = io.StringIO()
+    dump_dag(dag.root_context(StrictMaxAccumulator), out=out)
+    return out.getvalue()
+
+
+def random_file(rng, rules):
+    def step():
+        return f"k{rng.randrange(4)}.v{rng.randrange(4)}"
+
+    lines = []
+    for _ in range(rules):
+        selector = " ".join(step() for _ in range(rng.randrange(1, 4)))
+        if rng.random() < 0.2:
+            selector += f" ({step()}, {step()})"
+        if rng.random() < 0.1:
+            lines.append(f"@constrain {step()}")
+        lines.append(f"{selector} : p{rng.randrange(5)} = {rng.randrange(100)}")
+    return "\n".join(lines) + "\n"
+
+
+def test_random_edits_match_full_builds():
+    rng = random.Random(0)
+    files = {name: random_file(rng, 20) for name in ("a.ccs", "b.ccs", "c.ccs")}
+    build = IncrementalBuild(verify=True)
+    dag = build.update(io.StringIO(ROOT), "root", DictResolver(files))
+    assert build.stats.full
+    for _ in range(30):
+        name = rng.choice(sorted(files))
+        files[name] = random_file(rng, rng.randrange(0, 30))
+        old, old_dump = dag, dump(dag)
+        dag = build.update(io.StringIO(ROOT), "root", DictResolver(files))
+        assert not build.stats.full
+        assert build.stats.files_parsed == 1 and build.stats.files_reused == 3
+        assert dump(dag) == dump(full_dag(files))
+        # earlier Dags are left as they were
+        assert dump(old) == old_dump
+
+
+def test_earlier_dags_keep_their_nodes():
+    files = {"a.ccs": "k.a : p = 1\n", "b.ccs": "k.a l.b : p = 2\n", "c.ccs": "k.c : q = 3\n"}
+    build = IncrementalBuild()
+    old = build.update(io.StringIO(ROOT), "root", DictResolver(files))
+    stats, settings = repr(old.stats()), _settings(old.compiled())
+
+    files["a.ccs"] = "k.a : p = 4\nk.a m.c n.d : p = 5\n"
+    files["b.ccs"] = ""
+    build.update(io.StringIO(ROOT), "root", DictResolver(files))
+    assert build.stats.nodes_retired > 0 and build.stats.formulas_added > 0
+    # the old node graph, not just its compiled form, is as it was
+    assert repr(old.stats()) == stats
+    assert _settings(compile_dag(old)) == settings
+
+
+def test_only_new_selectors_are_expanded():
+    files = {"a.ccs": "k.a : p = 1\n", "b.ccs": "k.b : p = 2\n", "c.ccs": "k.c l.c : p = 3\n"}
+    build = IncrementalBuild()
+    build.update(io.StringIO(ROOT), "root", DictResolver(files))
+    assert build.stats.expansions == 4
+
+    files["b.ccs"] = "k.b : p = 2\nk.d : q = 4\n"
+    build.update(io.StringIO(ROOT), "root", DictResolver(files))
+    # b.ccs is parsed again, so both its selectors are new objects, but only
+    # k.d makes a formula there wasn't already a node for
+    assert build.stats.expansions == 2 and build.stats.expansions_reused == 3
+    assert build.stats.formulas_added == 1
+
+
+def test_retired_literals_leave_the_matchers():
+    files = {"a.ccs": "k.a : p = 1\n", "b.ccs": "gone.x gone.y : p = 2\n", "c.ccs": ""}
+    build = IncrementalBuild()
+    dag = build.update(io.StringIO(ROOT), "root", DictResolver(files))
+    assert "gone" in dag.children
+
+    files["b.ccs"] = ""
+    dag = build.update(io.StringIO(ROOT), "root", DictResolver(files))
+    assert "gone" not in dag.children and "gone" not in dag.compiled().children
+    assert build.stats.nodes_retired == 3
+    ctx = Context(dag).augment("gone", "x").augment("gone", "y")
+    assert ctx.get_single_value("x") == "0" and "p" not in ctx.props
+
+
+def test_errors_leave_the_build_as_it_was():
+    files = {"a.ccs": "k.a : p = 1\n", "b.ccs": "", "c.ccs": ""}
+    build = IncrementalBuild()
+    build.update(io.StringIO(ROOT), "root", DictResolver(files))
+
+    files["a.ccs"] = "k.a : p = \n"
+    with pytest.raises(CcsError):
+        build.update(io.StringIO(ROOT), "root", DictResolver(files))
+    files["a.ccs"] = "k.a : p = 2\n"
+    dag = build.update(io.StringIO(ROOT), "root", DictResolver(files))
+    assert not build.stats.full and build.stats.files_parsed == 1
+    assert Context(dag).augment("k", "a").get_single_value("p") == "2"
+
+
+def test_difference_finds_changed_settings():
+    files = {"a.ccs": "k.a : p = 1\n", "b.ccs": "", "c.ccs": ""}
+    dag = full_dag(files)
+    assert _difference(dag.compiled(), full_dag(files).compiled()) is None
+    files["b.ccs"] = "k.a : @constrain l.b\n"
+    assert "k.a" in _difference(dag.compiled(), full_dag(files).compiled())
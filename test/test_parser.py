@@ -90,17 +90,56 @@ fail("a = 'h$there}i'")
 fail("a = 'h${t-here}i'")
 
 
-def parse(ccs):
+LEXERS = [parser.Lexer, parser.RegexLexer]
+
+
+def parse(ccs, lexer=parser.RegexLexer):
     try:
-        parser.Parser().parse(io.StringIO(ccs), "-")
+        parser.Parser(lexer).parse(io.StringIO(ccs), "-")
         return True
     except parser.ParseError:
         return False
 
 
+@pytest.mark.parametrize("lexer", LEXERS)
 @pytest.mark.parametrize("ccs, expected", cases)
-def test_parse(ccs, expected):
-    assert parse(ccs) == expected
+def test_parse(ccs, expected, lexer):
+    assert parse(ccs, lexer) == expected
+
+
+def tokens(lexer, ccs):
+    """Lex ccs to the end, describing each token (or the error) as a tuple."""
+    result = []
+    try:
+        lex = lexer(io.StringIO(ccs))
+        while True:
+            tok = lex.consume()
+            string = tok.string_value and [
+                (e.is_interpolant, e.interpolate()) for e in tok.string_value.elements
+            ]
+            result.append(
+                (tok.type, tok.value, tok.location.line, tok.location.column, string)
+            )
+            if tok.type is parser.Token.EOS:
+                return result
+    except parser.ParseError as e:
+        result.append(str(e))
+        return result
+
+
+@pytest.mark.parametrize(
+    "ccs",
+    [ccs for ccs, _ in cases]
+    + [
+        "a.b {\n  x = 'multi\\\nline'\n  y = 0x1F\n}\n// trailing",
+        "/* one\n two */ a = \"${HOME}/x\"\n\n  b = -1.5e3",
+        "a = 'bad \\q'",
+        "\n\n  a = 'open",
+        "x = 1\n  %",
+    ],
+)
+def test_lexers_agree(ccs):
+    assert tokens(parser.RegexLexer, ccs) == tokens(parser.Lexer, ccs)
 
 
 def test_parse_selector_and_print():
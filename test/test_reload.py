@@ -0,0 +1,116 @@
+import os
+import time
+
+import pytest
+
+from ccs.error import CcsError
+from ccs.reload import ConfigHandle, _InotifyWatcher
+from ccs.search_state import StrictMaxAccumulator
+
+
+def write(path, text):
+    path.write_text(text)
+    # make sure the change is visible even where mtimes are coarse
+    st = path.stat()
+    ns = st.st_mtime_ns + 1_000_000_000
+    os.utime(path, ns=(ns, ns))
+
+
+def setup(tmp_path):
+    write(tmp_path / "main.ccs", '@import "helpers.ccs"\nx = 1\nenv.prod : y = 2\n')
+    write(tmp_path / "helpers.ccs", "env.prod : z = 'a'\n")
+    return tmp_path / "main.ccs"
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_reload_swaps_dag_and_old_contexts_keep_theirs(tmp_path):
+    handle = ConfigHandle(setup(tmp_path), watch=False)
+    old = handle.context.augment("env", "prod")
+    assert (old.get_single_value("y"), old.get_single_value("z")) == ("2", "a")
+    assert not handle.changed()
+
+    write(tmp_path / "helpers.ccs", "env.prod : z = 'b'\n")
+    assert handle.changed()
+    assert handle.reload()
+    assert (handle.generation, handle.reloads, handle.failures) == (1, 1, 0)
+    assert handle.last_reload_seconds > 0
+    assert handle.reload_seconds_total >= handle.last_reload_seconds
+
+    # the context from before is untouched; rebasing it replays its steps
+    assert old.get_single_value("z") == "a"
+    new = handle.rebase(old)
+    assert new.dag is handle.dag
+    assert list(new.debug_location) == list(old.debug_location)
+    assert new.get_single_value("z") == "b"
+    assert handle.rebase(new) is new
+
+
+def test_failed_reload_keeps_current_config(tmp_path):
+    handle = ConfigHandle(setup(tmp_path), watch=False)
+    dag = handle.dag
+    write(tmp_path / "helpers.ccs", "env.prod : z = \n")
+    assert not handle.reload()
+    assert handle.dag is dag
+    assert (handle.generation, handle.reloads, handle.failures) == (0, 0, 1)
+    assert isinstance(handle.last_error, CcsError)
+    # nothing has changed since the failed attempt
+    assert not handle.changed()
+
+    write(tmp_path / "helpers.ccs", "env.prod : z = 'c'\n")
+    assert handle.reload() and handle.last_error is None
+    assert handle.context.augment("env", "prod").get_single_value("z") == "c"
+
+
+def test_initial_load_errors_are_raised(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        ConfigHandle(tmp_path / "missing.ccs", watch=False)
+
+
+def test_rebase_keeps_context_settings(tmp_path):
+    handle = ConfigHandle(setup(tmp_path), watch=False)
+    ctx = handle.dag.root_context(StrictMaxAccumulator, lazy=True).with_poisoning()
+    ctx = ctx.augment("env", "prod")
+    handle.reload()
+    new = handle.rebase(ctx)
+    assert new.prop_accumulator is StrictMaxAccumulator and new.lazy
+    assert new.poisoned is not None
+
+
+@pytest.mark.parametrize("use_inotify", [False, True])
+def test_watcher_reloads_on_change(tmp_path, use_inotify):
+    if use_inotify and _InotifyWatcher.create() is None:
+        pytest.skip("inotify is not available")
+    main = setup(tmp_path)
+    poll = 5.0 if use_inotify else 0.02
+    with ConfigHandle(main, poll_interval=poll, use_inotify=use_inotify) as handle:
+        write(tmp_path / "helpers.ccs", "env.prod : z = 'b'\n")
+        wait_for(lambda: handle.context.augment("env", "prod").get_single_value("z") == "b")
+
+        # a newly imported file is watched too
+        write(tmp_path / "more.ccs", "w = 1\n")
+        write(main, '@import "helpers.ccs"\n@import "more.ccs"\nx = 1\n')
+        wait_for(lambda: "w" in handle.context.props)
+        write(tmp_path / "more.ccs", "w = 2\n")
+        wait_for(lambda: handle.context.get_single_value("w") == "2")
+
+        # replacing a file by renaming over it counts as a change
+        write(tmp_path / "new.ccs", '@import "helpers.ccs"\nx = 5\n')
+        (tmp_path / "new.ccs").replace(main)
+        wait_for(lambda: handle.context.get_single_value("x") == "5")
+        assert handle.failures == 0 and handle.generation >= 4
+    assert not handle._thread.is_alive()
+
+
+def test_incremental_reload(tmp_path):
+    handle = ConfigHandle(setup(tmp_path), watch=False, incremental=True, verify=True)
+    write(tmp_path / "helpers.ccs", "env.prod : z = 'b'\nenv.dev : z = 'c'\n")
+    assert handle.reload() and handle.last_error is None
+    assert handle.context.augment("env", "prod").get_single_value("z") == "b"
+    assert handle.context.augment("env", "dev").get_single_value("z") == "c"
+    assert handle._incremental.stats.files_parsed == 1
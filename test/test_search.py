@@ -1,9 +1,14 @@
 import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import StringIO
 import pytest
 
-from ccs.error import AmbiguousPropertyError, MissingPropertyError
-from ccs.search_state import Context, StrictMaxAccumulator
+from ccs.ast import FileImportResolver
+from ccs.error import AmbiguousPropertyError, CcsError, MissingPropertyError
+from ccs.parser import Parser
+from ccs.search_state import Context, MaxAccumulator, StrictMaxAccumulator
+
+from resolvers import DictResolver
 
 
 def expect_exception(work, expected):
@@ -241,3 +246,355 @@ def test_trace_properties():
     in_ab = in_a.augment("b")
     assert in_ab.get_single_value("c", cast=int) == 42
     assert re.match(r".*c = 42.*\n.*\[a > b\]", logged[-1], re.MULTILINE)
+
+
+IMPORT_TREE = {
+    "main.ccs": '@import "a.ccs"\nx = "main"\n@import "b.ccs"\nsvc.c { @import "c.ccs" }',
+    "a.ccs": 'x = "a"\n@import "common.ccs"\ny = "a"',
+    "b.ccs": '@import "common.ccs"\ny = "b"',
+    "c.ccs": 'z = "c"\n@import "common.ccs"',
+    "common.ccs": 'x = "common"\nz = "common"',
+}
+
+
+def load_tree(files, parser=None):
+    return Context.from_ccs_stream(
+        StringIO(files["main.ccs"]), "main.ccs", DictResolver(files), parser=parser
+    )
+
+
+def test_parallel_import_matches_sequential():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        parallel = load_tree(IMPORT_TREE, Parser(executor=pool))
+    sequential = load_tree(IMPORT_TREE)
+
+    for ctx, expected in [(parallel, sequential), (parallel.augment("svc", "c"), sequential.augment("svc", "c"))]:
+        for prop in ("x", "y", "z"):
+            p, s = ctx.get_single_property(prop), expected.get_single_property(prop)
+            assert (p.value, p.property_number, repr(p.origin)) == (
+                s.value, s.property_number, repr(s.origin)
+            )
+    assert sequential.get_single_value("x") == "common"
+    assert sequential.get_single_value("y") == "b"
+    assert sequential.augment("svc", "c").get_single_value("z") == "common"
+
+
+@pytest.mark.parametrize(
+    "files",
+    [
+        {"main.ccs": '@import "a.ccs"', "a.ccs": '@import "b.ccs"', "b.ccs": '@import "a.ccs"'},
+        {"main.ccs": '@import "a.ccs"\n@import "b.ccs"', "a.ccs": "x = 1", "b.ccs": "x = = 2"},
+        {"main.ccs": '@import "a.ccs"\n@import "b.ccs"', "a.ccs": '@import "b.ccs"', "b.ccs": '@import "a.ccs"'},
+    ],
+    ids=["circular", "parse-error", "circular-diamond"],
+)
+def test_parallel_import_failures_match_sequential(files, capsys):
+    def parse(parser):
+        return parser.parse_ccs_stream(StringIO(files["main.ccs"]), "main.ccs", DictResolver(files), [])
+
+    assert parse(Parser()) is None
+    sequential = capsys.readouterr().out
+    assert sequential.count("\n") == 1
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        assert parse(Parser(executor=pool)) is None
+    assert capsys.readouterr().out == sequential
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_diamond_imports_parsed_once(parallel):
+    parsed = []
+
+    class CountingResolver(DictResolver):
+        def resolve(self, location):
+            parsed.append(location)
+            return super().resolve(location)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        parser = Parser(executor=pool if parallel else None)
+        rule = parser.parse_ccs_stream(
+            StringIO(IMPORT_TREE["main.ccs"]), "main.ccs", CountingResolver(IMPORT_TREE), []
+        )
+        assert rule is not None
+        assert sorted(parsed) == ["a.ccs", "b.ccs", "c.ccs", "common.ccs"]
+        assert (parser.stats.files_parsed, parser.stats.imports, parser.stats.parses_saved) == (5, 6, 2)
+
+        # every import of common.ccs still contributes its own properties, in order
+        ctx = load_tree(IMPORT_TREE, parser)
+    assert ctx.get_single_value("x") == "common"
+    assert ctx.augment("svc", "c").get_single_value("z") == "common"
+
+
+def test_process_pool_imports(tmp_path):
+    # the resolver, lexer and parsed trees all have to cross the process boundary
+    for location, text in IMPORT_TREE.items():
+        (tmp_path / location).write_text(text)
+    with ProcessPoolExecutor(2) as pool:
+        parser = Parser(executor=pool)
+        with open(tmp_path / "main.ccs") as stream:
+            parallel = Context.from_ccs_stream(
+                stream, "main.ccs", FileImportResolver(tmp_path), parser=parser
+            )
+    assert parser.stats.files_parsed == 5
+    sequential = load_tree(IMPORT_TREE)
+
+    for ctx, expected in [(parallel, sequential), (parallel.augment("svc", "c"), sequential.augment("svc", "c"))]:
+        for prop in ("x", "y", "z"):
+            p, s = ctx.get_single_property(prop), expected.get_single_property(prop)
+            assert (p.value, p.property_number) == (s.value, s.property_number)
+
+
+def test_poisoning():
+    from ccs.dump import dump_dag
+
+    ccs = """
+        env.prod { x = 1 }
+        env.dev { x = 2 }
+        env.prod region.us, env.dev region.eu : y = 3
+        """
+    ctx = load_context(ccs).with_poisoning()
+    prod = ctx.augment("env", "prod")
+    dev = ctx.augment("env", "dev")
+    assert prod.get_single_value("x") == "1"
+    assert dev.get_single_value("x") == "2"
+
+    out = StringIO()
+    dump_dag(prod, out=out)
+    assert "env.dev" not in out.getvalue()
+    assert "region.us" in out.getvalue()
+    out = StringIO()
+    dump_dag(dev, out=out)
+    assert "env.prod" not in out.getvalue()
+    assert "region.eu" in out.getvalue()
+
+
+def context_state(ctx):
+    def array(a):
+        return [list(chunk) for chunk in a.chunks] if a is not None else None
+
+    return (
+        array(ctx.tallies),
+        array(ctx.or_specificities),
+        array(ctx.poisoned.flags() if ctx.poisoned is not None else None),
+        {name: repr(accum) for name, accum in ctx.props.items()},
+        [str(key) for key in ctx.debug_location],
+    )
+
+
+@pytest.mark.parametrize("poisoning", [False, True])
+def test_augment_many_matches_sequential_augments(poisoning):
+    ctx = load_context(
+        """
+        a.x { @constrain b.y; p = 1 }
+        b.y { @constrain c; q = 2 }
+        b.z, c { p = 3 }
+        a.x c : q = 4
+        b.y a.w : r = 5
+        """
+    )
+    if poisoning:
+        ctx = ctx.with_poisoning()
+    steps = [("a", "x"), ("b", "z"), ("c", None), ("a", "w")]
+    for n in range(len(steps) + 1):
+        sequential = ctx
+        for key, value in steps[:n]:
+            sequential = sequential.augment(key, value)
+        assert context_state(ctx.augment_many(steps[:n])) == context_state(sequential)
+        if n < len(steps):
+            assert context_state(ctx.augment_many(dict(steps[:n]))) == context_state(sequential)
+
+
+def test_augment_cache():
+    import pickle
+
+    from ccs.search_state import AugmentCache
+
+    traced = []
+    ctx = load_context(
+        "a.x { p = 1 } a.x b.y { p = 2 } b.y { p = 3 }",
+        trace_properties=lambda fmt, *args: traced.append(fmt % args),
+    )
+    cache = ctx.dag.augment_cache = AugmentCache(max_entries=2)
+
+    ax = ctx.augment("a", "x")
+    assert ctx.augment("a", "x") is ax
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # same step from a different parent is a different entry
+    axby = ax.augment("b", "y")
+    by = ctx.augment("b", "y")
+    assert by.get_single_value("p") == "3"
+    assert axby.get_single_value("p") == "2"
+    assert ax.augment("b", "y") is axby
+    assert ctx.augment("a", "x") is not ax  # least recently used, so evicted
+    assert cache.evictions == 2 and len(cache) == 2
+
+    assert ax.augment("b", "y").get_single_value("p") == "2"
+    assert traced[-1].endswith("[a.x > b.y]")
+    assert [str(k) for k in ctx.augment("b", "y").debug_location] == ["b.y"]
+
+    copy = pickle.loads(pickle.dumps(cache))
+    assert copy.max_entries == 2 and len(copy) == 0
+
+
+def test_from_mapping_ignores_key_order():
+    from ccs.search_state import SetAccumulator
+
+    ccs = """
+        a.x b.y { p = 1 }
+        b.y c.z : p = 2
+        a.x { @constrain d.w }
+        d.w c.z : q = 3
+        """
+    dag = load_context(ccs).dag
+    ctx = Context.from_mapping(dag, {"c": "z", "a": "x", "b": "y"})
+    assert Context.from_mapping(dag, {"b": "y", "c": "z", "a": "x"}) is ctx
+    assert ctx.get_single_value("p") == "2"
+    assert ctx.get_single_value("q") == "3"
+    sequential = Context(dag).augment("c", "z").augment("a", "x").augment("b", "y")
+    assert context_state(ctx)[:4] == context_state(sequential)[:4]
+
+    # prefixes are shared with shorter mappings
+    trie = dag.context_tries[(MaxAccumulator, None, False, False)]
+    assert Context.from_mapping(dag, {"a": "x"}) in trie._entries.values()
+    assert trie.hits == 2 and trie.misses == 1
+
+    # without build, only what's already shared is returned
+    assert Context.from_mapping(dag, {"d": "w"}, build=False) is None
+    assert Context.from_mapping(dag, {"b": "y", "c": "z", "a": "x"}, build=False) is ctx
+    assert Context.from_mapping(dag, {"a": "x"}, poisoning=True, build=False) is None
+    assert trie.hits == 3 and trie.misses == 1
+
+    # order matters with poisoning and constraints, so the mapping's order is kept
+    poisoned = Context.from_mapping(dag, {"d": "v", "a": "x"}, poisoning=True)
+    assert [str(k) for k in poisoned.debug_location] == ["d.v", "a.x"]
+    assert poisoned is not Context.from_mapping(dag, {"d": "v", "a": "x"}, poisoning=True)
+    set_ctx = Context.from_mapping(dag, {"b": "y", "a": "x"}, prop_accumulator=SetAccumulator)
+    assert set_ctx.get_single_value("p") == "1"
+    assert [str(k) for k in set_ctx.debug_location] == ["b.y", "a.x"]
+
+    dag.context_trie_size = 2
+    dag.context_tries.clear()
+    Context.from_mapping(dag, {"a": "x", "b": "y", "c": "z"})
+    assert len(dag.context_tries[(MaxAccumulator, None, False, False)]) == 2
+
+
+def test_property_free_root_is_not_reactivated(monkeypatch):
+    ctx = load_context(
+        """
+        @constrain a.x
+        a.x b.y { p = 1 }
+        """
+    )
+    assert len(ctx.props) == 0
+    assert ctx.dag.root_context() is ctx
+    assert Context(ctx.dag).tallies is ctx.tallies
+
+    root_activations = []
+    augment = Context._augment
+
+    def counting_augment(self, steps, *, activate_root=False):
+        root_activations.append(activate_root)
+        return augment(self, steps, activate_root=activate_root)
+
+    monkeypatch.setattr(Context, "_augment", counting_augment)
+    child = ctx.augment("c").augment("d").augment("b", "y")
+    assert child.get_single_value("p") == "1"
+    assert not any(root_activations)
+
+
+def test_lazy_props_match_eager():
+    from ccs.search_state import SetAccumulator
+
+    ccs = """
+        a = 0
+        x.one { a = 1; b = 1 }
+        x.one y.two { a = 2 }
+        y.two : b = 2
+        x.one, y.two : c = 3
+        x.one y.two, z : c = 4
+        z : @override a = 5
+        """
+    for accumulator in (MaxAccumulator, StrictMaxAccumulator):
+        eager = load_context(ccs, prop_accumulator=accumulator)
+        lazy = load_context(ccs, prop_accumulator=accumulator, lazy=True)
+        for steps in [[], [("x", "one")], [("x", "one"), ("y", "two")], [("y", "two"), ("z", None)]]:
+            e, la = eager.augment_many(steps), lazy.augment_many(steps)
+            assert sorted(la.props) == sorted(e.props)
+            for name in ["a", "b", "c", "d"]:
+                try:
+                    expected = e.get_single_value(name)
+                except CcsError as ex:
+                    with pytest.raises(type(ex), match=re.escape(str(ex))):
+                        la.get_single_value(name)
+                else:
+                    assert la.get_single_value(name) == expected
+
+    ctx = load_context(ccs, lazy=True).augment("x", "one")
+    assert ctx.props["a"] is ctx.props["a"]
+    with pytest.raises(ValueError):
+        load_context(ccs, prop_accumulator=SetAccumulator, lazy=True)
+
+
+def test_accumulator_protocol():
+    from ccs.dag import Specificity
+    from ccs.property import Property
+    from ccs.search_state import SetAccumulator
+
+    low, high = Specificity(0, 1, 0, 0), Specificity(0, 2, 0, 0)
+    a, b, c = (Property(v, "-", 0, n) for n, v in enumerate("abc"))
+
+    for accumulator in (MaxAccumulator, StrictMaxAccumulator, SetAccumulator):
+        acc = accumulator().accum(b, high)
+        assert acc.winners() == (b,)
+        # contributions that don't change anything return the same accumulator
+        assert acc.accum(b, high) is acc
+        if accumulator is not SetAccumulator:
+            assert acc.accum(c, low) is acc
+        assert accumulator().winners() == () and accumulator().all() == []
+
+    # a later tie wins for Max and Set, and is ambiguous for Strict
+    assert MaxAccumulator().accum(c, high).accum(a, high).winners() == (c,)
+    assert SetAccumulator().accum(a, high).accum(c, high).winners() == (c,)
+    assert StrictMaxAccumulator().accum(c, high).accum(a, high).winners() == (a, c)
+
+    acc = SetAccumulator().accum(a, low).accum(c, high).accum(b, low)
+    assert acc.winners() == (c,)
+    assert sorted(acc.all(), key=lambda e: e[0].property_number) == [
+        (a, low),
+        (b, low),
+        (c, high),
+    ]
+    assert MaxAccumulator().accum(a, low).accum(b, high).all() == [(b, high)]
+
+
+def trial_suggestions(ctx):
+    """suggest_context the slow way, with a trial augment for every element."""
+    current = set(ctx.props.keys())
+    seen = {(key.name, next(iter(key.values), None)) for key in ctx.debug_location}
+    out = []
+    for name, matcher in ctx.graph.children.items():
+        values = sorted(matcher.positive_values) + ([None] if matcher.wildcard is not None else [])
+        for value in values:
+            if (name, value) not in seen:
+                new = set(ctx.augment(name, value).props.keys()) - current
+                if new:
+                    out.append((name, value, new))
+    return out
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_suggest_context_matches_trial_augments(lazy):
+    from concurrent.futures import ProcessPoolExecutor
+
+    from ccs.search_state import suggest_context
+
+    from test_dag import CONFIGS
+
+    with ProcessPoolExecutor(2) as executor:
+        for ccs in CONFIGS:
+            root = load_context(ccs, lazy=lazy)
+            for ctx in [root, root.augment("a", "x"), root.augment("env", "prod")]:
+                expected = trial_suggestions(ctx)
+                assert suggest_context(ctx) == expected
+                assert suggest_context(ctx, executor=executor) == expected
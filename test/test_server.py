@@ -0,0 +1,216 @@
+import asyncio
+import io
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ccs import protocol
+from ccs.client import AsyncClient, Client, ServerError, _stats
+from ccs.error import AmbiguousPropertyError, MissingPropertyError
+from ccs.protocol import ProtocolError
+from ccs.reload import ConfigHandle
+from ccs.search_state import Context, StrictMaxAccumulator
+from ccs.server import QueryServer
+
+CCS = """
+x = 1
+env.prod { x = 2; db = 'prod-db' }
+env.prod region.eu : x = 3
+region.eu : y = 'a'
+region.eu : y = 'b'
+"""
+
+
+@pytest.fixture
+def serving(tmp_path):
+    servers = []
+
+    def start(config):
+        server = QueryServer(config)
+        path = tmp_path / f"s{len(servers)}.sock"
+        thread = threading.Thread(target=server.run, args=(path,), daemon=True)
+        thread.start()
+        assert server.ready.wait(10)
+        servers.append((server, thread))
+        return path
+
+    yield start
+    for server, thread in servers:
+        server.close()
+        thread.join(10)
+        assert not thread.is_alive()
+
+
+def root():
+    return Context.from_ccs_stream(
+        io.StringIO(CCS), "-", prop_accumulator=StrictMaxAccumulator, lazy=True
+    )
+
+
+def test_queries(serving):
+    with Client(serving(root())) as client:
+        result = client.query({"env": "prod", "region": "eu"}, ["x", "db", "y", "nope"])
+        assert dict(result) == {"x": "3", "db": "prod-db"}
+        assert result.get_single_value("x") == "3"
+        with pytest.raises(AmbiguousPropertyError):
+            result.get_single_value("y")
+        with pytest.raises(MissingPropertyError):
+            result.get_single_value("nope")
+
+        # steps may also be pairs, and a key may be given twice
+        results = client.batch(
+            [([], ["x"]), ([("env", "prod")], ["x"]), ([("env", "dev"), ("env", "prod")], ["x"])]
+        )
+        assert [r["x"] for r in results] == ["1", "2", "2"]
+        assert client.latency.count == 2
+
+
+def test_serves_augmented_context(serving):
+    with Client(serving(root().augment("env", "prod"))) as client:
+        assert dict(client.query({"region": "eu"}, ["x", "db"])) == {"x": "3", "db": "prod-db"}
+        assert client.query([("region", "us"), ("region", "eu")], ["x"])["x"] == "3"
+        assert client.query({}, ["x"])["x"] == "2"
+
+
+def test_contexts_are_shared_between_clients(serving):
+    path = serving(root())
+    with Client(path) as a, Client(path) as b:
+        a.query({"env": "prod", "region": "eu"}, ["x"])
+        before = a.stats()["contexts"]
+        assert b.query({"region": "eu", "env": "prod"}, ["x"])["x"] == "3"
+        after = b.stats()["contexts"]
+        assert after["hits"] == before["hits"] + 1
+        assert after["cached"] == before["cached"]
+
+
+def test_cold_queries_dont_hold_up_cached_ones(tmp_path):
+    with ThreadPoolExecutor(1) as pool, ThreadPoolExecutor(1) as caller:
+        server = QueryServer(root(), executor=pool)
+        path = tmp_path / "s.sock"
+        thread = threading.Thread(target=server.run, args=(path,), daemon=True)
+        thread.start()
+        assert server.ready.wait(10)
+        with Client(path, timeout=10) as client:
+            assert client.query({"env": "prod"}, ["x"])["x"] == "2"
+            # with the server's only worker busy, a query needing a new
+            # context waits, but one whose context is cached doesn't
+            gate = threading.Event()
+            pool.submit(gate.wait)
+            cold = caller.submit(client.query, {"region": "eu"}, ["x"])
+            assert client.query({"env": "prod"}, ["x"])["x"] == "2"
+            assert not cold.done()
+            gate.set()
+            assert cold.result(10)["x"] == "1"
+        server.close()
+        thread.join(10)
+
+
+def test_pipeline(serving):
+    with Client(serving(root()), pool_size=1) as client:
+        queries = [({"env": "prod" if i % 2 else "dev"}, ["x"]) for i in range(200)]
+        results = client.pipeline(queries, depth=8)
+        assert [r["x"] for r in results] == ["2" if i % 2 else "1" for i in range(200)]
+        stats = client.stats()
+        assert stats["requests"] == 201 and stats["queries"] == 200
+        assert stats["latency"]["count"] == 200 and stats["latency"]["p99"] > 0
+
+
+def test_async_client(serving):
+    path = serving(root())
+
+    async def main():
+        async with AsyncClient(path, pool_size=2) as client:
+            results = await asyncio.gather(
+                *(client.query({"env": "prod", "region": "eu"}, ["x"]) for _ in range(50))
+            )
+            assert {r["x"] for r in results} == {"3"}
+            assert len(client._connections) <= 2
+            assert client.latency.count == 50
+            assert (await client.stats())["queries"] == 50
+
+    asyncio.run(main())
+
+
+def test_errors(serving):
+    path = serving(root())
+    with Client(path) as client:
+        with pytest.raises(ServerError, match="unknown op"):
+            client._request(
+                lambda request_id: protocol.FRAME.pack(5) + protocol.REQUEST.pack(request_id, 9),
+                lambda r: None,
+            )
+        with pytest.raises(ServerError, match="truncated"):
+            client._request(
+                lambda request_id: protocol.FRAME.pack(7)
+                + protocol.REQUEST.pack(request_id, protocol.OP_QUERY)
+                + b"\x01\x00",
+                lambda r: None,
+            )
+        # the connection is still good after an error response
+        assert client.query({}, ["x"])["x"] == "1"
+        assert client.stats()["connections"] == 1
+
+        # but not after a response to some other request
+        with pytest.raises(ProtocolError, match="expected"):
+            client._request(lambda request_id: protocol.stats_request(request_id + 1), _stats)
+        assert client._idle == []
+        assert client.query({}, ["x"])["x"] == "1"
+
+    async def mismatched():
+        async with AsyncClient(path) as client:
+            with pytest.raises(ProtocolError, match="expected"):
+                await client._request(
+                    lambda request_id: protocol.stats_request(request_id + 1), _stats
+                )
+            assert all(conn.closed for conn in client._connections)
+            assert (await client.query({}, ["x"]))["x"] == "1"
+
+    asyncio.run(mismatched())
+
+    # a frame too large to accept drops the connection
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.connect(str(path))
+        sock.sendall(protocol.FRAME.pack(protocol.MAX_FRAME + 1))
+        assert sock.recv(1) == b""
+    with Client(path) as client:
+        assert client.stats()["errors"] == 3
+
+
+def test_serves_reloaded_config(serving, tmp_path):
+    main = tmp_path / "main.ccs"
+    main.write_text("env.prod : x = 1\n")
+    handle = ConfigHandle(main, watch=False, lazy=True)
+    with Client(serving(handle)) as client:
+        assert client.query({"env": "prod"}, ["x"])["x"] == "1"
+        main.write_text("env.prod : x = 2\n")
+        assert handle.reload()
+        assert client.query({"env": "prod"}, ["x"])["x"] == "2"
+        assert client.stats()["generation"] == 1
+
+
+def test_stale_socket_is_replaced(serving, tmp_path):
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(str(tmp_path / "s0.sock"))
+    stale.close()
+    path = serving(root())
+    with Client(path) as client:
+        assert client.query({}, ["x"])["x"] == "1"
+    assert os.path.exists(path)
+
+
+def test_shutdown_with_open_connections(tmp_path, caplog):
+    server = QueryServer(root())
+    path = tmp_path / "s.sock"
+    thread = threading.Thread(target=server.run, args=(path,), daemon=True)
+    thread.start()
+    assert server.ready.wait(10)
+    with Client(path) as a, Client(path) as b:
+        a.query({}, ["x"])
+        b.query({}, ["x"])
+        server.close()
+        thread.join(10)
+    assert not thread.is_alive()
+    assert not [r for r in caplog.records if r.name == "asyncio"]
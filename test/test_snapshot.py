@@ -0,0 +1,56 @@
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+import pytest
+
+from ccs.error import AmbiguousPropertyError, CcsError, MissingPropertyError
+from ccs.search_state import Context, SetAccumulator, StrictMaxAccumulator
+
+CCS = """
+    a = 1
+    b = 2.5
+    env.prod { a = 3; c = x }
+    env.prod : c = y
+    """
+
+
+def load(**kwargs):
+    return Context.from_ccs_stream(StringIO(CCS), "-", **kwargs)
+
+
+@pytest.mark.parametrize("accumulator", [None, SetAccumulator, StrictMaxAccumulator])
+def test_snapshot_matches_context(accumulator):
+    kwargs = {"prop_accumulator": accumulator} if accumulator else {}
+    for ctx in (load(**kwargs), load(**kwargs).augment("env", "prod")):
+        snap = ctx.snapshot()
+        assert set(snap) == set(ctx.props)
+        for name in ["a", "b", "c", "d"]:
+            try:
+                expected = ctx.get_single_value(name)
+            except CcsError as e:
+                with pytest.raises(type(e), match=str(e).replace("[", r"\[")):
+                    snap.get_single_value(name)
+            else:
+                assert snap.get_single_value(name) == expected
+        assert snap.try_get_single_value("d", "dflt") == "dflt"
+
+
+def test_snapshot_api():
+    snap = load(prop_accumulator=StrictMaxAccumulator).augment("env", "prod").snapshot()
+    assert snap.get_single_value("b", cast=float) == 2.5
+    assert snap.get_single_property("a").origin.line_number == 4
+    assert isinstance(snap["c"], tuple) and len(snap["c"]) == 2
+    with pytest.raises(AmbiguousPropertyError):
+        snap.get_single_value("c")
+    with pytest.raises(MissingPropertyError):
+        snap.get_single_value("d")
+    assert snap.location == ("env.prod",)
+
+    copy = pickle.loads(pickle.dumps(snap))
+    assert copy.get_single_value("a") == "3" and copy.location == snap.location
+    with pytest.raises(AmbiguousPropertyError):
+        copy.get_single_value("c")
+
+    with ThreadPoolExecutor(4) as pool:
+        assert set(pool.map(lambda _: snap.get_single_value("a"), range(8))) == {"3"}